@@ -0,0 +1,86 @@
+"""详情页解析的基准测试
+
+比较 BeautifulSoup(html.parser) 全量解析与 core.detail_parser 的 lxml 定向提取：
+先确认两者结果一致，再测每页耗时，以及在独立子进程中解析一页时常驻内存峰值的增长
+（lxml 的内存分配在C层，tracemalloc 统计不到；内存测量需要Linux）。
+
+用法：python benchmarks/detail_parser_benchmark.py [--page debug_house_detail.html] [--repeat 20]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import detail_parser
+from core.house_info import HouseInfoProcessor
+
+
+def peak_rss_growth(label, page_path):
+    """在新进程中解析一次，返回常驻内存峰值的增长（字节）"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--page', page_path, '--measure', label],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return int(output.split()[-1])
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def measure(func, page):
+    # 重置峰值（VmHWM），只统计解析本身造成的增长；需要Linux
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before = _status_kb('VmRSS')
+    func(page)
+    print((_status_kb('VmHWM') - before) * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page', default=os.path.join(ROOT, 'debug_house_detail.html'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if detail_parser.lxml_html is None:
+        sys.exit("lxml is not installed")
+    with open(args.page, encoding='utf-8') as f:
+        page = f.read()
+
+    # 不需要浏览器，只调用解析方法
+    processor = HouseInfoProcessor.__new__(HouseInfoProcessor)
+    implementations = {
+        'bs4 html.parser (old)': processor._parse_with_soup,
+        'lxml targeted': detail_parser.parse_detail_page
+    }
+    if args.measure:
+        return measure(implementations[args.measure], page)
+    expected = processor._parse_with_soup(page)
+    if detail_parser.parse_detail_page(page) != expected:
+        sys.exit("lxml result differs from the BeautifulSoup result")
+    print(f"{os.path.basename(args.page)}: {len(page) / 1024:.0f} KB, results identical, "
+          f"{len(expected[2])} sections, {len(expected[1])} images; {args.repeat} rounds")
+
+    baseline = None
+    for label, func in implementations.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            func(page)
+        per_page = (time.perf_counter() - start) / args.repeat
+        peak = peak_rss_growth(label, args.page)
+        baseline = baseline or (per_page, peak)
+        print(f"{label:<22} {per_page * 1e3:7.1f} ms/page ({baseline[0] / per_page:4.1f}x)  "
+              f"peak {peak / 2**20:6.1f} MB ({baseline[1] / peak:4.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
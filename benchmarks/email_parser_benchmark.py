@@ -0,0 +1,113 @@
+"""提醒邮件解析的基准测试
+
+用 benchmarks/fixtures 下保存的提醒邮件比较原来基于 BeautifulSoup(html.parser) 的实现
+与 core.email_parser 的标准库流式解析和 lxml 解析，先确认三者提取的字段一致，再计时。
+
+用法：python benchmarks/email_parser_benchmark.py [--repeat 200] [--fixtures DIR]
+"""
+import argparse
+import email
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from core import email_parser
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_extract_house_info(html_content):
+    """原 EmailHandler.extract_house_info（去掉日志），作为对照"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    title_link = soup.find('a', href=True, string=True)
+    title = title_link.text.strip() if title_link else ''
+    detail_url = title_link['href'] if title_link else ''
+    info_text = soup.get_text()
+    m = re.search(r'([A-Za-z\.\-\'\s]+)\s(\d+[A-Za-z]?),?\s*(\d{4}[A-Z]{2})\s+([A-Za-z ]+)', info_text)
+    if m:
+        full_address = f"{m.group(1).strip()} {m.group(2).strip()}, {m.group(3).strip()} {m.group(4).strip()}"
+    else:
+        full_address = ''
+    address = full_address or (re.search(r'\d{4}[A-Z]{2} [A-Za-z ]+', info_text).group(0) if re.search(r'\d{4}[A-Z]{2} [A-Za-z ]+', info_text) else '')
+    price = re.search(r'€ [\d\.,]+ k\.k\.', info_text)
+    size_rooms = re.search(r'\d+ m² • \d+ m² • \d+ kamers', info_text)
+    agent = re.search(r'[A-Za-z ]+ Makelaardij', info_text)
+    btn = soup.find('a', string=lambda s: s and 'Bekijk details' in s)
+    return {
+        'title': title,
+        'address': address,
+        'price': price.group(0) if price else '',
+        'size_rooms': size_rooms.group(0) if size_rooms else '',
+        'agent': agent.group(0) if agent else '',
+        'url': btn['href'] if btn else detail_url
+    }
+
+
+def load_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.eml'))):
+        with open(path, 'rb') as f:
+            message = email.message_from_bytes(f.read())
+        for part in message.walk():
+            if part.get_content_type() == 'text/html':
+                corpus.append((os.path.basename(path), part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8')))
+                break
+    return corpus
+
+
+def parse_stdlib(html_content):
+    lxml_html, email_parser.lxml_html = email_parser.lxml_html, None
+    try:
+        return email_parser.parse_alert(html_content)
+    finally:
+        email_parser.lxml_html = lxml_html
+
+
+def timed(func, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html_content in corpus:
+            func(html_content)
+    return (time.perf_counter() - start) / (repeat * len(corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--fixtures', default=FIXTURES)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.fixtures)
+    if not corpus:
+        sys.exit(f"No .eml fixtures found in {args.fixtures}")
+
+    implementations = {'bs4 html.parser (old)': legacy_extract_house_info, 'stdlib streaming': parse_stdlib}
+    if email_parser.lxml_html is not None:
+        implementations['lxml'] = email_parser.parse_alert
+
+    # 字段必须与原实现一致
+    for name, html_content in corpus:
+        expected = legacy_extract_house_info(html_content)
+        for label, func in implementations.items():
+            result = func(html_content)
+            mismatched = {k: (v, result.get(k)) for k, v in expected.items() if result.get(k) != v}
+            if mismatched:
+                sys.exit(f"{label} differs from the old parser on {name}: {mismatched}")
+    listings = sum(len(email_parser.parse_alerts(html_content)) for _, html_content in corpus)
+    print(f"{len(corpus)} fixture emails, all parsers agree; {listings} listings incl. digests; {args.repeat} rounds")
+    implementations['parse_alerts (digests)'] = email_parser.parse_alerts
+
+    baseline = None
+    for label, func in implementations.items():
+        per_email = timed(func, corpus, args.repeat)
+        baseline = baseline or per_email
+        print(f"{label:<24} {per_email * 1e6:9.1f} µs/email  {baseline / per_email:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+"""离线回放的端到端基准测试
+
+不连接 Gmail、Makelaarsland、Google Maps、walterliving 和 Twilio，用录制的数据回放完整流程：
+真实的 EmailHandler（IMAP增量同步和按段下载）、HouseInfoProcessor 的详情页抓取和解析、
+MapsService、WOZService、ImmigrationService、publish_to_github（本地git仓库，推送到本地裸仓库）
+以及 WhatsApp 和邮件通知。外部服务由本地替身提供：
+
+- IMAP：内存中的邮箱，邮件由 benchmarks/fixtures 下的提醒邮件改写对象ID和门牌号生成，每套房源都是新的；
+- HTTP：替换 requests 的传输层，详情页返回 debug_house_detail.html，WOZ 和移民指数返回
+  benchmarks/fixtures/replay 下保存的页面，Google Maps 和 Twilio 返回按请求生成的 JSON；
+- SMTP：只序列化邮件、不发送的会话。
+
+每个规模在独立子进程和临时目录中从空状态运行（配置在导入时读取环境变量，各模块的全局状态互不影响），
+报告吞吐量和 utils.metrics 记录的各阶段耗时。并发等参数可以用环境变量调整（如 BATCH_WORKERS），
+--latency 给每次外部请求加上固定延迟以模拟网络往返。
+
+用法：python benchmarks/replay_benchmark.py [--sizes 1,100,10000] [--latency 0.05]
+                                            [--json result.json] [--compare previous.json]
+"""
+import argparse
+import copy
+import email
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.charset import Charset, BASE64, QP
+from urllib.parse import urlsplit, parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+REPLAY_FIXTURES = os.path.join(FIXTURES, 'replay')
+# 用作模板的提醒邮件：先单套房源的提醒，再一封摘要邮件（摘要中的链接都带对象ID）。
+# alert_04 只有邮编没有街道和门牌号，副本会按地址被识别为重复，不适合生成新房源
+TEMPLATE_EMAILS = ('alert_01.eml', 'alert_02.eml', 'alert_03.eml', 'alert_05.eml', 'alert_06.eml', 'digest_07.eml')
+# 报告中各阶段的顺序，其余指标按名称排在后面
+STAGE_ORDER = ('imap_fetch', 'email_parse', 'stage_parsed', 'stage_detailed', 'page_load_http',
+               'stage_enriched', 'maps_geocode', 'maps_distance_matrix', 'maps_directions', 'maps_places',
+               'woz', 'immigration', 'publish', 'publish_update', 'git_commit', 'git_push',
+               'notify_whatsapp', 'notify_email')
+# 随结果一起保存的调优参数，比较两次运行时可以看出配置差异
+TUNING_ENV = ('BATCH_WORKERS', 'ENRICHMENT_WORKERS', 'WHATSAPP_CONCURRENCY', 'GIT_PUSH_WINDOW',
+              'EMAIL_BATCH_WINDOW', 'DIGEST_RATE', 'DIGEST_WINDOW', 'MAPS_CELL_PRECISION', 'STATIONS_FILE')
+
+_OBJECT_ID_RE = re.compile(r'woningdetails/(\d+)')
+
+
+# ---------- 回放数据 ----------
+
+def _html_part(message):
+    for part in message.walk():
+        if part.get_content_type() == 'text/html':
+            return part
+
+
+def load_templates():
+    """读取模板邮件，返回 [(邮件, HTML, [(标题, 对象ID)])]"""
+    from core.email_parser import parse_alerts
+    templates = []
+    for name in TEMPLATE_EMAILS:
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            message = email.message_from_bytes(f.read())
+        part = _html_part(message)
+        html = part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8')
+        listings = [(l['title'], _OBJECT_ID_RE.search(l['url']).group(1)) for l in parse_alerts(html)]
+        templates.append((message, html, listings))
+    return templates
+
+
+def build_mailbox(count):
+    """生成正好包含 count 套不同房源的提醒邮件，保持原邮件的结构和传输编码"""
+    templates = load_templates()
+    messages = []
+    total = 0
+    copies = 0
+    while total < count:
+        for message, html, listings in templates:
+            if total + len(listings) > count:
+                continue
+            for title, object_id in listings:
+                # 门牌号按副本递增，对象ID全局唯一：去重、地理编码和WOZ都会当作新房源
+                total += 1
+                html = html.replace(title, re.sub(r'\d+', str(copies + 1), title, count=1))
+                html = html.replace(f'woningdetails/{object_id}', f'woningdetails/{5000000 + total}')
+            messages.append(_with_html(message, html))
+        copies += 1
+    return messages
+
+
+def _with_html(message, html):
+    message = copy.deepcopy(message)
+    part = _html_part(message)
+    encoding = (part['Content-Transfer-Encoding'] or '8bit').lower()
+    del part['Content-Transfer-Encoding']
+    charset = Charset('utf-8')
+    charset.body_encoding = {'base64': BASE64, 'quoted-printable': QP}.get(encoding)
+    part.set_payload(html, charset)
+    return message
+
+
+# ---------- IMAP ----------
+
+class FakeIMAP:
+    """内存中的IMAP会话，支持 EmailHandler 用到的命令；所有实例共享同一个邮箱"""
+
+    messages = {}
+    capabilities = ('IMAP4REV1', 'IDLE', 'UIDPLUS')
+
+    def __init__(self, host=None, port=None, **kwargs):
+        self.seen = set()
+
+    def login(self, user, password):
+        return 'OK', [b'LOGIN completed']
+
+    def select(self, mailbox='INBOX'):
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [b'1'] if code == 'UIDVALIDITY' else [None]
+
+    def noop(self):
+        return 'OK', [b'NOOP completed']
+
+    def logout(self):
+        return 'BYE', [b'LOGOUT completed']
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            return 'OK', [self._search(args[-1])]
+        if command == 'FETCH':
+            uids = [int(uid) for uid in args[0].split(',')]
+            return 'OK', self._fetch(uids, args[1])
+        if command == 'STORE':
+            self.seen.update(int(uid) for uid in args[0].split(','))
+            return 'OK', []
+        raise NotImplementedError(command)
+
+    def _search(self, query):
+        m = re.search(r'UID (\d+):\*', query)
+        first = int(m.group(1)) if m else 1
+        uids = [uid for uid in sorted(self.messages) if uid >= first] or sorted(self.messages)[-1:]
+        return ' '.join(str(uid) for uid in uids).encode()
+
+    def _fetch(self, uids, items):
+        data = []
+        for i, uid in enumerate(uids, 1):
+            message = self.messages[uid]
+            if items == '(BODYSTRUCTURE)':
+                data.append(f'{i} (UID {uid} BODYSTRUCTURE {_bodystructure(message)})'.encode())
+                continue
+            section = re.search(r'BODY\.PEEK\[([\d.]*)\]', items).group(1)
+            payload = _section(message, section) if section else message.as_bytes()
+            data.append((f'{i} (UID {uid} BODY[{section}] {{{len(payload)}}}'.encode(), payload))
+            data.append(b')')
+        return data
+
+
+def _leaf_bytes(part):
+    return part.get_payload().encode('utf-8', 'surrogateescape')
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        return '(' + ''.join(_bodystructure(sub) for sub in part.get_payload()) + \
+               f' "{part.get_content_subtype().upper()}")'
+    charset = part.get_content_charset()
+    params = f'("CHARSET" "{charset}")' if charset else 'NIL'
+    encoding = (part['Content-Transfer-Encoding'] or '7bit').upper()
+    body = _leaf_bytes(part)
+    lines = body.count(b'\n')
+    return (f'("{part.get_content_maintype().upper()}" "{part.get_content_subtype().upper()}" {params} '
+            f'NIL NIL "{encoding}" {len(body)} {lines})')
+
+
+def _section(message, section):
+    part = message
+    for index in section.split('.'):
+        part = part.get_payload()[int(index) - 1]
+    return _leaf_bytes(part)
+
+
+# ---------- HTTP ----------
+
+def _number(text, low, high):
+    """由文本确定的伪随机数，同一地址每次得到相同的坐标和时间"""
+    digest = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+    return low + (high - low) * digest / 0xFFFFFFFF
+
+
+def _minutes(origin, destination, mode):
+    if mode == 'walking':
+        return round(_number(origin + destination, 4, 35))
+    return round(_number(origin + destination, 18, 140))
+
+
+class ReplayAdapter:
+    """替换 requests 的传输层：按主机返回录制的页面或生成的API响应，并统计请求数"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        with open(os.path.join(ROOT, 'debug_house_detail.html'), 'rb') as f:
+            self.detail_page = f.read()
+        with open(os.path.join(REPLAY_FIXTURES, 'woz_report.html'), 'rb') as f:
+            self.woz_page = f.read()
+        with open(os.path.join(REPLAY_FIXTURES, 'allochtonenmeter.html'), 'rb') as f:
+            self.immigration_page = f.read()
+
+    def send(self, request, **kwargs):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        url = urlsplit(request.url)
+        with self._lock:
+            self.requests[url.hostname] = self.requests.get(url.hostname, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        status, content_type, body = self._route(url, request)
+        response = Response()
+        response.status_code = status
+        response.reason = 'OK' if status < 400 else 'Not Found'
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type, 'Content-Length': str(len(body))})
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+    def _route(self, url, request):
+        host = url.hostname or ''
+        if host.endswith('makelaarsland.nl') and 'woningdetails' in url.path:
+            return 200, 'text/html; charset=utf-8', self.detail_page
+        if host == 'walterliving.com':
+            return 200, 'text/html; charset=utf-8', self.woz_page
+        if host == 'www.allochtonenmeter.nl':
+            return 200, 'text/html; charset=utf-8', self.immigration_page
+        if host == 'maps.googleapis.com':
+            return 200, 'application/json', json.dumps(self._maps(url.path, parse_qs(url.query))).encode()
+        if host == 'api.twilio.com' and url.path.endswith('/Messages.json'):
+            return 201, 'application/json', json.dumps(self._twilio(parse_qs(request.body))).encode()
+        return 404, 'text/plain', b'not recorded'
+
+    @staticmethod
+    def _maps(path, query):
+        if path.endswith('/geocode/json'):
+            address = query['address'][0]
+            # 荷兰兰斯塔德一带的坐标
+            location = {'lat': _number(address, 51.4, 52.6), 'lng': _number(address[::-1], 4.3, 5.9)}
+            return {'status': 'OK', 'results': [{'formatted_address': address, 'geometry': {'location': location}}]}
+        if path.endswith('/distancematrix/json'):
+            origins = query['origins'][0].split('|')
+            destinations = query['destinations'][0].split('|')
+            mode = query.get('mode', ['driving'])[0]
+            rows = []
+            for origin in origins:
+                elements = []
+                for destination in destinations:
+                    minutes = _minutes(origin, destination, mode)
+                    elements.append({
+                        'status': 'OK',
+                        'duration': {'text': f'{minutes} min', 'value': minutes * 60},
+                        'distance': {'text': f'{minutes * (0.08 if mode == "walking" else 0.9):.1f} km',
+                                     'value': minutes * (80 if mode == 'walking' else 900)}
+                    })
+                rows.append({'elements': elements})
+            return {'status': 'OK', 'origin_addresses': origins, 'destination_addresses': destinations, 'rows': rows}
+        if path.endswith('/directions/json'):
+            origin, destination = query['origin'][0], query['destination'][0]
+            minutes = _minutes(origin, destination, query.get('mode', ['driving'])[0])
+            return {'status': 'OK', 'routes': [{'summary': '', 'legs': [{
+                'duration': {'text': f'{minutes} min', 'value': minutes * 60},
+                'distance': {'text': f'{minutes * 0.9:.1f} km', 'value': minutes * 900},
+                'start_address': origin,
+                'end_address': destination
+            }]}]}
+        if path.endswith('/place/nearbysearch/json'):
+            return {'status': 'OK', 'results': [{'name': 'Utrecht Centraal', 'vicinity': 'Stationsplein, Utrecht'}]}
+        return {'status': 'ZERO_RESULTS', 'results': []}
+
+    @staticmethod
+    def _twilio(form):
+        return {
+            'sid': 'SM' + hashlib.md5(repr(sorted(form.items())).encode()).hexdigest(),
+            'status': 'queued',
+            'to': form.get('To', [''])[0],
+            'from': form.get('From', [''])[0],
+            'body': form.get('Body', [''])[0],
+            'num_segments': '1'
+        }
+
+
+# ---------- SMTP ----------
+
+class FakeSMTP:
+    """只把邮件序列化的SMTP会话"""
+
+    sent = 0
+    latency = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self, host='', port=0, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def login(self, user, password):
+        return 235, b'Accepted'
+
+    def send_message(self, message, *args, **kwargs):
+        message.as_bytes()
+        if self.latency:
+            time.sleep(self.latency)
+        with FakeSMTP._lock:
+            FakeSMTP.sent += 1
+        return {}
+
+    def noop(self):
+        return 250, b'OK'
+
+    def quit(self):
+        return 221, b'Bye'
+
+    def close(self):
+        pass
+
+
+# ---------- 单个规模（子进程） ----------
+
+def _git(*args, cwd):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+
+def _prepare_pages_repo(workdir):
+    """GitHub Pages子仓库的替身：本地仓库推送到本地裸仓库"""
+    remote = os.path.join(workdir, 'pages-remote.git')
+    repo = os.path.join(workdir, 'makelaarsland-houses')
+    _git('init', '-q', '--bare', remote, cwd=workdir)
+    _git('init', '-q', repo, cwd=workdir)
+    for name in ('house_template.html', 'index_template.html'):
+        shutil.copy(os.path.join(REPLAY_FIXTURES, name), repo)
+    _git('config', 'user.name', 'replay', cwd=repo)
+    _git('config', 'user.email', 'replay@localhost', cwd=repo)
+    _git('add', '.', cwd=repo)
+    _git('commit', '-q', '-m', 'templates', cwd=repo)
+    _git('remote', 'add', 'origin', remote, cwd=repo)
+    _git('push', '-q', '-u', 'origin', 'HEAD', cwd=repo)
+    return repo
+
+
+def run_size(count, workdir, latency):
+    """在 workdir 中从空状态处理 count 套房源，返回结果字典"""
+    # 配置和日志在导入时读取环境变量和当前目录，必须在导入项目模块之前设置
+    os.chdir(workdir)
+    forced = {
+        'CACHE_FILE': 'cache.sqlite3',
+        'LISTING_INDEX_FILE': 'listing_index.db',
+        'JOB_QUEUE_FILE': 'jobs.db',
+        'IMAP_STATE_FILE': 'imap_state.json',
+        'LISTINGS_DB': 'listings.db',
+        'METRICS_PORT': '0',
+        'DEBUG_DUMP_RATE': '0',
+        'HTTP_DETAIL_FETCH': 'true',
+        'EMAIL': 'replay@localhost',
+        'EMAIL_PASSWORD': 'replay',
+        'GOOGLE_MAPS_API_KEY': 'AIzaReplayBenchmarkKey',
+        'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+        'TWILIO_AUTH_TOKEN': 'replay',
+        'TWILIO_PHONE_NUMBER': '+31600000000'
+    }
+    os.environ.update(forced)
+    for name, value in {
+        'WHATSAPP_RECIPIENTS': '+31600000001,+31600000002',
+        'EMAIL_RECIPIENTS': 'one@localhost,two@localhost',
+        'GIT_PUSH_WINDOW': '2',
+        'EMAIL_BATCH_WINDOW': '0',
+        'DIGEST_WINDOW': '1'
+    }.items():
+        os.environ.setdefault(name, value)
+    repo = _prepare_pages_repo(workdir)
+
+    import imaplib
+    import smtplib
+    import requests
+    adapter = ReplayAdapter(latency)
+    requests.Session.get_adapter = lambda session, url: adapter
+    FakeIMAP.messages = {uid: message for uid, message in enumerate(build_mailbox(count), 1)}
+    imaplib.IMAP4_SSL = FakeIMAP
+    FakeSMTP.latency = latency
+    smtplib.SMTP_SSL = FakeSMTP
+
+    import publish_to_github
+    publish_to_github.REPO_PATH = repo
+    publish_to_github.HOUSE_TEMPLATE = os.path.join(repo, 'house_template.html')
+    publish_to_github.INDEX_TEMPLATE = os.path.join(repo, 'index_template.html')
+    publish_to_github.HOUSES_JSON = os.path.join(repo, 'houses.json')
+    publish_to_github.HOUSES_STORE = os.path.join(repo, 'houses.jsonl')
+    from main import MakelaarslandProcessor
+    from utils.metrics import metrics
+
+    processor = MakelaarslandProcessor()
+    # 会话cookie有效，详情页全部走HTTP，不启动Chrome
+    processor.house_processor.http_fetcher.load_cookies([{'name': 'replay', 'value': '1', 'domain': '.makelaarsland.nl'}])
+    start = time.perf_counter()
+    processed = processor.process_batch()
+    batch_seconds = time.perf_counter() - start
+    # 等待后台的通知和推送全部完成
+    processor.notifier.stop()
+    publish_to_github.stop_push_queue()
+    elapsed = time.perf_counter() - start
+    processor.email_handler.close()
+    processor.enrichment.shutdown()
+    processor.batch_executor.shutdown()
+
+    snapshot = metrics.snapshot()
+    return {
+        'listings': count,
+        'emails': len(FakeIMAP.messages),
+        'jobs': processed,
+        'batch_seconds': batch_seconds,
+        'elapsed': elapsed,
+        'throughput': count / elapsed,
+        'stages': {
+            name: {'count': h['count'], 'mean': h['sum'] / h['count'], 'p50': h['p50'], 'p95': h['p95']}
+            for name, h in snapshot['histograms'].items() if h['count']
+        },
+        'counters': snapshot['counters'],
+        'requests': dict(sorted(adapter.requests.items())),
+        'smtp_messages': FakeSMTP.sent,
+        'queue': processor.job_queue.counts()
+    }
+
+
+# ---------- 报告 ----------
+
+def _ms(seconds):
+    # 分位数超过最大的桶时为None
+    return f"{seconds * 1e3:.1f}" if seconds is not None else '+Inf'
+
+
+def report(result, previous=None):
+    counters = result['counters']
+    print(f"\n== {result['listings']} listing(s) in {result['emails']} email(s): "
+          f"{result['elapsed']:.2f}s ({result['batch_seconds']:.2f}s batch + "
+          f"{result['elapsed'] - result['batch_seconds']:.2f}s draining notifications and pushes), "
+          f"{result['throughput']:.1f} listings/s"
+          + (f" ({result['throughput'] / previous['throughput']:.2f}x previous)" if previous else ''))
+    print(f"   jobs: {result['queue']}; notified {counters.get('jobs_notified', 0)}, "
+          f"skipped {counters.get('jobs_skipped', 0)}, failed {counters.get('jobs_failed', 0)}")
+    print(f"   stand-in requests: {result['requests']}, smtp messages: {result['smtp_messages']}")
+    order = {name: i for i, name in enumerate(STAGE_ORDER)}
+    print(f"   {'stage':<22}{'count':>7}{'mean ms':>10}{'p50<= ms':>10}{'p95<= ms':>10}"
+          + (f"{'speedup':>10}" if previous else ''))
+    for name, stage in sorted(result['stages'].items(), key=lambda item: (order.get(item[0], len(order)), item[0])):
+        line = (f"   {name:<22}{stage['count']:>7}{_ms(stage['mean']):>10}"
+                f"{_ms(stage['p50']):>10}{_ms(stage['p95']):>10}")
+        before = previous and previous['stages'].get(name)
+        if before:
+            line += f"{before['mean'] / stage['mean']:>9.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,100,10000', help="comma separated listing counts")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every stand-in HTTP request and SMTP message")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="results file of an earlier run to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary working directories")
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline's log output")
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        result = run_size(args.run, args.workdir, args.latency)
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = {r['listings']: r for r in json.load(f)['results']}
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        workdir = tempfile.mkdtemp(prefix=f'bouwbot-replay-{size}-')
+        result_path = os.path.join(workdir, 'result.json')
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', str(size), '--workdir', workdir,
+             '--result', result_path, '--latency', str(args.latency)],
+            stdout=None if args.verbose else subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.PIPE, text=True
+        )
+        if completed.returncode != 0:
+            sys.exit(f"Replay of {size} listings failed (logs in {workdir}):\n{completed.stderr or ''}")
+        with open(result_path, encoding='utf-8') as f:
+            result = json.load(f)
+        results.append(result)
+        report(result, previous.get(size))
+        if args.keep:
+            print(f"   working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'latency': args.latency,
+                'env': {name: os.environ[name] for name in TUNING_ENV if name in os.environ},
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import os
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from webdriver_manager.chrome import ChromeDriverManager
+from utils.logging_config import logger
+from utils.metrics import metrics
+
+BASE_URL = "https://mijn.makelaarsland.nl"
+LOGIN_URL = f"{BASE_URL}/inloggen"
+
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def get_chromedriver_path() -> str:
+    """只解析一次chromedriver路径，避免每次都调用ChromeDriverManager().install()"""
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            path = ChromeDriverManager().install()
+            if os.name == 'nt' and not path.endswith("chromedriver.exe"):
+                path = os.path.join(os.path.dirname(path), "chromedriver.exe")
+            _chromedriver_path = path
+        return _chromedriver_path
+
+
+class BrowserSession:
+    """一个长期存活的headless Chrome实例"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.cookie_version = 0
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"[BrowserPool] Error while quitting driver: {str(e)}")
+
+
+class BrowserPool:
+    """已登录Chrome实例池：登录一次，共享cookie，过期自动重新登录，按页数或崩溃回收浏览器"""
+
+    def __init__(self, username: str, password: str, size: int = 1, max_pages: int = 50, timeout: int = 15):
+        self.username = username
+        self.password = password
+        self.size = max(1, size)
+        self.max_pages = max(1, max_pages)
+        self.timeout = timeout
+        # 空闲浏览器（后进先出）和已创建的数量；归还或回收浏览器时唤醒等待的线程
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._login_lock = threading.Lock()
+        # 最近一次登录得到的cookie，新浏览器直接注入而不必再次登录
+        self._cookies = []
+        self._cookie_version = 0
+
+    @metrics.timed('chrome_start')
+    def _create_driver(self):
+        chrome_options = Options()
+        chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        logger.info("[BrowserPool] Starting new headless Chrome...")
+        return webdriver.Chrome(service=Service(get_chromedriver_path()), options=chrome_options)
+
+    def _checkout(self) -> BrowserSession:
+        """取一个空闲浏览器；没有空闲且未达上限时新建，否则等待归还或回收"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                self._cond.wait()
+        try:
+            return BrowserSession(self._create_driver())
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _return(self, session: BrowserSession):
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    def _release_slot(self):
+        # 回收后空出的名额由等待的线程新建浏览器补上
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _discard(self, session: BrowserSession):
+        session.quit()
+        self._release_slot()
+
+    @contextmanager
+    def session(self):
+        """借出一个浏览器会话，用完后归还；出错或达到页数上限时回收"""
+        session = self._checkout()
+        healthy = True
+        try:
+            yield session
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            if healthy and session.pages < self.max_pages:
+                self._return(session)
+            else:
+                reason = 'crashed' if not healthy else f'served {session.pages} pages'
+                logger.info(f"[BrowserPool] Recycling browser ({reason})")
+                self._discard(session)
+
+    def _is_login_page(self, driver) -> bool:
+        return '/inloggen' in driver.current_url
+
+    def _login(self, session: BrowserSession, version_seen: int):
+        """登录并保存cookie；若其他线程已在此期间重新登录，直接复用其cookie"""
+        with self._login_lock:
+            if self._cookie_version != version_seen and self._cookies:
+                self._apply_cookies(session)
+                return
+            driver = session.driver
+            logger.info("[BrowserPool] Logging in to Makelaarsland...")
+            with metrics.timer('login'):
+                driver.get(LOGIN_URL)
+                wait = WebDriverWait(driver, self.timeout)
+                email_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='email']")))
+                password_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='password']")))
+                email_input.send_keys(self.username)
+                password_input.send_keys(self.password)
+                login_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit']")))
+                login_btn.click()
+                wait.until(lambda d: not self._is_login_page(d))
+            self._cookies = driver.get_cookies()
+            self._cookie_version += 1
+            session.cookie_version = self._cookie_version
+            logger.info("[BrowserPool] Login successful")
+
+    def _apply_cookies(self, session: BrowserSession):
+        driver = session.driver
+        # add_cookie要求当前页面与cookie同域
+        if not driver.current_url.startswith(BASE_URL):
+            driver.get(BASE_URL)
+        driver.delete_all_cookies()
+        for cookie in self._cookies:
+            cookie = {k: v for k, v in cookie.items() if k != 'sameSite'}
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException as e:
+                logger.warning(f"[BrowserPool] Could not restore cookie {cookie.get('name')}: {str(e)}")
+        session.cookie_version = self._cookie_version
+
+    def _ensure_authenticated(self, session: BrowserSession):
+        if session.cookie_version == self._cookie_version and session.cookie_version:
+            return
+        if self._cookies:
+            self._apply_cookies(session)
+        else:
+            self._login(session, session.cookie_version)
+
+    @metrics.timed('page_load')
+    def _load(self, driver, url: str):
+        driver.get(url)
+        try:
+            WebDriverWait(driver, self.timeout).until(EC.any_of(
+                EC.presence_of_element_located((By.ID, 'featuresModule')),
+                EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='password']"))
+            ))
+        except TimeoutException:
+            logger.warning(f"[BrowserPool] Timed out waiting for page content: {url}")
+
+    def get_page_source(self, url: str) -> str:
+        """用已登录的浏览器加载页面并返回HTML；会话过期时重新登录一次"""
+        with self.session() as session:
+            self._ensure_authenticated(session)
+            driver = session.driver
+            self._load(driver, url)
+            if self._is_login_page(driver):
+                logger.info("[BrowserPool] Session expired, logging in again")
+                self._login(session, session.cookie_version)
+                self._load(driver, url)
+            session.pages += 1
+            return driver.page_source
+
+    def get_cookies(self) -> list:
+        """返回当前已认证的cookie列表"""
+        return list(self._cookies)
+
+    def close(self):
+        """关闭池内所有空闲浏览器"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._discard(session)
@@ -0,0 +1,147 @@
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    lxml_html = None
+
+# 与 BeautifulSoup get_text() 一致：这些标签内的文本和注释不算正文
+_SKIP_TEXT_TAGS = frozenset(('script', 'style', 'template'))
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+if lxml_html is not None:
+    # 预编译的XPath，只定位需要的几个区块
+    FEATURES_MODULE = etree.XPath('//div[@id="featuresModule"]')
+    FEATURE_NODES = etree.XPath(f'.//h3 | .//div[{_has_class("row")}]')
+    KEY_DIV = etree.XPath(f'.//div[{_has_class("grey")}]')
+    VALUE_DIV = etree.XPath(f'.//div[{_has_class("darkgrey")}]')
+    FALLBACK_HEADINGS = etree.XPath('//h2 | //h3 | //strong')
+    # 与 find_next 一致：先找子孙元素，再找文档中之后的元素
+    NEXT_TABLE = etree.XPath('(descendant::*[self::table or self::dl] | following::*[self::table or self::dl])[1]')
+    TABLE_ROWS = etree.XPath('.//tr')
+    ROW_CELLS = etree.XPath('.//*[self::td or self::th]')
+    TERMS = etree.XPath('.//dt')
+    NEXT_DEFINITION = etree.XPath('(descendant::dd | following::dd)[1]')
+    OBJECT_DETAILS = etree.XPath(f'//div[{_has_class("object-details")}]')
+    MAIN = etree.XPath('//main')
+    IMAGE_LINKS = etree.XPath('//div[@id="links"][1]//a[@href]/@href')
+    MAIN_IMAGE = etree.XPath('//img[@id="myHeightImage"]/@src')
+    AGENT_HEADING = etree.XPath('//h3')
+    AGENT_CARD = etree.XPath(f'ancestor::div[{_has_class("card")}][1]')
+    FIRST_PARAGRAPH = etree.XPath('.//p[1]')
+    PHONE_LINK = etree.XPath('.//a[starts-with(@href, "tel:")]')
+    EMAIL_LINK = etree.XPath('.//a[starts-with(@href, "mailto:")]')
+
+
+def _strings(element):
+    """按文档顺序返回元素内的文本片段（跳过script/style和注释）"""
+    strings = []
+    skip = 0
+    for event, node in etree.iterwalk(element, events=('start', 'end')):
+        is_tag = isinstance(node.tag, str)
+        if event == 'start':
+            if is_tag and node.tag in _SKIP_TEXT_TAGS:
+                skip += 1
+            elif is_tag and not skip and node.text:
+                strings.append(node.text)
+        else:
+            if is_tag and node.tag in _SKIP_TEXT_TAGS:
+                skip -= 1
+            if not skip and node.tail and node is not element:
+                strings.append(node.tail)
+    return strings
+
+
+def _text(element, separator: str = '', strip: bool = False) -> str:
+    """等价于 BeautifulSoup 的 get_text(separator, strip)"""
+    strings = _strings(element)
+    if strip:
+        strings = [s.strip() for s in strings if s.strip()]
+    return separator.join(strings)
+
+
+def _single_string(element):
+    """等价于 BeautifulSoup 的 Tag.string：只有一个子节点时的文本"""
+    children = len(element) + bool(element.text) + sum(1 for child in element if child.tail)
+    if children != 1:
+        return None
+    if element.text:
+        return element.text
+    child = element[0]
+    return _single_string(child) if isinstance(child.tag, str) else None
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def parse_detail_page(page_source: str) -> tuple:
+    """用lxml解析详情页，只按XPath定位参数区块、图片链接、主图和中介卡片
+
+    返回 (details, images, details_sections, agent_info)，与原BeautifulSoup实现的结果一致。
+    """
+    root = lxml_html.fromstring(page_source)
+    details_sections = {}
+
+    # Makelaarsland参数区块：h3为分组标题，div.row中grey/darkgrey为键值
+    features_module = _first(FEATURES_MODULE(root))
+    if features_module is not None:
+        current_section = None
+        for node in FEATURE_NODES(features_module):
+            if node.tag == 'h3':
+                current_section = _text(node, strip=True)
+                details_sections[current_section] = {}
+            else:
+                key_div = _first(KEY_DIV(node))
+                value_div = _first(VALUE_DIV(node))
+                if key_div is not None and value_div is not None and current_section:
+                    details_sections[current_section][_text(key_div, strip=True)] = _text(value_div, strip=True)
+
+    # 兜底：原有h2/h3/strong+table/dl结构
+    if not details_sections:
+        for section in FALLBACK_HEADINGS(root):
+            table = _first(NEXT_TABLE(section))
+            if table is None:
+                continue
+            group = {}
+            for row in TABLE_ROWS(table):
+                cols = ROW_CELLS(row)
+                if len(cols) == 2:
+                    group[_text(cols[0], strip=True)] = _text(cols[1], strip=True)
+            for dt in TERMS(table):
+                dd = _first(NEXT_DEFINITION(dt))
+                if dd is not None:
+                    group[_text(dt, strip=True)] = _text(dd, strip=True)
+            if group:
+                details_sections[_text(section, strip=True)] = group
+
+    # 兼容无结构时的纯文本
+    details_div = _first(OBJECT_DETAILS(root))
+    if details_div is None:
+        details_div = _first(MAIN(root))
+    details = _text(details_div, separator='\n', strip=True) if details_div is not None else _text(root)
+
+    # 图片链接：主图在前，去重
+    images = list(IMAGE_LINKS(root))
+    main_image = _first(MAIN_IMAGE(root))
+    if main_image:
+        images.insert(0, main_image)
+    images = list(dict.fromkeys(images))
+
+    # Verkopend makelaar卡片
+    agent_info = {}
+    heading = next(
+        (h for h in AGENT_HEADING(root) if 'Verkopend makelaar' in (_single_string(h) or '')), None
+    )
+    card = _first(AGENT_CARD(heading)) if heading is not None else None
+    if card is not None:
+        name_p = _first(FIRST_PARAGRAPH(card))
+        phone_a = _first(PHONE_LINK(card))
+        email_a = _first(EMAIL_LINK(card))
+        agent_info['name'] = _text(name_p, strip=True) if name_p is not None else ''
+        agent_info['phone'] = _text(phone_a, strip=True) if phone_a is not None else ''
+        agent_info['email'] = _text(email_a, strip=True) if email_a is not None else ''
+
+    return details, images, details_sections, agent_info
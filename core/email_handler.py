@@ -1,64 +1,336 @@
 import imaplib
 import email
-from email.header import decode_header
-from bs4 import BeautifulSoup
+import base64
+import quopri
+import socket
+import time
 from utils.logging_config import logger
+from utils.metrics import metrics
+from core.imap_state import ImapSyncState
+from core.email_parser import parse_alerts, decode_subject
 import re
 
+IMAP_HOST = "imap.gmail.com"
+SENDER_QUERY = 'FROM "info@makelaarsland.nl"'
+
+# 连接断开时视为可重连的异常
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+_IMAP_TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+_UID_RE = re.compile(rb'UID (\d+)')
+
+def _parse_imap_list(data: bytes) -> list:
+    """把IMAP括号列表（如BODYSTRUCTURE）解析为嵌套的Python列表"""
+    stack = [[]]
+    for m in _IMAP_TOKEN_RE.finditer(data):
+        token = m.group(0)
+        if token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                inner = stack.pop()
+                stack[-1].append(inner)
+        elif token.startswith(b'"'):
+            stack[-1].append(token[1:-1].replace(b'\\"', b'"').decode('utf-8', errors='replace'))
+        elif token.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode('utf-8', errors='replace'))
+    return stack[0]
+
+def _find_html_part(structure: list, section: str = ''):
+    """在BODYSTRUCTURE中查找text/html部分，返回 (段号, 传输编码, 字符集) 或 None"""
+    if structure and isinstance(structure[0], list):
+        # multipart：子部分列表之后是子类型和扩展数据
+        index = 0
+        for sub in structure:
+            if not isinstance(sub, list):
+                break
+            index += 1
+            found = _find_html_part(sub, f"{section}.{index}" if section else str(index))
+            if found:
+                return found
+        return None
+    if len(structure) < 6 or not isinstance(structure[0], str) or not isinstance(structure[1], str):
+        return None
+    if structure[0].lower() == 'text' and structure[1].lower() == 'html':
+        params = structure[2] or []
+        charset = None
+        for key, value in zip(params[::2], params[1::2]):
+            if isinstance(key, str) and key.lower() == 'charset':
+                charset = value
+        encoding = (structure[5] or '7bit').lower()
+        return section or '1', encoding, charset
+    return None
+
+def _decode_part(payload: bytes, encoding: str, charset: str) -> str:
+    if encoding == 'base64':
+        payload = base64.b64decode(payload)
+    elif encoding == 'quoted-printable':
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset if charset else 'utf-8')
+    except (UnicodeDecodeError, LookupError):
+        logger.warning(f"Failed to decode with charset {charset}, trying latin1")
+        return payload.decode('latin1', errors='replace')
+
 class EmailHandler:
-    def __init__(self, email_address: str, email_password: str):
+    def __init__(self, email_address: str, email_password: str, max_backoff: float = 300,
+                 state_file: str = 'imap_state.json'):
         self.email = email_address
         self.password = email_password
+        self.max_backoff = max_backoff
+        # 常驻IMAP连接，避免每个周期都重新握手TLS和登录
+        self._mail = None
+        self._uidvalidity = None
+        # 基于UID的增量同步状态，跨重启保存
+        self.state = ImapSyncState(state_file)
+    
+    def _connect(self):
+        """建立连接，失败时按指数退避重试直到成功"""
+        backoff = 1
+        while True:
+            try:
+                mail = imaplib.IMAP4_SSL(IMAP_HOST)
+                mail.login(self.email, self.password)
+                mail.select("inbox")
+                _, data = mail.response('UIDVALIDITY')
+                self._uidvalidity = data[0].decode() if data and data[0] else None
+                logger.info(f"IMAP connection established (UIDVALIDITY {self._uidvalidity})")
+                return mail
+            except CONNECTION_ERRORS + (imaplib.IMAP4.error,) as e:
+                logger.warning(f"IMAP connection failed: {str(e)}, retrying in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+    
+    def _connection(self):
+        if self._mail is None:
+            self._mail = self._connect()
+        return self._mail
+    
+    def _drop_connection(self):
+        mail, self._mail = self._mail, None
+        if mail is not None:
+            try:
+                mail.logout()
+            except Exception:
+                pass
     
-    def check_email(self):
-        """检查新邮件（仅未读）"""
-        logger.info("Starting email check...")
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(self.email, self.password)
-        mail.select("inbox")
+    def _run(self, command):
+        """在常驻连接上执行命令；连接已断开时重连并重试一次"""
+        try:
+            return command(self._connection())
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"IMAP connection lost: {str(e)}, reconnecting")
+            self._drop_connection()
+            return command(self._connection())
+    
+    def supports_idle(self) -> bool:
+        return 'IDLE' in self._run(lambda mail: mail.capabilities)
+    
+    def wait_for_new_mail(self, timeout: float = 300) -> bool:
+        """用IMAP IDLE等待新邮件；收到 EXISTS 通知返回True，超时返回False"""
+        try:
+            return self._idle(self._connection(), timeout)
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"IMAP IDLE interrupted: {str(e)}, reconnecting")
+            self._drop_connection()
+            return True
+    
+    def _idle(self, mail, timeout: float) -> bool:
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response!r}")
         
-        # 搜索来自 info@makelaarsland.nl 的未读邮件
-        _, messages = mail.search(None, '(UNSEEN FROM "info@makelaarsland.nl")')
-        logger.info(f"Found {len(messages[0].split())} unread emails")
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._wait_readable(mail, remaining):
+                break
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if line.rstrip().endswith(b'EXISTS'):
+                new_mail = True
+                break
         
-        for num in messages[0].split():
-            logger.info(f"Processing email #{num.decode()}")
-            _, msg = mail.fetch(num, '(RFC822)')
-            email_body = msg[0][1]
-            email_message = email.message_from_bytes(email_body)
-            
-            # 打印邮件基本信息
-            subject = decode_header(email_message["subject"])[0][0]
-            if isinstance(subject, bytes):
-                subject = subject.decode()
-            logger.info(f"Email subject: {subject}")
-            logger.info(f"From: {email_message['from']}")
-            logger.info(f"Date: {email_message['date']}")
-            
-            # 处理邮件内容
-            yield self.process_email(email_message)
-            
-            # 标记为已读
-            mail.store(num, '+FLAGS', '\\Seen')
-            logger.info(f"Email #{num.decode()} processed and marked as read")
+        # 结束IDLE，读到本次命令的带标签应答为止
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+        return new_mail
+    
+    @staticmethod
+    def _wait_readable(mail, timeout: float) -> bool:
+        """等待下一条应答，超时返回False
+        
+        imaplib 通过带缓冲的 mail.file 读取，已读进缓冲区的应答在socket上select不到，
+        所以用 peek 等待：缓冲区有数据时立即返回，否则在超时内等待socket上的数据。
+        """
+        previous = mail.sock.gettimeout()
+        mail.sock.settimeout(timeout)
+        try:
+            mail.file.peek(1)
+            return True
+        except socket.timeout:
+            # 超时的读取没有取走数据，但文件对象此后不能再读，换一个新的
+            mail.file.close()
+            mail.file = mail.sock.makefile('rb')
+            return False
+        finally:
+            mail.sock.settimeout(previous)
+    
+    def fetch_new_batch(self) -> list:
+        """增量取回新邮件并解析，返回 [(UID, [房屋信息])]；不会标记为已读
+        
+        有同步状态时按UID高水位搜索，与邮件是否已读无关；首次运行或UIDVALIDITY变化时只取UNSEEN邮件，
+        邮箱中其余的邮件记为已处理。
+        只下载每封邮件的text/html部分，而不是整封RFC822邮件。
+        """
+        logger.debug("Starting batch email check...")
+        
+        def search(mail):
+            # NOOP 让服务器推送新到达的邮件，同时检测连接是否存活
+            mail.noop()
+            if not self.state.is_valid(self._uidvalidity):
+                _, data = mail.uid('SEARCH', None, f'(UNSEEN {SENDER_QUERY})')
+                unseen = sorted(int(uid) for uid in data[0].split())
+                self._reset_state(mail, unseen)
+                return unseen
+            _, data = mail.uid('SEARCH', None, f'(UID {self.state.last_uid + 1}:* {SENDER_QUERY})')
+            # "n:*" 总会包含最后一封邮件，需要再按高水位过滤
+            return [int(uid) for uid in data[0].split() if self.state.is_pending(int(uid))]
+        
+        with metrics.timer('imap_fetch'):
+            uids = self._run(search)
+            if not uids:
+                return []
+            html_by_uid, messages_by_uid = self._run(lambda mail: self._fetch_html_parts(mail, uids))
+        logger.info(f"Found {len(uids)} new emails")
         
-        mail.close()
-        mail.logout()
-        logger.info("Email check completed")
-    
-    def process_email(self, email_message):
-        """处理邮件内容"""
-        subject = decode_header(email_message["subject"])[0][0]
-        if isinstance(subject, bytes):
-            subject = subject.decode()
-        logger.info(f"Starting to process email content: {subject}")
+        results = []
+        for uid in uids:
+            try:
+                with metrics.timer('email_parse'):
+                    if uid in html_by_uid:
+                        listings = self.extract_listings(html_by_uid[uid])
+                    elif uid in messages_by_uid:
+                        listings = self.process_email(messages_by_uid[uid]) or []
+                    else:
+                        listings = []
+            except Exception as e:
+                logger.error(f"Error extracting house info from UID {uid}: {str(e)}")
+                listings = []
+            results.append((uid, listings))
+        metrics.inc('emails', len(results))
+        metrics.inc('listings', sum(len(l) for _, l in results))
+        logger.info(f"Parsed {len(results)} emails with {sum(len(l) for _, l in results)} listings in batch")
+        return results
+    
+    def _reset_state(self, mail, unseen: list) -> None:
+        """首次运行或UIDVALIDITY变化时，把邮箱中已有的邮件都记为已处理，只有本次的UNSEEN邮件待处理
+
+        高水位不能停在0：否则下一个周期会按 "UID 1:*" 搜索，重新处理全部历史提醒。
+        """
+        if unseen:
+            # 第一封未读邮件之前的都已处理；之后的已读提醒逐个记为已处理
+            _, data = mail.uid('SEARCH', None, f'(UID {unseen[0]}:* {SENDER_QUERY})')
+            done = {int(uid) for uid in data[0].split()} - set(unseen)
+            self.state.reset(self._uidvalidity, unseen[0] - 1, done)
+            return
+        # "UID *" 匹配邮箱中UID最大的邮件
+        _, data = mail.uid('SEARCH', None, 'UID *')
+        uids = [int(uid) for uid in data[0].split()] if data and data[0] else []
+        self.state.reset(self._uidvalidity, max(uids, default=0))
+    
+    def _fetch_html_parts(self, mail, uids: list) -> dict:
+        """先取BODYSTRUCTURE定位HTML部分，再只下载该部分；结构无法解析时下载整封邮件
+        
+        返回 ({UID: HTML}, {UID: 整封邮件})
+        """
+        uid_set = ','.join(str(uid) for uid in uids)
+        _, data = mail.uid('FETCH', uid_set, '(BODYSTRUCTURE)')
+        
+        sections = {}
+        for item in data:
+            line = item[0] if isinstance(item, tuple) else item
+            if not line or isinstance(item, tuple):
+                # 含literal的结构少见，交给整封下载处理
+                continue
+            uid_match = _UID_RE.search(line)
+            if not uid_match:
+                continue
+            parsed = _parse_imap_list(line)
+            fields = parsed[1] if len(parsed) > 1 and isinstance(parsed[1], list) else []
+            for key, value in zip(fields[::2], fields[1::2]):
+                if key == 'BODYSTRUCTURE' and isinstance(value, list):
+                    html_part = _find_html_part(value)
+                    if html_part:
+                        sections[int(uid_match.group(1))] = html_part
+        
+        html_by_uid = {}
+        by_section = {}
+        for uid, (section, encoding, charset) in sections.items():
+            by_section.setdefault(section, []).append(uid)
+        for section, section_uids in by_section.items():
+            # BODY.PEEK 不会隐式设置 \Seen，处理成功后再单独标记
+            _, data = mail.uid('FETCH', ','.join(str(uid) for uid in section_uids), f'(BODY.PEEK[{section}])')
+            for item in data:
+                if not isinstance(item, tuple):
+                    continue
+                uid_match = _UID_RE.search(item[0])
+                if uid_match:
+                    uid = int(uid_match.group(1))
+                    _, encoding, charset = sections[uid]
+                    html_by_uid[uid] = _decode_part(item[1], encoding, charset)
+        
+        messages_by_uid = {}
+        missing = [uid for uid in uids if uid not in html_by_uid]
+        if missing:
+            logger.info(f"Falling back to full message fetch for {len(missing)} emails")
+            _, data = mail.uid('FETCH', ','.join(str(uid) for uid in missing), '(BODY.PEEK[])')
+            for item in data:
+                if not isinstance(item, tuple):
+                    continue
+                uid_match = _UID_RE.search(item[0])
+                if uid_match:
+                    messages_by_uid[int(uid_match.group(1))] = email.message_from_bytes(item[1])
+        return html_by_uid, messages_by_uid
+    
+    def commit(self, uid: int, pending: list) -> None:
+        """记录一封邮件已处理完成，推进持久化的UID高水位"""
+        self.state.commit(uid, pending)
+    
+    def mark_seen(self, uids: list) -> None:
+        """批量把邮件标记为已读（仅供邮件客户端查看，同步不依赖该标记）"""
+        if not uids:
+            return
+        self._run(lambda mail: mail.uid('STORE', ','.join(str(uid) for uid in uids), '+FLAGS', '\\Seen'))
+        logger.info(f"Marked {len(uids)} emails as read")
+    
+    def close(self):
+        """关闭常驻连接"""
+        self._drop_connection()
+    
+    def process_email(self, email_message, subject: str = None):
+        """处理邮件内容，返回其中的房源列表；subject 为调用方已解码的主题"""
+        if subject is None:
+            subject = decode_subject(email_message)
+        logger.debug(f"Starting to process email content: {subject}")
             
         if email_message.is_multipart():
-            logger.info("Detected multipart email")
+            logger.debug("Detected multipart email")
             for part in email_message.walk():
                 content_type = part.get_content_type()
                 content_transfer_encoding = part.get('Content-Transfer-Encoding', '').lower()
-                logger.info(f"Processing email part - Type: {content_type}, Encoding: {content_transfer_encoding}")
+                logger.debug(f"Processing email part - Type: {content_type}, Encoding: {content_transfer_encoding}")
                 
                 # 处理 text/html 内容
                 if content_type == "text/html":
@@ -68,14 +340,14 @@ class EmailHandler:
                         
                         # 尝试确定字符集
                         charset = part.get_content_charset()
-                        logger.info(f"Detected charset: {charset}")
+                        logger.debug(f"Detected charset: {charset}")
                         
                         # 根据编码解码内容
                         if content_transfer_encoding == 'base64':
-                            logger.info("Detected Base64 encoded content")
+                            logger.debug("Detected Base64 encoded content")
                             try:
                                 html_content = payload.decode(charset if charset else 'utf-8')
-                                logger.info("Base64 content decoded successfully")
+                                logger.debug("Base64 content decoded successfully")
                             except UnicodeDecodeError:
                                 logger.warning(f"Failed to decode with charset {charset}, trying latin1")
                                 html_content = payload.decode('latin1', errors='replace')
@@ -83,94 +355,36 @@ class EmailHandler:
                             # 对于非base64内容，尝试使用指定的字符集解码
                             try:
                                 html_content = payload.decode(charset if charset else 'utf-8')
-                                logger.info("Content decoded successfully")
+                                logger.debug("Content decoded successfully")
                             except UnicodeDecodeError:
                                 logger.warning(f"Failed to decode with charset {charset}, trying latin1")
                                 html_content = payload.decode('latin1', errors='replace')
                         
                         # 处理解码后的HTML内容
-                        logger.info("Starting to extract house information...")
-                        return self.extract_house_info(html_content)
+                        logger.debug("Starting to extract house information...")
+                        return self.extract_listings(html_content)
                         
                     except Exception as e:
                         logger.error(f"Error processing email part: {str(e)}")
                         continue
         else:
-            logger.info("Detected single part email")
+            logger.debug("Detected single part email")
             try:
                 payload = email_message.get_payload(decode=True)
                 charset = email_message.get_content_charset()
-                logger.info(f"Single part email charset: {charset}")
+                logger.debug(f"Single part email charset: {charset}")
                 html_content = payload.decode(charset if charset else 'utf-8')
-                return self.extract_house_info(html_content)
+                return self.extract_listings(html_content)
             except Exception as e:
                 logger.error(f"Error processing single part email: {str(e)}")
                 return None
     
-    def extract_house_info(self, html_content):
-        """从HTML内容中提取房屋信息"""
-        logger.info("Starting HTML content parsing...")
-        soup = BeautifulSoup(html_content, 'html.parser')
-
-        # 1. 标题和详情页链接
-        title_link = soup.find('a', href=True, string=True)
-        title = title_link.text.strip() if title_link else ''
-        detail_url = title_link['href'] if title_link else ''
-        logger.info(f"Extracted title: {title}")
-        logger.info(f"Detail page URL: {detail_url}")
-
-        # 2. 地址、价格、面积、房间数、中介
-        info_text = soup.get_text()
-        logger.info("Starting address extraction...")
-        
-        # 提取街道、门牌号、邮编、城市
-        street = ''
-        house_number = ''
-        postcode = ''
-        city = ''
-        # 匹配模式如 "H. Diemerstraat 37, 3555GR Utrecht"
-        m = re.search(r'([A-Za-z\.\-\'\s]+)\s(\d+[A-Za-z]?),?\s*(\d{4}[A-Z]{2})\s+([A-Za-z ]+)', info_text)
-        if m:
-            street = m.group(1).strip()
-            house_number = m.group(2).strip()
-            postcode = m.group(3).strip()
-            city = m.group(4).strip()
-            full_address = f"{street} {house_number}, {postcode} {city}"
-            logger.info(f"Successfully matched address: {full_address}")
-        else:
-            logger.warning("Failed to match complete address format")
-            full_address = ''
-            
-        address = full_address or (re.search(r'\d{4}[A-Z]{2} [A-Za-z ]+', info_text).group(0) if re.search(r'\d{4}[A-Z]{2} [A-Za-z ]+', info_text) else '')
-        logger.info(f"Final address: {address}")
-        
-        price = re.search(r'€ [\d\.,]+ k\.k\.', info_text)
-        price = price.group(0) if price else ''
-        logger.info(f"Price: {price}")
-        
-        size_rooms = re.search(r'\d+ m² • \d+ m² • \d+ kamers', info_text)
-        size_rooms = size_rooms.group(0) if size_rooms else ''
-        logger.info(f"Size and rooms: {size_rooms}")
-        
-        agent = re.search(r'[A-Za-z ]+ Makelaardij', info_text)
-        agent = agent.group(0) if agent else ''
-        logger.info(f"Agent: {agent}")
-
-        # 3. 图片
-        img_url = ''
-
-        # 4. "Bekijk details"按钮
-        btn = soup.find('a', string=lambda s: s and 'Bekijk details' in s)
-        btn_url = btn['href'] if btn else detail_url
-
-        return {
-            'title': title,
-            'address': address,
-            'price': price,
-            'size_rooms': size_rooms,
-            'agent': agent,
-            'images': [],
-            'url': btn_url,
-            'details': '',
-            'nearest_station': {}
-        } 
\ No newline at end of file
+    def extract_listings(self, html_content) -> list:
+        """从HTML内容中提取所有房屋信息；摘要邮件会返回多套房源"""
+        listings = parse_alerts(html_content)
+        for house_data in listings:
+            logger.debug(f"Parsed alert: {house_data['title']} | {house_data['address'] or 'no address'} | {house_data['price'] or 'no price'}")
+            logger.debug(f"Alert fields: {house_data}")
+        if len(listings) > 1:
+            logger.info(f"Digest email with {len(listings)} listings")
+        return listings
@@ -0,0 +1,243 @@
+import re
+from email.header import decode_header, make_header
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    lxml_html = None
+
+# 所有模式只编译一次
+ADDRESS_RE = re.compile(r'([A-Za-z\.\-\'\s]+)\s(\d+[A-Za-z]?),?\s*(\d{4}[A-Z]{2})\s+([A-Za-z ]+)')
+POSTCODE_CITY_RE = re.compile(r'\d{4}[A-Z]{2} [A-Za-z ]+')
+PRICE_RE = re.compile(r'€ [\d\.,]+ k\.k\.')
+SIZE_ROOMS_RE = re.compile(r'\d+ m² • \d+ m² • \d+ kamers')
+AGENT_RE = re.compile(r'[A-Za-z ]+ Makelaardij')
+DETAILS_BUTTON_TEXT = 'Bekijk details'
+OBJECT_ID_RE = re.compile(r'woningdetails/(\d+)')
+
+# 这些标签内的文本不属于 get_text() 的结果
+_SKIP_TEXT_TAGS = frozenset(('script', 'style', 'template'))
+_VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'
+))
+
+
+def decode_subject(message) -> str:
+    """解码邮件主题（可能由多段不同编码组成）"""
+    subject = message['subject']
+    if not subject:
+        return ''
+    try:
+        return str(make_header(decode_header(subject)))
+    except (UnicodeDecodeError, LookupError):
+        return str(subject)
+
+
+class _AlertTokenizer(HTMLParser):
+    """单遍扫描HTML：同时收集正文文本和所有带href的链接
+
+    链接文本按 BeautifulSoup 的 Tag.string 规则计算：只有一个子节点时取该子节点的文本，否则为None。
+    每个链接同时记录它在正文文本中的起始位置，用于把摘要邮件切分成多个房源。
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self.length = 0
+        self.links = []
+        # 栈中每一帧：[标签, href, 子节点数, 唯一子节点的string, 在links中的位置]
+        self._stack = []
+        self._skip = 0
+
+    def _add_child(self, string=None):
+        if self._stack:
+            frame = self._stack[-1]
+            frame[2] += 1
+            frame[3] = string
+
+    def handle_starttag(self, tag, attrs):
+        self._add_child()
+        if tag in _VOID_TAGS:
+            return
+        href = dict(attrs).get('href') if tag == 'a' else None
+        index = None
+        if tag == 'a':
+            index = len(self.links)
+            self.links.append((href, None, self.length))
+        self._stack.append([tag, href, 0, None, index])
+        if tag in _SKIP_TEXT_TAGS:
+            self._skip += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._add_child()
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or not any(frame[0] == tag for frame in self._stack):
+            return
+        while self._stack:
+            name, href, children, string, index = self._stack.pop()
+            if name in _SKIP_TEXT_TAGS:
+                self._skip -= 1
+            string = string if children == 1 else None
+            if index is not None:
+                self.links[index] = (href, string, self.links[index][2])
+            if self._stack and self._stack[-1][2] == 1:
+                self._stack[-1][3] = string
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        self._add_child(data)
+        if not self._skip:
+            self.text.append(data)
+            self.length += len(data)
+
+    def handle_comment(self, data):
+        self._add_child()
+
+    def close(self):
+        super().close()
+        # 未闭合的标签（包括链接）在文档结束时关闭
+        while self._stack:
+            self.handle_endtag(self._stack[-1][0])
+
+
+def _tokenize_stdlib(html_content: str) -> tuple:
+    tokenizer = _AlertTokenizer()
+    tokenizer.feed(html_content)
+    tokenizer.close()
+    return ''.join(tokenizer.text), tokenizer.links
+
+
+def _lxml_string(element):
+    """lxml元素按 Tag.string 规则的文本"""
+    children = len(element) + bool(element.text) + sum(1 for child in element if child.tail)
+    if children != 1:
+        return None
+    if element.text:
+        return element.text
+    child = element[0]
+    return _lxml_string(child) if isinstance(child.tag, str) else None
+
+
+def _tokenize_lxml(html_content: str) -> tuple:
+    root = lxml_html.fromstring(html_content)
+    text = []
+    length = 0
+    links = []
+    skip = 0
+    for event, element in etree.iterwalk(root, events=('start', 'end')):
+        is_tag = isinstance(element.tag, str)
+        if event == 'start':
+            if is_tag and element.tag == 'a':
+                links.append((element.get('href'), _lxml_string(element), length))
+            if is_tag and element.tag in _SKIP_TEXT_TAGS:
+                skip += 1
+            elif is_tag and not skip and element.text:
+                text.append(element.text)
+                length += len(element.text)
+        else:
+            if is_tag and element.tag in _SKIP_TEXT_TAGS:
+                skip -= 1
+            # tail属于父元素，根元素的tail不在文档内
+            if not skip and element.tail and element is not root:
+                text.append(element.tail)
+                length += len(element.tail)
+    return ''.join(text), links
+
+
+def tokenize(html_content: str) -> tuple:
+    """返回 (正文文本, [(href, 链接文本, 在正文中的位置)])；安装了lxml时使用lxml，否则使用标准库的流式解析"""
+    if lxml_html is not None:
+        try:
+            return _tokenize_lxml(html_content)
+        except (etree.ParserError, ValueError):
+            pass
+    return _tokenize_stdlib(html_content)
+
+
+def _listing_from(text: str, links: list) -> dict:
+    """从一段正文及其中的链接提取一套房源的信息"""
+    # 1. 标题和详情页链接：第一个只含文本的链接
+    title, detail_url = '', ''
+    for href, string, _ in links:
+        if href is not None and string:
+            title, detail_url = string.strip(), href
+            break
+
+    # 2. 地址、价格、面积、房间数、中介
+    street = house_number = postcode = city = ''
+    m = ADDRESS_RE.search(text)
+    if m:
+        street = m.group(1).strip()
+        house_number = m.group(2).strip()
+        postcode = m.group(3).strip()
+        city = m.group(4).strip()
+        address = f"{street} {house_number}, {postcode} {city}"
+    else:
+        m = POSTCODE_CITY_RE.search(text)
+        address = m.group(0) if m else ''
+
+    price = PRICE_RE.search(text)
+    size_rooms = SIZE_ROOMS_RE.search(text)
+    agent = AGENT_RE.search(text)
+
+    # 3. "Bekijk details"按钮，没有时使用标题链接
+    btn_url = next(
+        (href for href, string, _ in links if string and DETAILS_BUTTON_TEXT in string and href is not None),
+        detail_url
+    )
+
+    return {
+        'title': title,
+        'address': address,
+        'postcode': postcode,
+        'city': city,
+        'price': price.group(0) if price else '',
+        'size_rooms': size_rooms.group(0) if size_rooms else '',
+        'agent': agent.group(0) if agent else '',
+        'images': [],
+        'url': btn_url,
+        'details': '',
+        'nearest_station': {}
+    }
+
+
+def _segments(text: str, links: list) -> list:
+    """把摘要邮件切分成每套房源的 (起始位置, 结束位置)
+
+    优先按详情页链接中的对象ID切分：每出现一个新ID开始一段；链接中没有对象ID时
+    （例如经过跳转的追踪链接），按"Bekijk details"按钮切分：每个按钮结束一段。
+    """
+    starts = []
+    seen = set()
+    for href, _, offset in links:
+        m = OBJECT_ID_RE.search(href or '')
+        if m and m.group(1) not in seen:
+            seen.add(m.group(1))
+            starts.append(offset)
+    if len(starts) > 1:
+        return list(zip(starts, starts[1:] + [len(text)]))
+
+    ends = [offset + len(string) for _, string, offset in links if string and DETAILS_BUTTON_TEXT in string]
+    if len(ends) > 1:
+        return list(zip([0] + ends[:-1], ends))
+    return [(0, len(text))]
+
+
+def parse_alerts(html_content: str) -> list:
+    """从提醒邮件HTML中提取所有房源；摘要邮件包含多套房源，普通提醒只有一套"""
+    text, links = tokenize(html_content)
+    listings = []
+    for start, end in _segments(text, links):
+        block_links = [link for link in links if start <= link[2] < end]
+        listing = _listing_from(text[start:end], block_links)
+        if listing['url'] or listing['address']:
+            listings.append(listing)
+    return listings
+
+
+def parse_alert(html_content: str) -> dict:
+    """从只含一套房源的提醒邮件中提取房屋信息；所有字段共用一次文本提取"""
+    return _listing_from(*tokenize(html_content))
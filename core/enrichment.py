@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Tuple
+from utils.logging_config import logger
+
+
+@dataclass
+class EnrichmentTask:
+    func: Callable
+    args: Tuple = ()
+    timeout: float = 30
+    # 超时或出错时使用的降级结果
+    default: Any = None
+    kwargs: Dict = field(default_factory=dict)
+
+
+class EnrichmentPipeline:
+    """并发执行互不依赖的查询（详情页、地图、WOZ、移民指数、Huispedia），每个查询独立超时并降级"""
+
+    def __init__(self, max_workers: int = 8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='enrich')
+
+    def run(self, tasks: Dict[str, EnrichmentTask], started: Dict[str, Future] = None) -> Dict[str, Any]:
+        """同时提交所有任务，返回 {任务名: 结果}；总耗时约等于最慢的单个任务
+
+        started 为 prefetch 返回的进行中的查询，同名任务直接等待它们，不再重复调用。
+        """
+        start = time.monotonic()
+        started = started or {}
+        futures = {
+            name: started[name] if name in started else self.executor.submit(task.func, *task.args, **task.kwargs)
+            for name, task in tasks.items()
+        }
+
+        results = {}
+        for name, future in futures.items():
+            task = tasks[name]
+            remaining = max(0.0, start + task.timeout - time.monotonic())
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                # 线程无法被强制终止，只是不再等待它的结果
+                future.cancel()
+                logger.warning(f"[Enrichment] {name} timed out after {task.timeout}s, using fallback")
+                results[name] = task.default
+            except Exception as e:
+                logger.error(f"[Enrichment] {name} failed: {str(e)}")
+                results[name] = task.default
+
+        logger.info(f"[Enrichment] {len(tasks)} lookups finished in {time.monotonic() - start:.2f}s")
+        return results
+
+    def prefetch(self, tasks: Dict[str, EnrichmentTask]) -> Dict[str, Future]:
+        """在后台开始查询但不等待结果，返回 {任务名: Future}，之后交给 run 的 started 参数"""
+        return {name: self.executor.submit(task.func, *task.args, **task.kwargs) for name, task in tasks.items()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
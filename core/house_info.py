@@ -1,58 +1,80 @@
-import os
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
-import time
+import os
+import random
 import re
+from datetime import datetime
 from utils.logging_config import logger
 from models.house import HouseInfo
+from core.browser_pool import BrowserPool
+from core.http_fetcher import HttpDetailFetcher
+from core import detail_parser
+from core.listing_index import object_id_from_url
 
 class HouseInfoProcessor:
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, pool_size: int = 1, max_pages: int = 50, http_fetch: bool = True,
+                 debug_dump_rate: float = 0.0, debug_dump_dir: str = 'debug_pages'):
         self.username = username
         self.password = password
+        self.browser_pool = BrowserPool(username, password, size=pool_size, max_pages=max_pages)
+        # HTTP模式：cookie有效时直接请求静态页面，只有缺少featuresModule时才回退到浏览器
+        self.http_fetcher = HttpDetailFetcher() if http_fetch else None
+        # 按比例抽样保存原始详情页，用于排查解析问题；默认关闭
+        self.debug_dump_rate = debug_dump_rate
+        self.debug_dump_dir = debug_dump_dir
     
     def get_house_details(self, url: str) -> tuple:
         """获取房屋详细信息"""
-        chrome_options = Options()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chromedriver_path = ChromeDriverManager().install()
-        if not chromedriver_path.endswith("chromedriver.exe"):
-            chromedriver_path = os.path.join(os.path.dirname(chromedriver_path), "chromedriver.exe")
-            
-        driver = webdriver.Chrome(service=Service(chromedriver_path), options=chrome_options)
+        page_source = None
+        if self.http_fetcher:
+            page_source = self.http_fetcher.fetch(url)
+            if page_source:
+                logger.info(f"Fetched house details over HTTP: {url}")
+        
+        if not page_source:
+            try:
+                page_source = self.browser_pool.get_page_source(url)
+            except Exception as e:
+                logger.error(f"Error in get_house_details: {str(e)}")
+                return "", [], {}, {}
+            # 浏览器登录后的cookie同步给HTTP模式
+            if self.http_fetcher:
+                self.http_fetcher.load_cookies(self.browser_pool.get_cookies())
+        
+        self._maybe_dump(url, page_source)
+        return self.parse_house_details(page_source)
+    
+    def _maybe_dump(self, url: str, page_source: str) -> None:
+        if not self.debug_dump_rate or random.random() >= self.debug_dump_rate:
+            return
+        try:
+            os.makedirs(self.debug_dump_dir, exist_ok=True)
+            name = object_id_from_url(url) or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            path = os.path.join(self.debug_dump_dir, f"house_detail_{name}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(page_source)
+            logger.debug(f"Saved detail page to {path}")
+        except OSError as e:
+            logger.warning(f"Could not save detail page: {str(e)}")
+    
+    def parse_house_details(self, page_source: str) -> tuple:
+        """解析房屋详情页HTML；安装了lxml时只按XPath提取需要的区块"""
+        if detail_parser.lxml_html is not None:
+            try:
+                return detail_parser.parse_detail_page(page_source)
+            except Exception as e:
+                logger.error(f"Error in parse_house_details: {str(e)}")
+                return "", [], {}, {}
+        return self._parse_with_soup(page_source)
+    
+    def _parse_with_soup(self, page_source: str) -> tuple:
+        """未安装lxml时使用BeautifulSoup解析"""
         details = ""
         images = []
         details_sections = {}
         agent_info = {}
         
         try:
-            # 登录 Makelaarsland
-            driver.get("https://mijn.makelaarsland.nl/inloggen")
-            wait = WebDriverWait(driver, 15)
-            email_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='email']")))
-            password_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='password']")))
-            email_input.send_keys(self.username)
-            password_input.send_keys(self.password)
-            login_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit']")))
-            login_btn.click()
-            time.sleep(3)
-            
-            # 访问房屋页面
-            driver.get(url)
-            time.sleep(3)
-            soup = BeautifulSoup(driver.page_source, "html.parser")
-            
-            # 保存完整HTML到本地文件
-            with open("debug_house_detail.html", "w", encoding="utf-8") as f:
-                f.write(soup.prettify())
+            soup = BeautifulSoup(page_source, "html.parser")
             
             # Makelaarsland参数区块递归解析
             features_module = soup.find('div', id='featuresModule')
@@ -120,12 +142,14 @@ class HouseInfoProcessor:
                     agent_info['email'] = email_a.get_text(strip=True) if email_a else ''
                     
         except Exception as e:
-            logger.error(f"Error in get_house_details: {str(e)}")
-        finally:
-            driver.quit()
+            logger.error(f"Error in parse_house_details: {str(e)}")
             
         return details, images, details_sections, agent_info
     
+    def close(self):
+        """关闭浏览器池"""
+        self.browser_pool.close()
+    
     def extract_important_info(self, details_sections: dict) -> dict:
         """从详情部分提取重要信息"""
         def extract_param(sections, keys):
@@ -0,0 +1,71 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from utils.logging_config import logger
+from utils.metrics import metrics
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+class HttpDetailFetcher:
+    """使用已认证cookie直接通过HTTP获取详情页，无需启动Chrome"""
+
+    def __init__(self, pool_size: int = 4, timeout: float = 10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml',
+            'Accept-Language': 'nl-NL,nl;q=0.9,en;q=0.8'
+        })
+        self._lock = threading.Lock()
+        self._has_cookies = False
+
+    @property
+    def has_cookies(self) -> bool:
+        return self._has_cookies
+
+    def load_cookies(self, cookies: list):
+        """导入Selenium格式的cookie（driver.get_cookies()的结果）"""
+        with self._lock:
+            self.session.cookies.clear()
+            for cookie in cookies:
+                self.session.cookies.set(
+                    cookie['name'],
+                    cookie['value'],
+                    domain=cookie.get('domain', ''),
+                    path=cookie.get('path', '/')
+                )
+            self._has_cookies = bool(cookies)
+
+    def invalidate(self):
+        """cookie失效后清空，下次请求将回退到浏览器"""
+        with self._lock:
+            self.session.cookies.clear()
+            self._has_cookies = False
+
+    @metrics.timed('page_load_http')
+    def fetch(self, url: str):
+        """获取详情页HTML；会话失效或页面缺少featuresModule时返回None"""
+        if not self._has_cookies:
+            return None
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"[HttpFetcher] Request failed for {url}: {str(e)}")
+            return None
+
+        if '/inloggen' in response.url:
+            logger.info("[HttpFetcher] Redirected to login page, cookies expired")
+            self.invalidate()
+            return None
+        if response.status_code != 200:
+            logger.warning(f"[HttpFetcher] Unexpected status {response.status_code} for {url}")
+            return None
+        if 'id="featuresModule"' not in response.text:
+            logger.info("[HttpFetcher] Static page lacks featuresModule, falling back to browser")
+            return None
+        return response.text
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+from utils.logging_config import logger
+
+
+class ImapSyncState:
+    """持久化的IMAP增量同步状态：UIDVALIDITY、已处理的最高UID，以及高水位之上已处理的UID"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.uidvalidity = None
+        self.last_uid = 0
+        self.done = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.uidvalidity = data.get('uidvalidity')
+            self.last_uid = data.get('last_uid', 0)
+            self.done = set(data.get('done', []))
+        except (OSError, ValueError) as e:
+            logger.error(f"[ImapState] Could not read {self.path}: {str(e)}")
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'uidvalidity': self.uidvalidity,
+                'last_uid': self.last_uid,
+                'done': sorted(self.done)
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def is_valid(self, uidvalidity: str) -> bool:
+        """状态是否属于当前邮箱；首次运行或UIDVALIDITY变化时返回False"""
+        return self.uidvalidity is not None and self.uidvalidity == uidvalidity
+
+    def reset(self, uidvalidity: str, last_uid: int = 0, done=()):
+        """为新的UIDVALIDITY重新开始；last_uid 及以下和 done 中的UID视为已处理"""
+        with self._lock:
+            logger.info(f"[ImapState] Starting new sync state for UIDVALIDITY {uidvalidity} at UID {last_uid}")
+            self.uidvalidity = uidvalidity
+            self.last_uid = last_uid
+            self.done = set(done)
+            self._save()
+
+    def is_pending(self, uid: int) -> bool:
+        return uid > self.last_uid and uid not in self.done
+
+    def commit(self, uid: int, pending: list):
+        """记录一个已处理的UID；pending为本批次尚未完成的UID，高水位不会越过它们"""
+        with self._lock:
+            self.done.add(uid)
+            blocked = [u for u in pending if u != uid and self.is_pending(u)]
+            ceiling = min(blocked) - 1 if blocked else max(self.done)
+            advanced = [u for u in self.done if u <= ceiling]
+            if advanced:
+                self.last_uid = max(self.last_uid, max(advanced))
+                self.done.difference_update(advanced)
+            self._save()
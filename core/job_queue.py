@@ -0,0 +1,234 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from utils.logging_config import logger
+
+# 房源依次经过的阶段；每完成一个阶段就把结果写回队列
+STAGES = ('parsed', 'detailed', 'enriched', 'published', 'notified')
+# 终止状态：通知已发出、无需处理（重复/被筛掉）、重试次数用完
+DONE, SKIPPED, FAILED = 'notified', 'skipped', 'failed'
+FINISHED = (DONE, SKIPPED, FAILED)
+# 通知已交给后台发送、等待全部送达；不会被领取，送达后由 finish_notifying 记为 DONE
+NOTIFYING = 'notifying'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER,
+    position INTEGER,
+    stage TEXT NOT NULL,
+    data TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_runnable ON jobs(stage, not_before);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_source ON jobs(uid, position);
+"""
+
+
+class LeaseLost(Exception):
+    """任务的租约已过期并被其他工作者领取，当前持有者应放弃处理"""
+
+
+class Job:
+    """队列中的一套房源：当前已完成的阶段和累积的房源数据"""
+
+    __slots__ = ('id', 'uid', 'stage', 'data', 'attempts', 'owner')
+
+    def __init__(self, id: int, uid: int, stage: str, data: dict, attempts: int, owner: str = None):
+        self.id = id
+        self.uid = uid
+        self.stage = stage
+        self.data = data
+        self.attempts = attempts
+        # 领取时的租约持有者，写检查点时据此确认租约仍属于自己
+        self.owner = owner
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.stage!r}, {self.data.get('url') or self.data.get('address')!r})"
+
+
+class JobQueue:
+    """持久化的房源任务队列（SQLite，WAL模式）
+
+    每套房源是一个任务，按 STAGES 推进，每完成一个阶段写一次检查点；进程重启后从最后完成的阶段继续，
+    不会重复抓取和调用外部服务。失败的任务按指数退避重试。
+
+    同一队列只能由一个进程使用（进程内可以有多个工作线程）：房源去重的登记（ListingIndex.claim）
+    和后台通知都只在进程内存中。打开队列时清除上一个进程留下的租约，并把等待通知送达的任务
+    退回 published 阶段重新通知。取任务时加租约，处理时间超过租约的任务可以被其他线程接手，
+    原持有者在下一次写检查点时收到 LeaseLost。
+    """
+
+    def __init__(self, path: str, lease: float = 300, max_attempts: int = 5,
+                 base_backoff: float = 30, max_backoff: float = 1800):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'position' not in columns:
+            # 旧队列没有 position 列；已有任务的 position 为NULL，不参与唯一约束
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN position INTEGER")
+        self._conn.executescript(INDEXES)
+        self._recover()
+
+    def _recover(self):
+        """清除上一个进程留下的租约；没等到通知送达的任务回到 published 阶段重新通知"""
+        with self._lock, self._transaction() as conn:
+            notifying = conn.execute(
+                "UPDATE jobs SET stage = 'published', updated_at = ? WHERE stage = ?", (self._now(), NOTIFYING)
+            ).rowcount
+            conn.execute("UPDATE jobs SET lease_owner = NULL, lease_until = 0 WHERE lease_owner IS NOT NULL")
+        if notifying:
+            logger.info(f"[JobQueue] {notifying} job(s) were interrupted before their notifications were delivered, "
+                        f"notifying again")
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 保证多个进程之间领取任务互斥"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec='seconds')
+
+    def enqueue(self, uid: int, listings: list) -> list:
+        """把一封邮件中的房源作为新任务写入队列（一个事务），返回新任务的ID
+
+        任务以 (邮件UID, 在邮件中的序号) 为唯一键：写入队列后、推进UID高水位前崩溃时，
+        同一封邮件重新入队不会产生重复的任务。
+        """
+        now = self._now()
+        ids = []
+        with self._lock, self._transaction() as conn:
+            for position, house_data in enumerate(listings):
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO jobs (uid, position, stage, data, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (uid, position, STAGES[0], json.dumps(house_data, ensure_ascii=False), now, now)
+                )
+                if cursor.rowcount:
+                    ids.append(cursor.lastrowid)
+        if len(ids) < len(listings):
+            logger.info(f"[JobQueue] {len(listings) - len(ids)} listing(s) of email {uid} were already queued")
+        return ids
+
+    def claim(self, worker: str = None):
+        """领取最早的一个可运行任务并加租约；没有时返回None"""
+        owner = f"{self.owner}:{worker or threading.current_thread().name}"
+        now = time.time()
+        with self._lock, self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT id, uid, stage, data, attempts FROM jobs "
+                f"WHERE stage NOT IN ({', '.join('?' * (len(FINISHED) + 1))}) AND not_before <= ? AND lease_until < ? "
+                f"ORDER BY id LIMIT 1",
+                (*FINISHED, NOTIFYING, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET lease_owner = ?, lease_until = ? WHERE id = ?",
+                (owner, now + self.lease, row['id'])
+            )
+        return Job(row['id'], row['uid'], row['stage'], json.loads(row['data']), row['attempts'], owner)
+
+    def _check_lease(self, conn, job: Job) -> None:
+        """确认任务仍由 job 持有（调用时在写事务中），否则抛出 LeaseLost
+
+        租约过期但没有被其他工作者领取时仍属于原持有者。
+        """
+        row = conn.execute("SELECT lease_owner FROM jobs WHERE id = ?", (job.id,)).fetchone()
+        if row is None or row['lease_owner'] != job.owner:
+            raise LeaseLost(f"{job} lease lost to {row['lease_owner'] if row else None}")
+
+    def checkpoint(self, job: Job, stage: str, data: dict = None) -> None:
+        """记录任务完成了 stage，保存累积的数据并续租；租约已丢失时抛出 LeaseLost，不写入
+
+        结束状态和 NOTIFYING 同时释放租约。
+        """
+        now = time.time()
+        release = stage in FINISHED or stage == NOTIFYING
+        with self._lock, self._transaction() as conn:
+            self._check_lease(conn, job)
+            conn.execute(
+                "UPDATE jobs SET stage = ?, data = ?, lease_owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(job.data if data is None else data, ensure_ascii=False),
+                 None if release else job.owner, 0 if release else now + self.lease, self._now(), job.id)
+            )
+        if data is not None:
+            job.data = data
+        job.stage = stage
+
+    def finish_notifying(self, job: Job) -> bool:
+        """通知全部结束（送达或放弃重试）后把 NOTIFYING 的任务记为 DONE"""
+        with self._lock, self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ? AND stage = ?",
+                (DONE, self._now(), job.id, NOTIFYING)
+            ).rowcount > 0
+
+    def release(self, job: Job) -> None:
+        with self._lock, self._transaction() as conn:
+            conn.execute("UPDATE jobs SET lease_owner = NULL, lease_until = 0 WHERE id = ? AND lease_owner = ?",
+                         (job.id, job.owner))
+
+    def fail(self, job: Job, error: str) -> bool:
+        """记录失败并释放租约；还可以重试时按退避推迟，返回是否还会重试。租约已丢失时抛出 LeaseLost"""
+        attempts = job.attempts + 1
+        retry = attempts < self.max_attempts
+        backoff = min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff)
+        with self._lock, self._transaction() as conn:
+            self._check_lease(conn, job)
+            conn.execute(
+                "UPDATE jobs SET attempts = ?, last_error = ?, not_before = ?, stage = ?, "
+                "lease_owner = NULL, lease_until = 0, updated_at = ? WHERE id = ?",
+                (attempts, error, time.time() + backoff if retry else 0, job.stage if retry else FAILED,
+                 self._now(), job.id)
+            )
+        job.attempts = attempts
+        if not retry:
+            logger.error(f"[JobQueue] {job} failed {attempts} times, giving up: {error}")
+        return retry
+
+    def counts(self) -> dict:
+        """各阶段的任务数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) FROM jobs GROUP BY stage").fetchall()
+        return {stage: count for stage, count in rows}
+
+    def purge_finished(self, days: float = 30) -> int:
+        """删除早已结束的任务"""
+        cutoff = datetime.fromtimestamp(time.time() - days * 24 * 3600).isoformat(timespec='seconds')
+        with self._lock, self._transaction() as conn:
+            return conn.execute(
+                f"DELETE FROM jobs WHERE stage IN ({', '.join('?' * len(FINISHED))}) AND updated_at < ?",
+                (*FINISHED, cutoff)
+            ).rowcount
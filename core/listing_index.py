@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from utils.logging_config import logger
+
+_OBJECT_ID_RE = re.compile(r'woningdetails/(\d+)')
+_POSTCODE_RE = re.compile(r'(\d{4})\s*([A-Za-z]{2})\b')
+
+
+def object_id_from_url(url: str) -> str:
+    """从详情页URL中提取Makelaarsland对象ID，例如 .../woningdetails/3767520"""
+    m = _OBJECT_ID_RE.search(url or '')
+    return m.group(1) if m else ''
+
+
+def normalize_address(address: str) -> str:
+    """规范化地址用于比较：邮编去空格转大写，其余转小写并去掉标点和多余空格"""
+    if not address:
+        return ''
+    address = _POSTCODE_RE.sub(lambda m: f" {m.group(1)}{m.group(2).upper()} ", address)
+    parts = re.sub(r'[^\w]+', ' ', address).split()
+    return ' '.join(p if re.fullmatch(r'\d{4}[A-Z]{2}', p) else p.lower() for p in parts)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    key TEXT PRIMARY KEY,
+    filename TEXT,
+    price TEXT,
+    address TEXT,
+    rejected TEXT,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS addresses (
+    address TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+"""
+
+_ENTRY_COLUMNS = ('filename', 'price', 'address', 'rejected', 'first_seen', 'last_seen')
+
+
+class ListingIndex:
+    """已处理房源的持久化索引（SQLite，WAL模式），按对象ID和规范化地址识别重复的提醒邮件
+
+    每次登记只写一行，与索引大小无关；旧版的 listing_index.json 在首次打开时导入。
+    """
+
+    def __init__(self, path: str):
+        # 旧配置指向JSON文件时，改用同名的 .db 文件并从JSON导入
+        if path.endswith('.json'):
+            path = path[:-len('.json')] + '.db'
+        self.path = path
+        self._lock = threading.Lock()
+        # 正在处理中的房源 -> 登记者（任务ID），避免同一批次内重复抓取；只在本进程内有效
+        self._claimed = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+        if self._conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0] == 0:
+            self.import_legacy(os.path.splitext(path)[0] + '.json')
+
+    def import_legacy(self, path: str) -> int:
+        """从旧版JSON索引导入，返回导入数量"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"[ListingIndex] Could not read {path}: {str(e)}")
+            return 0
+        objects = data.get('objects', {})
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO listings (key, filename, price, address, rejected, first_seen, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(key, e.get('filename'), e.get('price', ''), e.get('address', ''), e.get('rejected'),
+                  e.get('first_seen', now), e.get('last_seen', now)) for key, e in objects.items()]
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO addresses (address, key) VALUES (?, ?)",
+                list(data.get('addresses', {}).items())
+            )
+        logger.info(f"[ListingIndex] Imported {len(objects)} listings from {path}")
+        return len(objects)
+
+    @staticmethod
+    def key_for(house_data: dict) -> str:
+        object_id = object_id_from_url(house_data.get('url', ''))
+        if object_id:
+            return object_id
+        address = normalize_address(house_data.get('address', ''))
+        return f"addr:{address}" if address else ''
+
+    def _entry(self, key: str):
+        row = self._conn.execute(
+            f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM listings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {k: row[k] for k in _ENTRY_COLUMNS if row[k] is not None}
+
+    def _find(self, house_data: dict):
+        """返回 (键, 索引记录)，未知时返回 (None, None)"""
+        key = self.key_for(house_data)
+        entry = self._entry(key) if key else None
+        if entry is not None:
+            return key, entry
+        address = normalize_address(house_data.get('address', ''))
+        row = self._conn.execute("SELECT key FROM addresses WHERE address = ?", (address,)).fetchone() if address else None
+        if row is None:
+            return None, None
+        return row['key'], self._entry(row['key'])
+
+    def is_known(self, house_data: dict) -> bool:
+        with self._lock:
+            return self._find(house_data)[1] is not None
+
+    def claim(self, house_data: dict, owner=None):
+        """查找已知房源；未知时以 owner 的名义登记为处理中并返回None。
+
+        返回已知房源的索引记录；同一房源正在被其他登记者处理时返回 {'pending': True}。
+        owner 已持有登记时（例如任务重试）仍返回None。
+        """
+        with self._lock:
+            key, entry = self._find(house_data)
+            if entry is not None:
+                return dict(entry, key=key)
+            key = self.key_for(house_data)
+            if not key:
+                return None
+            if key in self._claimed and (owner is None or self._claimed[key] != owner):
+                return {'pending': True, 'key': key}
+            self._claimed[key] = owner
+            return None
+
+    def release(self, house_data: dict):
+        """处理失败时释放登记，下次可以重试"""
+        with self._lock:
+            self._claimed.pop(self.key_for(house_data), None)
+
+    def record(self, house_data: dict, key: str = None, rejected: str = None):
+        """保存处理后的房源（需要已包含filename）；key为已知房源在索引中的键
+
+        被预筛选淘汰的房源没有filename，rejected 记录淘汰原因。
+        """
+        key = key or self.key_for(house_data)
+        if not key:
+            return
+        now = datetime.now().isoformat(timespec='seconds')
+        address = normalize_address(house_data.get('address', ''))
+        with self._lock, self._conn:
+            # 只更新这一行；没有提供filename时保留原来的
+            self._conn.execute(
+                "INSERT INTO listings (key, filename, price, address, rejected, first_seen, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET filename = COALESCE(excluded.filename, filename), "
+                "price = excluded.price, address = excluded.address, rejected = excluded.rejected, "
+                "last_seen = excluded.last_seen",
+                (key, house_data.get('filename'), house_data.get('price', ''), house_data.get('address', ''),
+                 rejected, now, now)
+            )
+            if address:
+                self._conn.execute(
+                    "INSERT INTO addresses (address, key) VALUES (?, ?) "
+                    "ON CONFLICT(address) DO UPDATE SET key = excluded.key",
+                    (address, key)
+                )
+            self._claimed.pop(key, None)
@@ -0,0 +1,227 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from core.listing_index import object_id_from_url
+from models.house import parse_price
+from utils.logging_config import logger
+
+# 列表页用不到的大字段，单独存放在 listing_details 表
+BULKY_FIELDS = ('details', 'details_sections', 'other_info')
+
+_POSTCODE_RE = re.compile(r'\b(\d{4})\s?([A-Z]{2})\b')
+
+SORT_COLUMNS = {'id', 'created_at', 'updated_at', 'price_eur', 'postcode'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL UNIQUE,
+    object_id TEXT,
+    url TEXT,
+    address TEXT,
+    postcode TEXT,
+    price_eur INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS listing_details (
+    listing_id INTEGER PRIMARY KEY REFERENCES listings(id),
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_listings_object_id ON listings(object_id);
+CREATE INDEX IF NOT EXISTS idx_listings_url ON listings(url);
+CREATE INDEX IF NOT EXISTS idx_listings_postcode ON listings(postcode);
+CREATE INDEX IF NOT EXISTS idx_listings_price ON listings(price_eur);
+CREATE INDEX IF NOT EXISTS idx_listings_created_at ON listings(created_at);
+"""
+
+
+def _columns(house: dict) -> dict:
+    """从房源字典中提取带索引的列"""
+    postcode = _POSTCODE_RE.search(house.get('address') or '')
+    return {
+        'object_id': object_id_from_url(house.get('url')) or None,
+        'url': house.get('url'),
+        'address': house.get('address'),
+        'postcode': f"{postcode.group(1)}{postcode.group(2)}" if postcode else None,
+        'price_eur': house['price_eur'] if 'price_eur' in house else parse_price(house.get('price'))
+    }
+
+
+class ListingStore:
+    """SQLite（WAL模式）房源存储：插入为O(1)，列表数据与大字段分表，常用字段带索引"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def insert(self, house: dict) -> int:
+        """追加一套已发布的房源（需要包含filename），返回其序号"""
+        now = datetime.now().isoformat(timespec='seconds')
+        summary = {k: v for k, v in house.items() if k not in BULKY_FIELDS}
+        bulky = {k: house[k] for k in BULKY_FIELDS if k in house}
+        columns = _columns(house)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO listings (filename, object_id, url, address, postcode, price_eur, created_at, updated_at, summary) "
+                "VALUES (:filename, :object_id, :url, :address, :postcode, :price_eur, :created_at, :updated_at, :summary)",
+                dict(columns, filename=house['filename'], created_at=house.get('created_at', now), updated_at=now,
+                     summary=json.dumps(summary, ensure_ascii=False))
+            )
+            self._conn.execute(
+                "INSERT INTO listing_details (listing_id, data) VALUES (?, ?)",
+                (cursor.lastrowid, json.dumps(bulky, ensure_ascii=False))
+            )
+            return cursor.lastrowid
+
+    def get(self, filename: str):
+        """读取一套房源的完整记录"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT l.summary, d.data FROM listings l LEFT JOIN listing_details d ON d.listing_id = l.id "
+                "WHERE l.filename = ?", (filename,)
+            ).fetchone()
+        if row is None:
+            return None
+        house = json.loads(row['summary'])
+        house.update(json.loads(row['data'] or '{}'))
+        return house
+
+    def update(self, filename: str, changes: dict):
+        """更新列表字段（如价格），返回更新后的完整记录"""
+        house = self.get(filename)
+        if house is None:
+            return None
+        house.update(changes)
+        summary = {k: v for k, v in house.items() if k not in BULKY_FIELDS}
+        columns = _columns(house)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE listings SET object_id = :object_id, url = :url, address = :address, postcode = :postcode, "
+                "price_eur = :price_eur, updated_at = :updated_at, summary = :summary WHERE filename = :filename",
+                dict(columns, filename=filename, updated_at=datetime.now().isoformat(timespec='seconds'),
+                     summary=json.dumps(summary, ensure_ascii=False))
+            )
+        return house
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def position(self, filename: str):
+        """房源的发布序号（从0开始），不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM listings WHERE filename = ?", (filename,)).fetchone()
+            if row is None:
+                return None
+            return self._conn.execute("SELECT COUNT(*) FROM listings WHERE id < ?", (row['id'],)).fetchone()[0]
+
+    def _summaries(self, sql: str, params=()) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row['summary']) for row in rows]
+
+    def latest(self, limit: int) -> list:
+        """最新发布的房源摘要，最新在前"""
+        return self._summaries("SELECT summary FROM listings ORDER BY id DESC LIMIT ?", (limit,))
+
+    def page(self, page: int, size: int) -> list:
+        """按发布顺序的第page页（从1开始）房源摘要，页内最新在前"""
+        rows = self._summaries(
+            "SELECT summary FROM listings ORDER BY id LIMIT ? OFFSET ?", (size, (page - 1) * size)
+        )
+        return list(reversed(rows))
+
+    def iter_summaries(self, batch: int = 1000):
+        """按发布顺序遍历所有房源摘要，每次只读取一批"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, summary FROM listings WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row['summary'])
+            last_id = rows[-1]['id']
+
+    def iter_records(self, batch: int = 1000):
+        """按发布顺序遍历所有房源的完整记录（用于导出），每次只读取一批"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT l.id, l.summary, d.data FROM listings l LEFT JOIN listing_details d ON d.listing_id = l.id "
+                    "WHERE l.id > ? ORDER BY l.id LIMIT ?", (last_id, batch)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                house = json.loads(row['summary'])
+                house.update(json.loads(row['data'] or '{}'))
+                yield house
+            last_id = rows[-1]['id']
+
+    def query(self, postcode_prefix: str = None, min_price: int = None, max_price: int = None,
+              object_id: str = None, url: str = None, since: str = None,
+              order_by: str = 'id', descending: bool = True, limit: int = 100, offset: int = 0) -> list:
+        """按邮编、价格、对象ID、URL、日期筛选并排序，只读取摘要"""
+        clauses, params = [], []
+        if postcode_prefix:
+            clauses.append("postcode LIKE ?")
+            params.append(postcode_prefix.replace(' ', '').upper() + '%')
+        if min_price is not None:
+            clauses.append("price_eur >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append("price_eur <= ?")
+            params.append(max_price)
+        if object_id:
+            clauses.append("object_id = ?")
+            params.append(object_id)
+        if url:
+            clauses.append("url = ?")
+            params.append(url)
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if order_by not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort listings by {order_by}")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        sql = (f"SELECT summary FROM listings {where} "
+               f"ORDER BY {order_by} {'DESC' if descending else 'ASC'}, id DESC LIMIT ? OFFSET ?")
+        return self._summaries(sql, params + [limit, offset])
+
+    def import_legacy(self, path: str, exists=None) -> int:
+        """从旧版 houses.json（最新在前）或 houses.jsonl（按发布顺序）导入，返回导入数量"""
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                houses = [json.loads(line) for line in f if line.strip()]
+            else:
+                houses = list(reversed(json.load(f)))
+        imported = 0
+        seen = {}
+        for house in houses:
+            filename = house.get('filename')
+            if not filename or (exists and not exists(filename)):
+                continue
+            # jsonl中同一文件名后出现的记录是更新
+            seen[filename] = house
+        for house in seen.values():
+            self.insert(house)
+            imported += 1
+        logger.info(f"[ListingStore] Imported {imported} listings from {path}")
+        return imported
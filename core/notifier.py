@@ -0,0 +1,338 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+from models.house import HouseInfo
+from utils.logging_config import logger
+from utils.metrics import metrics
+
+
+@dataclass
+class Delivery:
+    """发给一个收件人的一条通知"""
+    recipient: str
+    house_info: HouseInfo
+    attempts: int = 0
+    # 重试前的最早发送时间
+    not_before: float = 0.0
+    # 送达或放弃重试后调用；停止时仍未送达的投递不调用
+    done: Optional[Callable[[], None]] = None
+
+
+class ChannelQueue:
+    """单个通知渠道的后台发送队列
+
+    每次取出所有到期的投递交给 send_batch 一起发送；send_batch 返回发送失败的投递，
+    这些投递按指数退避重新排队，最多尝试 max_attempts 次；送达或放弃后调用投递的 done。设置 window 时，
+    第一条通知到达后再等待这么多秒，把同一批房源的通知合并发送。
+
+    设置 digest_rate 时，最近一分钟内的房源数超过它即进入摘要模式：等待 digest_window 秒收集房源，
+    交给 send_digest 给每个收件人发一条摘要，外发请求数不再随房源数增长。
+    """
+
+    def __init__(self, name: str, send_batch, window: float = 0, max_attempts: int = 5,
+                 base_backoff: float = 30, max_backoff: float = 600, send_digest=None,
+                 digest_rate: int = None, digest_window: float = 120):
+        self.name = name
+        self.send_batch = send_batch
+        self.window = window
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.send_digest = send_digest
+        self.digest_rate = digest_rate
+        self.digest_window = digest_window
+        # 最近提交的房源时间，用于计算速率
+        self._recent = deque()
+        self._pending = []
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'notify-{name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, deliveries: list):
+        """登记待发送的通知，立即返回"""
+        if not deliveries:
+            return
+        with self._cond:
+            if self._digest_enabled():
+                now = time.monotonic()
+                self._prune_recent(now)
+                self._recent.append(now)
+            self._pending.extend(deliveries)
+            self._cond.notify()
+    
+    def _digest_enabled(self) -> bool:
+        return bool(self.digest_rate) and self.send_digest is not None
+    
+    def _prune_recent(self, now: float):
+        cutoff = now - 60
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    def _bursting(self) -> bool:
+        """最近一分钟内提交的房源数是否超过摘要阈值（调用时持有锁）"""
+        if not self._digest_enabled():
+            return False
+        self._prune_recent(time.monotonic())
+        return len(self._recent) > self.digest_rate
+
+    def _collect(self, seconds: float):
+        """在锁内等待满 seconds 秒（期间新到的通知不会提前结束等待），停止时立即返回"""
+        deadline = time.monotonic() + seconds
+        while not self._stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._cond.wait(remaining)
+
+    def _take_ready(self) -> tuple:
+        """等待并取出到期的投递，返回 (投递列表, 是否按摘要发送)；停止且队列为空时返回None"""
+        with self._cond:
+            while True:
+                if self._stopping:
+                    # 停止前把剩余的（包括等待重试的）都再发一次
+                    ready, self._pending = self._pending, []
+                    return (ready, self._bursting()) if ready else None
+                now = time.monotonic()
+                ready = [d for d in self._pending if d.not_before <= now]
+                if ready:
+                    digest = self._bursting()
+                    if not any(d.attempts for d in ready):
+                        # 收集窗口期内同一批的其他通知
+                        self._collect(self.digest_window if digest else self.window)
+                        now = time.monotonic()
+                        ready = [d for d in self._pending if d.not_before <= now]
+                    self._pending = [d for d in self._pending if d.not_before > now]
+                    return ready, digest
+                if self._pending:
+                    self._cond.wait(min(d.not_before for d in self._pending) - now)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            taken = self._take_ready()
+            if taken is None:
+                return
+            ready, digest = taken
+            try:
+                with metrics.timer(f'notify_{self.name}'):
+                    if digest:
+                        logger.info(f"[Notify] Burst detected, sending {len(ready)} {self.name} notifications as digests")
+                        failed = self.send_digest(ready)
+                    else:
+                        failed = self.send_batch(ready)
+            except Exception as e:
+                logger.error(f"[Notify] {self.name} batch failed: {str(e)}")
+                failed = ready
+            metrics.inc(f'notify_{self.name}_sent', len(ready) - len(failed))
+            if failed:
+                metrics.inc(f'notify_{self.name}_failed', len(failed))
+            failed_ids = {id(delivery) for delivery in failed}
+            for delivery in ready:
+                if id(delivery) not in failed_ids:
+                    self._finish(delivery)
+            retry = []
+            for delivery in failed:
+                delivery.attempts += 1
+                if delivery.attempts >= self.max_attempts:
+                    logger.error(f"[Notify] Giving up {self.name} notification to {delivery.recipient} "
+                                 f"for {delivery.house_info.url} after {delivery.attempts} attempts")
+                    self._finish(delivery)
+                    continue
+                if self._stopping:
+                    # 不调用done：任务保持未完成，重启后重新通知
+                    logger.error(f"[Notify] Stopping with undelivered {self.name} notification to "
+                                 f"{delivery.recipient} for {delivery.house_info.url}")
+                    continue
+                backoff = min(self.base_backoff * 2 ** (delivery.attempts - 1), self.max_backoff)
+                delivery.not_before = time.monotonic() + backoff
+                retry.append(delivery)
+            if retry:
+                logger.warning(f"[Notify] {len(retry)} {self.name} notifications failed, retrying later")
+                with self._cond:
+                    self._pending.extend(retry)
+
+    def _finish(self, delivery: Delivery):
+        if delivery.done is None:
+            return
+        try:
+            delivery.done()
+        except Exception as e:
+            logger.error(f"[Notify] Completion callback for {delivery.house_info.url} failed: {str(e)}")
+
+    def stop(self, timeout=None):
+        """发送剩余的通知后停止"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+class NotificationDispatcher:
+    """把房源通知同时分发到WhatsApp和邮件两个渠道
+
+    两个渠道各有一个后台队列，互不等待：WhatsApp消息用有界线程池并行发送，
+    一批邮件共用一个SMTP会话。每个渠道失败的收件人单独重试。
+    提醒集中到达（每分钟超过 digest_rate 套）时改为每个收件人一条摘要。
+    """
+
+    def __init__(self, whatsapp_service, email_service, whatsapp_concurrency: int = 4,
+                 email_window: float = 2, max_attempts: int = 5, max_backoff: float = 600,
+                 digest_rate: int = None, digest_window: float = 120):
+        self.whatsapp_service = whatsapp_service
+        self.email_service = email_service
+        self.whatsapp_executor = ThreadPoolExecutor(max_workers=whatsapp_concurrency, thread_name_prefix='whatsapp')
+        self.channels = {
+            'whatsapp': ChannelQueue('whatsapp', self._send_whatsapp, max_attempts=max_attempts,
+                                     max_backoff=max_backoff, send_digest=self._send_whatsapp_digest,
+                                     digest_rate=digest_rate, digest_window=digest_window),
+            'email': ChannelQueue('email', self._send_email, window=email_window, max_attempts=max_attempts,
+                                  max_backoff=max_backoff, send_digest=self._send_email_digest,
+                                  digest_rate=digest_rate, digest_window=digest_window)
+        }
+
+    def submit(self, house_info: HouseInfo, on_done=None) -> None:
+        """登记一套房源的通知，立即返回；两个渠道的投递都送达或放弃重试后调用 on_done"""
+        whatsapp = [Delivery(r, house_info) for r in self.whatsapp_service.recipients]
+        email = [Delivery(r, house_info) for r in self.email_service.recipients]
+        if on_done is not None:
+            if not whatsapp and not email:
+                on_done()
+            done = self._countdown(len(whatsapp) + len(email), on_done)
+            for delivery in whatsapp + email:
+                delivery.done = done
+        self.channels['whatsapp'].submit(whatsapp)
+        self.channels['email'].submit(email)
+
+    @staticmethod
+    def _countdown(count: int, callback):
+        """返回一个函数，被调用 count 次后调用 callback"""
+        lock = threading.Lock()
+        remaining = [count]
+
+        def done():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            callback()
+        return done
+
+    def _send_whatsapp(self, deliveries: list) -> list:
+        # 每套房源的正文只生成一次
+        bodies = {}
+        futures = []
+        for delivery in deliveries:
+            key = id(delivery.house_info)
+            if key not in bodies:
+                bodies[key] = self.whatsapp_service.format_message(delivery.house_info)
+            futures.append((delivery, self.whatsapp_executor.submit(
+                self.whatsapp_service.send_message, delivery.recipient, bodies[key]
+            )))
+        failed = []
+        for delivery, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed to send WhatsApp message to {delivery.recipient}: {str(e)}")
+                failed.append(delivery)
+        return failed
+
+    @staticmethod
+    def _by_recipient(deliveries: list) -> dict:
+        """按收件人分组，保持房源的提交顺序"""
+        groups = {}
+        for delivery in deliveries:
+            groups.setdefault(delivery.recipient, []).append(delivery)
+        return groups
+
+    def _send_whatsapp_digest_to(self, recipient: str, group: list) -> list:
+        """依次发送一个收件人的摘要消息，返回未发出的投递
+
+        某条消息失败时只有它和之后的消息中的房源重试，已发出的消息不会重复发送。
+        """
+        chunks = self.whatsapp_service.digest_chunks([d.house_info for d in group])
+        for i, (body, _) in enumerate(chunks):
+            try:
+                self.whatsapp_service.send_message(recipient, body)
+            except Exception as e:
+                logger.error(f"Failed to send WhatsApp digest part {i + 1}/{len(chunks)} to {recipient}: {str(e)}")
+                return [group[j] for _, indexes in chunks[i:] for j in indexes]
+        return []
+
+    def _send_whatsapp_digest(self, deliveries: list) -> list:
+        futures = [
+            (group, self.whatsapp_executor.submit(self._send_whatsapp_digest_to, recipient, group))
+            for recipient, group in self._by_recipient(deliveries).items()
+        ]
+        failed = []
+        for group, future in futures:
+            try:
+                failed.extend(future.result())
+            except Exception as e:
+                logger.error(f"Failed to send WhatsApp digest to {group[0].recipient}: {str(e)}")
+                failed.extend(group)
+        return failed
+
+    def _send_email_digest(self, deliveries: list) -> list:
+        groups = self._by_recipient(deliveries)
+        pages = {}
+        failed = []
+        with self.email_service.connect() as server:
+            for recipient, group in groups.items():
+                house_infos = [d.house_info for d in group]
+                # 收件人相同的房源组合通常一样，摘要只生成一次
+                key = tuple(id(h) for h in house_infos)
+                if key not in pages:
+                    pages[key] = self.email_service.render_digest_html(house_infos)
+                try:
+                    server.send_message(self.email_service.build_message(
+                        self.email_service.digest_subject(house_infos), pages[key], recipient
+                    ))
+                except Exception as e:
+                    logger.error(f"Failed to send email digest to {recipient}: {str(e)}")
+                    failed.extend(group)
+        logger.info(f"[Notify] Sent {len(groups)} email digests covering {len(deliveries)} notifications")
+        return failed
+
+    def _send_email(self, deliveries: list) -> list:
+        start = time.monotonic()
+        pages = {}
+        failed = []
+        with self.email_service.connect() as server:
+            for i, delivery in enumerate(deliveries):
+                house_info = delivery.house_info
+                key = id(house_info)
+                if key not in pages:
+                    pages[key] = self.email_service.render_html(house_info)
+                try:
+                    server.send_message(self.email_service.build_message(
+                        self.email_service.subject(house_info), pages[key], delivery.recipient
+                    ))
+                except Exception as e:
+                    logger.error(f"Failed to send email to {delivery.recipient}: {str(e)}")
+                    failed.append(delivery)
+                    if not self._is_connected(server):
+                        # 会话已断开，剩下的留给重试
+                        failed.extend(deliveries[i + 1:])
+                        break
+        logger.info(f"[Notify] Sent {len(deliveries) - len(failed)}/{len(deliveries)} emails over one SMTP "
+                    f"session in {time.monotonic() - start:.2f}s")
+        return failed
+
+    @staticmethod
+    def _is_connected(server) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def stop(self, timeout=None):
+        """发送队列中剩余的通知后停止"""
+        for channel in self.channels.values():
+            channel.stop(timeout)
+        self.whatsapp_executor.shutdown(wait=False)
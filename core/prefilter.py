@@ -0,0 +1,94 @@
+import re
+from models.house import parse_price, parse_area, parse_rooms, parse_minutes
+
+_POSTCODE_CITY_RE = re.compile(r'(\d{4})\s?([A-Z]{2})\s+(.+)$')
+
+
+def _split_list(value: str) -> list:
+    return [item.strip().lower() for item in (value or '').split(',') if item.strip()]
+
+
+class PreFilter:
+    """按邮件中已有的廉价信息（价格、面积、房间数、邮编、城市）筛选房源
+
+    不满足条件的房源直接归档，不再抓取详情页和查询外部服务。
+    无法解析的字段不作为淘汰依据。
+    """
+
+    def __init__(self, min_price: int = None, max_price: int = None, min_area: int = None,
+                 min_rooms: int = None, postcodes: list = None, cities: list = None,
+                 exclude_cities: list = None, max_commute: int = None):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_area = min_area
+        self.min_rooms = min_rooms
+        # 邮编前缀，如 "10" 表示 10xx 开头的所有邮编
+        self.postcodes = [p.replace(' ', '').upper() for p in (postcodes or [])]
+        self.cities = [c.lower() for c in (cities or [])]
+        self.exclude_cities = [c.lower() for c in (exclude_cities or [])]
+        # 到任一通勤目标的最长公共交通时间（分钟），需要先查询地图
+        self.max_commute = max_commute
+
+    @classmethod
+    def from_config(cls, config) -> 'PreFilter':
+        return cls(
+            min_price=config.PREFILTER_MIN_PRICE,
+            max_price=config.PREFILTER_MAX_PRICE,
+            min_area=config.PREFILTER_MIN_AREA,
+            min_rooms=config.PREFILTER_MIN_ROOMS,
+            postcodes=_split_list(config.PREFILTER_POSTCODES),
+            cities=_split_list(config.PREFILTER_CITIES),
+            exclude_cities=_split_list(config.PREFILTER_EXCLUDE_CITIES),
+            max_commute=config.PREFILTER_MAX_COMMUTE
+        )
+
+    @property
+    def checks_commute(self) -> bool:
+        return self.max_commute is not None
+
+    @staticmethod
+    def _postcode_city(house_data: dict) -> tuple:
+        postcode = house_data.get('postcode', '')
+        city = house_data.get('city', '')
+        if not (postcode and city):
+            m = _POSTCODE_CITY_RE.search(house_data.get('address', ''))
+            if m:
+                postcode = postcode or m.group(1) + m.group(2)
+                city = city or m.group(3)
+        return postcode.replace(' ', '').upper(), city.strip().lower()
+
+    def check(self, house_data: dict):
+        """检查邮件中的信息，返回淘汰原因；通过时返回None"""
+        price = parse_price(house_data.get('price'))
+        if price is not None:
+            if self.min_price is not None and price < self.min_price:
+                return f"price {price} below {self.min_price}"
+            if self.max_price is not None and price > self.max_price:
+                return f"price {price} above {self.max_price}"
+        size_rooms = house_data.get('size_rooms', '')
+        area = parse_area(size_rooms)
+        if self.min_area is not None and area is not None and area < self.min_area:
+            return f"living area {area} m² below {self.min_area} m²"
+        rooms = parse_rooms(size_rooms)
+        if self.min_rooms is not None and rooms is not None and rooms < self.min_rooms:
+            return f"{rooms} rooms, fewer than {self.min_rooms}"
+        postcode, city = self._postcode_city(house_data)
+        if self.postcodes and postcode and not any(postcode.startswith(p) for p in self.postcodes):
+            return f"postcode {postcode} outside {', '.join(self.postcodes)}"
+        if city:
+            if self.cities and city not in self.cities:
+                return f"city {city} not in {', '.join(self.cities)}"
+            if city in self.exclude_cities:
+                return f"city {city} excluded"
+        return None
+
+    def check_commute(self, station_info: dict):
+        """地图查询后检查通勤时间，返回淘汰原因；通过时返回None"""
+        if self.max_commute is None:
+            return None
+        minutes = [parse_minutes((commute or {}).get('duration'))
+                   for commute in (station_info.get('commutes') or {}).values()]
+        minutes = [m for m in minutes if m is not None]
+        if minutes and min(minutes) > self.max_commute:
+            return f"commute {min(minutes)} min, longer than {self.max_commute} min"
+        return None
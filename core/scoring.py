@@ -0,0 +1,125 @@
+import threading
+import warnings
+import numpy as np
+from models.house import ListingNumbers
+from utils.logging_config import logger
+
+# 特征及方向：+1 表示越大越好，-1 表示越小越好
+FEATURES = ('price_per_m2', 'price_vs_woz', 'commute_penalty', 'walk_penalty', 'rooms')
+DIRECTIONS = np.array([-1.0, -1.0, -1.0, -1.0, 1.0])
+DEFAULT_WEIGHTS = {
+    'price_per_m2': 0.35,
+    'price_vs_woz': 0.2,
+    'commute_penalty': 0.25,
+    'walk_penalty': 0.1,
+    'rooms': 0.1
+}
+
+# 通勤/步行在这个时间（分钟）以内不扣分
+COMMUTE_FREE_MINUTES = 30
+WALK_FREE_MINUTES = 10
+
+
+def _raw_matrix(numbers: list) -> np.ndarray:
+    """把 ListingNumbers 列表转成原始数值矩阵，缺失值为 NaN：
+    价格、居住面积、WOZ、平均通勤分钟、步行分钟、房间数
+    """
+    rows = []
+    for n in numbers:
+        commutes = list((n.commute_minutes or {}).values())
+        rows.append((
+            n.price_eur, n.living_area_m2, n.woz_eur,
+            sum(commutes) / len(commutes) if commutes else None,
+            n.walking_minutes, n.rooms
+        ))
+    return np.array(rows, dtype=float).reshape(len(rows), 6)
+
+
+def feature_matrix(numbers: list) -> np.ndarray:
+    """一次性计算所有房源的特征矩阵（行：房源，列：FEATURES）"""
+    raw = _raw_matrix(numbers)
+    price, area, woz, commute, walk, rooms = raw.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_per_m2 = np.where(area > 0, price / area, np.nan)
+        price_vs_woz = np.where(woz > 0, price / woz, np.nan)
+    commute_penalty = np.maximum(commute - COMMUTE_FREE_MINUTES, 0)
+    walk_penalty = np.maximum(walk - WALK_FREE_MINUTES, 0)
+    return np.column_stack((price_per_m2, price_vs_woz, commute_penalty, walk_penalty, rooms))
+
+
+class ScoringEngine:
+    """用NumPy对所有历史房源批量打分，并用分位数表在常数时间内给新房源排名
+
+    每个特征按历史均值/标准差标准化，缺失值按平均水平（0分）处理；得分是加权平均。
+    新房源按已拟合的参数打分后，在固定大小的分位数表中二分查找得到百分位。
+    每新增 refit_every 套房源重新拟合一次。
+    """
+
+    def __init__(self, weights: dict = None, quantiles: int = 101, refit_every: int = 100):
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.weights = np.array([weights[name] for name in FEATURES], dtype=float)
+        self.quantiles = quantiles
+        self.refit_every = refit_every
+        self._lock = threading.Lock()
+        self._features = np.empty((0, len(FEATURES)))
+        # 没有历史数据的特征均值为NaN，标准化后按0分处理
+        self._mean = np.full(len(FEATURES), np.nan)
+        self._std = np.ones(len(FEATURES))
+        self._table = np.empty(0)
+        # 上次拟合之后新增的房源特征行
+        self._pending = []
+
+    def _fit(self):
+        if self._pending:
+            self._features = np.vstack([self._features] + self._pending)
+            self._pending = []
+        features = self._features
+        if len(features):
+            # 全部缺失的列会触发 "Mean of empty slice" 警告，均值保持NaN即可
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                mean = np.nanmean(features, axis=0)
+                std = np.nanstd(features, axis=0)
+            self._mean = mean
+            self._std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+            scores = self._score(features)
+            self._table = np.quantile(scores, np.linspace(0, 1, self.quantiles))
+
+    def _score(self, features: np.ndarray) -> np.ndarray:
+        z = np.nan_to_num((features - self._mean) / self._std) * DIRECTIONS
+        return z @ self.weights / self.weights.sum()
+
+    def fit(self, records) -> np.ndarray:
+        """用历史房源（字典）拟合，返回它们的得分"""
+        numbers = [ListingNumbers.from_dict(record) for record in records]
+        with self._lock:
+            self._features = feature_matrix(numbers)
+            self._pending = []
+            self._fit()
+            logger.info(f"[Scoring] Fitted on {len(numbers)} listings")
+            return self._score(self._features)
+
+    def score_all(self) -> np.ndarray:
+        """所有已知房源的当前得分"""
+        with self._lock:
+            return self._score(np.vstack([self._features] + self._pending))
+
+    def percentile(self, score: float) -> float:
+        """得分在历史房源中的百分位（0-100）"""
+        table = self._table
+        if not len(table):
+            return 50.0
+        # 分位数表大小固定，查找为常数时间
+        index = np.searchsorted(table, score, side='right')
+        return round(100.0 * min(max(int(index) - 1, 0), len(table) - 1) / (len(table) - 1), 1)
+
+    def rank(self, record: dict) -> tuple:
+        """给新房源打分并排名，返回 (得分, 百分位)，然后加入历史"""
+        features = feature_matrix([ListingNumbers.from_dict(record)])
+        with self._lock:
+            score = float(self._score(features)[0])
+            percentile = self.percentile(score)
+            self._pending.append(features)
+            if len(self._pending) >= self.refit_every:
+                self._fit()
+        return round(score, 3), percentile
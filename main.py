@@ -17,24 +17,34 @@ import json
 from datetime import datetime
 import re
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from publish_to_github import add_new_house
+from publish_to_github import add_new_house, update_house, start_push_queue, stop_push_queue, get_store
 from selenium.webdriver.common.keys import Keys
 import logging
 import sys
 from utils.config import Config
 from utils.logging_config import logger
+from utils.geo import StationIndex
+from utils.metrics import metrics
+from core import email_parser, detail_parser
 from core.email_handler import EmailHandler
 from core.house_info import HouseInfoProcessor
+from core.enrichment import EnrichmentPipeline, EnrichmentTask
+from core.listing_index import ListingIndex
+from core.scoring import ScoringEngine
+from core.prefilter import PreFilter
+from core.notifier import NotificationDispatcher
+from core.job_queue import JobQueue, Job, LeaseLost, NOTIFYING, SKIPPED
 from services.maps_service import MapsService
 from services.whatsapp_service import WhatsAppService
 from services.email_service import EmailService
 from services.woz_service import WOZService
 from services.immigration_service import ImmigrationService
 from services.huispedia_service import HuispediaService
-from models.house import HouseInfo
+from models.house import HouseInfo, ListingNumbers, parse_price
 
 # 加载环境变量
 load_dotenv()
@@ -53,11 +63,33 @@ class MakelaarslandProcessor:
     def __init__(self):
         # 初始化配置
         self.config = Config()
+        if email_parser.lxml_html is None or detail_parser.lxml_html is None:
+            logger.warning("lxml is not installed: parsing alert emails and detail pages with the much slower "
+                           "HTMLParser/BeautifulSoup fallback (pip install -r requirements.txt)")
         
         # 初始化各个服务
-        self.email_handler = EmailHandler(self.config.EMAIL, self.config.EMAIL_PASSWORD)
-        self.house_processor = HouseInfoProcessor(self.config.MAKELAARSLAND_USERNAME, self.config.MAKELAARSLAND_PASSWORD)
-        self.maps_service = MapsService(self.config.GOOGLE_MAPS_API_KEY)
+        self.email_handler = EmailHandler(
+            self.config.EMAIL,
+            self.config.EMAIL_PASSWORD,
+            state_file=self.config.IMAP_STATE_FILE
+        )
+        self.house_processor = HouseInfoProcessor(
+            self.config.MAKELAARSLAND_USERNAME,
+            self.config.MAKELAARSLAND_PASSWORD,
+            pool_size=self.config.BROWSER_POOL_SIZE,
+            max_pages=self.config.BROWSER_MAX_PAGES,
+            http_fetch=self.config.HTTP_DETAIL_FETCH,
+            debug_dump_rate=self.config.DEBUG_DUMP_RATE,
+            debug_dump_dir=self.config.DEBUG_DUMP_DIR
+        )
+        self.maps_service = MapsService(
+            self.config.GOOGLE_MAPS_API_KEY,
+            cache_file=self.config.CACHE_FILE,
+            cell_precision=self.config.MAPS_CELL_PRECISION,
+            commute_targets=self.config.get_commute_targets(),
+            station_index=StationIndex.load(self.config.STATIONS_FILE) if self.config.STATIONS_FILE else None,
+            station_index_max_km=self.config.STATION_INDEX_MAX_KM
+        )
         self.whatsapp_service = WhatsAppService(
             self.config.TWILIO_ACCOUNT_SID,
             self.config.TWILIO_AUTH_TOKEN,
@@ -69,67 +101,304 @@ class MakelaarslandProcessor:
             self.config.EMAIL_PASSWORD,
             self.config.get_email_recipients()
         )
-        self.woz_service = WOZService()
-        self.immigration_service = ImmigrationService()
+        # 通知在后台发送，不阻塞房源处理
+        self.notifier = NotificationDispatcher(
+            self.whatsapp_service,
+            self.email_service,
+            whatsapp_concurrency=self.config.WHATSAPP_CONCURRENCY,
+            email_window=self.config.EMAIL_BATCH_WINDOW,
+            max_attempts=self.config.NOTIFY_MAX_ATTEMPTS,
+            digest_rate=self.config.DIGEST_RATE,
+            digest_window=self.config.DIGEST_WINDOW
+        )
+        self.woz_service = WOZService(
+            cache_file=self.config.CACHE_FILE,
+            ttl_days=self.config.WOZ_CACHE_DAYS,
+            negative_ttl_days=self.config.NEGATIVE_CACHE_DAYS
+        )
+        self.immigration_service = ImmigrationService(
+            cache_file=self.config.CACHE_FILE,
+            ttl_days=self.config.IMMIGRATION_CACHE_DAYS,
+            negative_ttl_days=self.config.NEGATIVE_CACHE_DAYS
+        )
         self.huispedia_service = HuispediaService()
+        self.listing_index = ListingIndex(self.config.LISTING_INDEX_FILE)
+        # 持久化任务队列：每套房源按阶段推进并写检查点，重启后从断点继续
+        self.job_queue = JobQueue(
+            self.config.JOB_QUEUE_FILE,
+            lease=self.config.JOB_LEASE,
+            max_attempts=self.config.JOB_MAX_ATTEMPTS
+        )
+        self.job_queue.purge_finished()
+        self.prefilter = PreFilter.from_config(self.config)
+        # 用已发布的房源拟合打分参数，新房源在常数时间内得到百分位排名
+        self.scoring = ScoringEngine(
+            weights=self.config.get_score_weights(),
+            refit_every=self.config.SCORE_REFIT_EVERY
+        )
+        self.scoring.fit(get_store().iter_summaries())
+        # 后台合并推送，发布不再阻塞通知
+        if self.config.GIT_PUSH_WINDOW > 0:
+            start_push_queue(self.config.GIT_PUSH_WINDOW)
+        # 本地指标接口：/metrics（Prometheus文本格式）和 /metrics.json
+        if self.config.METRICS_PORT:
+            metrics.start_server(self.config.METRICS_PORT, self.config.METRICS_HOST)
+        self.enrichment = EnrichmentPipeline(max_workers=self.config.ENRICHMENT_WORKERS)
+        # detailed阶段预取的查询：房源URL -> {任务名: Future}，enriched阶段取出
+        self._prefetched = {}
+        self.batch_executor = ThreadPoolExecutor(max_workers=self.config.BATCH_WORKERS, thread_name_prefix='listing')
     
-    def process_house(self, house_data: dict) -> HouseInfo:
-        """处理单个房屋信息"""
-        # 获取详细信息
-        details, images, details_sections, agent_info = self.house_processor.get_house_details(house_data['url'])
-        house_data['details'] = details
-        house_data['images'] = images
-        house_data['details_sections'] = details_sections
-        house_data['agent_info'] = agent_info
-        
-        # 提取重要信息
-        house_data['important_info'] = self.house_processor.extract_important_info(details_sections)
+    def screen_listing(self, house_data: dict, owner=None) -> tuple:
+        """parsed阶段：去重和预筛选，返回 (下一步, 房源数据)
+
+        下一步为 SKIPPED（重复且无变化、被筛掉）、'published'（已知房源的价格已更新，只需通知）
+        或 'new'（需要抓取详情页并完整处理）。owner 为登记处理中房源的任务ID。
+        """
+        known = self.listing_index.claim(house_data, owner)
+        if known and not known.get('rejected'):
+            return self.update_known_house(known, house_data)
+        if known and house_data.get('price') in ('', known.get('price')):
+            logger.info(f"House {house_data['url']} was filtered out before ({known['rejected']}), skipping")
+            return SKIPPED, house_data
         
-        # 获取到最近火车站的距离
-        house_data['nearest_station'] = self.maps_service.get_nearest_station(house_data['address'])
+        # 先用邮件中的信息筛选，只有通过的房源才抓取详情页和查询外部服务
+        reason = self.prefilter.check(house_data)
+        if reason:
+            self.archive_rejected(house_data, reason, key=known['key'] if known else None)
+            return SKIPPED, house_data
+        return 'new', house_data
+    
+    def archive_rejected(self, house_data: dict, reason: str, key: str = None) -> None:
+        """记录被筛掉的房源；价格变化后会重新筛选"""
+        logger.info(f"Filtered out {house_data.get('address') or house_data['url']}: {reason}")
+        self.listing_index.record(house_data, key=key, rejected=reason)
+    
+    def update_known_house(self, known: dict, house_data: dict) -> tuple:
+        """已处理过的房源：跳过抓取和所有外部查询，只更新可能变化的字段"""
+        if known.get('pending'):
+            logger.info(f"House {house_data['url']} is already being processed, skipping duplicate")
+            return SKIPPED, house_data
+        if house_data.get('price') == known.get('price') or not house_data.get('price'):
+            logger.info(f"House {house_data['url']} already processed and unchanged, skipping")
+            return SKIPPED, house_data
         
-        # 获取WOZ估值
-        house_data['woz_info'] = self.woz_service.get_woz_info(house_data['address'])
+        logger.info(f"Price change for {known.get('address')}: {known.get('price')} -> {house_data['price']}")
+        updated = update_house(known['filename'], {
+            'price': house_data['price'],
+            'price_eur': parse_price(house_data['price'])
+        })
+        if updated is None:
+            logger.warning(f"Published page {known['filename']} not found, processing as new house")
+            return 'new', house_data
+        self.listing_index.record(updated, key=known['key'])
+        return 'published', updated
+    
+    def lookup_tasks(self, house_data: dict) -> dict:
+        """地图、WOZ、移民指数、Huispedia查询，互不依赖"""
+        address = house_data['address']
+        no_immigration_info = "<p style='margin:0;color:#666;'>Geen immigratie informatie beschikbaar</p>"
+        tasks = {
+            'nearest_station': EnrichmentTask(
+                self.maps_service.get_nearest_station, (address,),
+                timeout=self.config.ENRICHMENT_TIMEOUT,
+                default={
+                    'station_name': '',
+                    'station_addr': '',
+                    'walking_time': '',
+                    'walking_distance': '',
+                    'commutes': {},
+                    'to_science_park': None,
+                    'to_flux': None
+                }
+            ),
+            'woz_info': EnrichmentTask(
+                self.woz_service.get_woz_info, (address,),
+                timeout=self.config.ENRICHMENT_TIMEOUT, default=None
+            ),
+            'huispedia_url': EnrichmentTask(
+                self.huispedia_service.get_huispedia_url, (address,),
+                timeout=self.config.ENRICHMENT_TIMEOUT, default=''
+            )
+        }
         
         # 获取移民指数
-        postcode_match = re.search(r'(\d{4})[A-Z]{2}', house_data['address'])
+        postcode_match = re.search(r'(\d{4})[A-Z]{2}', address)
         if postcode_match:
-            postcode_prefix = postcode_match.group(1)
-            house_data['immigration_info'] = self.immigration_service.get_immigration_index(postcode_prefix)
+            tasks['immigration_info'] = EnrichmentTask(
+                self.immigration_service.get_immigration_index, (postcode_match.group(1),),
+                timeout=self.config.ENRICHMENT_TIMEOUT, default=no_immigration_info
+            )
         else:
-            house_data['immigration_info'] = "<p style='margin:0;color:#666;'>Geen immigratie informatie beschikbaar</p>"
+            house_data['immigration_info'] = no_immigration_info
         
-        # 获取Huispedia链接
-        house_data['huispedia_url'] = self.huispedia_service.get_huispedia_url(house_data['address'])
+        # 通勤检查时已经查过地图
+        if house_data.get('nearest_station'):
+            del tasks['nearest_station']
+        return tasks
+    
+    def fetch_details(self, house_data: dict):
+        """detailed阶段：抓取详情页；通勤不满足预筛选条件时返回None"""
+        tasks = self.lookup_tasks(house_data)
         
-        # 发布到GitHub Pages
-        filename = add_new_house(house_data)
-        house_data['filename'] = filename
+        # 按成本递进：设置了通勤上限时先查地图（批量预取后通常命中缓存），不满足则不再抓取详情页
+        if self.prefilter.checks_commute:
+            station = self.enrichment.run({'nearest_station': tasks.pop('nearest_station')})['nearest_station']
+            reason = self.prefilter.check_commute(station)
+            if reason:
+                self.archive_rejected(house_data, reason)
+                return None
+            house_data['nearest_station'] = station
         
-        # 转换为HouseInfo对象
-        return HouseInfo.from_dict(house_data)
+        # 其他查询在后台先开始，与抓取详情页重叠；enriched阶段直接等待这些进行中的查询
+        self._prefetched[house_data['url']] = self.enrichment.prefetch(tasks)
+        details, images, details_sections, agent_info = self.enrichment.run({
+            'details': EnrichmentTask(
+                self.house_processor.get_house_details, (house_data['url'],),
+                timeout=self.config.DETAIL_TIMEOUT, default=("", [], {}, {})
+            )
+        })['details']
+        house_data['details'] = details
+        house_data['images'] = images
+        house_data['details_sections'] = details_sections
+        house_data['agent_info'] = agent_info
+        return house_data
+    
+    def enrich(self, house_data: dict) -> dict:
+        """enriched阶段：外部查询、提取重要信息、解析数值字段并打分"""
+        # 重启后没有预取的查询，重新调用（通常命中缓存）
+        started = self._prefetched.pop(house_data['url'], None)
+        house_data.update(self.enrichment.run(self.lookup_tasks(house_data), started))
+        
+        # 提取重要信息
+        house_data['important_info'] = self.house_processor.extract_important_info(house_data['details_sections'])
+        # 数值字段只在入库时解析一次，随房源一起保存
+        house_data.update(ListingNumbers.parse(house_data).to_dict())
+        house_data['score'], house_data['score_percentile'] = self.scoring.rank(house_data)
+        return house_data
+    
+    def publish(self, house_data: dict) -> dict:
+        """published阶段：发布到GitHub Pages并记入索引"""
+        house_data['filename'] = add_new_house(house_data)
+        self.listing_index.record(house_data)
+        return house_data
+    
+    def run_job(self, job: Job) -> None:
+        """从任务最后完成的阶段继续处理一套房源，每完成一个阶段写一次检查点"""
+        queue = self.job_queue
+        if job.stage == 'parsed':
+            with metrics.timer('stage_parsed'):
+                outcome, house_data = self.screen_listing(job.data, job.id)
+            if outcome == SKIPPED:
+                metrics.inc('jobs_skipped')
+                return queue.checkpoint(job, SKIPPED, house_data)
+            if outcome == 'published':
+                queue.checkpoint(job, 'published', house_data)
+            else:
+                with metrics.timer('stage_detailed'):
+                    house_data = self.fetch_details(house_data)
+                if house_data is None:
+                    metrics.inc('jobs_skipped')
+                    return queue.checkpoint(job, SKIPPED)
+                queue.checkpoint(job, 'detailed', house_data)
+        elif job.stage in ('detailed', 'enriched'):
+            # 重启或重试后继续未发布的任务：重新登记为处理中；同一房源已由其他任务发布或正在处理时不再重复发布
+            known = self.listing_index.claim(job.data, job.id)
+            if known:
+                logger.info(f"House {job.data['url']} was {'claimed' if known.get('pending') else 'published'} "
+                            f"by another job, skipping {job}")
+                metrics.inc('jobs_skipped')
+                return queue.checkpoint(job, SKIPPED)
+        
+        if job.stage == 'detailed':
+            with metrics.timer('stage_enriched'):
+                house_data = self.enrich(job.data)
+            queue.checkpoint(job, 'enriched', house_data)
+        if job.stage == 'enriched':
+            queue.checkpoint(job, 'published', self.publish(job.data))
+        if job.stage == 'published':
+            # WhatsApp和邮件同时在后台发送；全部结束后才记为 DONE，进程在此之前退出时重启后重新通知
+            queue.checkpoint(job, NOTIFYING)
+            self.notifier.submit(HouseInfo.from_dict(job.data), on_done=lambda: self.finish_notifying(job))
+    
+    def finish_notifying(self, job: Job) -> None:
+        """一套房源的所有通知都已送达或放弃重试（在通知线程中调用）"""
+        if self.job_queue.finish_notifying(job):
+            metrics.inc('jobs_notified')
+    
+    def work(self) -> int:
+        """一个工作线程：不断领取可运行的任务直到队列中没有，返回处理的任务数"""
+        processed = 0
+        while True:
+            job = self.job_queue.claim()
+            if job is None:
+                return processed
+            processed += 1
+            try:
+                self.run_job(job)
+            except LeaseLost as e:
+                # 处理超过租约时长，任务已被其他工作线程接手，由它继续
+                logger.warning(f"Abandoning {job}: {str(e)}")
+            except Exception as e:
+                self.fail_job(job, e)
+    
+    def fail_job(self, job: Job, error: Exception) -> None:
+        """单个任务失败不影响其他任务；已完成的阶段保留，稍后从失败的阶段重试"""
+        try:
+            retry = self.job_queue.fail(job, f"{type(error).__name__}: {error}")
+        except LeaseLost as e:
+            logger.warning(f"{job} failed after losing its lease, leaving it to the new owner: {str(e)}")
+            return
+        metrics.inc('jobs_failed')
+        # 详情已抓取的任务继续占用登记，重复的提醒不会在重试前重新处理同一房源
+        if not retry or job.stage == 'parsed':
+            self.listing_index.release(job.data)
+        logger.error(f"{job} failed{', will retry later' if retry else ''}: {str(error)}", exc_info=True)
+    
+    def process_batch(self) -> int:
+        """增量取回新邮件并写入任务队列，然后用有界线程池处理队列中所有可运行的任务，返回处理的任务数"""
+        batch = self.email_handler.fetch_new_batch()
+        if batch:
+            # 房源写入持久化队列后即可推进UID高水位，之后的处理与邮箱无关
+            pending = [uid for uid, _ in batch]
+            for uid, listings in batch:
+                self.job_queue.enqueue(uid, listings)
+                self.email_handler.commit(uid, pending)
+            self.email_handler.mark_seen(pending)
+            
+            # 一次性为整批通过预筛选的新房源计算车站和通勤（distance matrix），各线程随后直接命中缓存
+            new_addresses = [
+                house_data['address'] for _, listings in batch for house_data in listings
+                if house_data.get('address') and not self.listing_index.is_known(house_data)
+                and not self.prefilter.check(house_data)
+            ]
+            if len(new_addresses) > 1:
+                self.maps_service.get_nearest_stations(new_addresses)
+        
+        workers = [self.batch_executor.submit(self.work) for _ in range(self.config.BATCH_WORKERS)]
+        processed = sum(worker.result() for worker in workers)
+        if processed:
+            logger.info(f"Batch finished: {processed} jobs run, queue: {self.job_queue.counts()}")
+        return processed
+    
+    def wait_for_new_mail(self) -> None:
+        """优先使用IMAP IDLE等待推送；服务器不支持或已禁用时回退到定时轮询"""
+        if self.config.IMAP_IDLE and self.email_handler.supports_idle():
+            if self.email_handler.wait_for_new_mail(self.config.IDLE_TIMEOUT):
+                logger.info("IMAP IDLE: new mail notification received")
+        else:
+            time.sleep(self.config.POLL_INTERVAL)
     
     def run(self):
         """主循环"""
         while True:
             try:
-                logger.info("Starting new check cycle...")
+                # 批量检查新邮件
+                if self.process_batch():
+                    # 每个有新任务的周期输出一行各阶段耗时摘要（包括之前空闲周期的样本）
+                    logger.info(f"Cycle summary: {metrics.cycle_summary()}")
                 
-                # 检查新邮件
-                for house_data in self.email_handler.check_email():
-                    if house_data:
-                        # 处理房屋信息
-                        house_info = self.process_house(house_data)
-                        
-                        # 发送WhatsApp消息
-                        self.whatsapp_service.send_house_info(house_info)
-                        
-                        # 发送邮件
-                        self.email_service.send_house_info(house_info)
-                
-                logger.info("Check cycle completed successfully")
-                # 每10秒检查一次
-                time.sleep(10)
+                # 等待新邮件到达
+                self.wait_for_new_mail()
                 
             except Exception as e:
                 logger.error(f"Error occurred: {str(e)}", exc_info=True)
@@ -138,7 +407,16 @@ class MakelaarslandProcessor:
 
 def main():
     processor = MakelaarslandProcessor()
-    processor.run()
+    try:
+        processor.run()
+    finally:
+        processor.notifier.stop(timeout=60)
+        stop_push_queue(timeout=60)
+        processor.email_handler.close()
+        processor.batch_executor.shutdown(wait=False, cancel_futures=True)
+        processor.enrichment.shutdown()
+        processor.house_processor.close()
+        metrics.stop_server()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,6 +1,123 @@
+import re
 from dataclasses import dataclass
 from typing import List, Dict, Optional
 
+# 千位分隔符至少出现一次才按分组匹配，否则整串数字（如 "€499500"）
+_PRICE_RE = re.compile(r'€\s*(\d{1,3}(?:[.,]\d{3})+|\d+)')
+_AREA_RE = re.compile(r'(\d+(?:\.\d{3})*)\s*m²')
+_ROOMS_RE = re.compile(r'(\d+)\s*kamers?')
+_YEAR_RE = re.compile(r'\b(1[5-9]\d\d|20\d\d)\b')
+_LABEL_RE = re.compile(r'(?<![A-Za-z])([A-G]\+*)(?![A-Za-z])')
+_HOURS_RE = re.compile(r'(\d+)\s*(?:uur|u\b|hours?|h\b)')
+_MINUTES_RE = re.compile(r'(\d+)\s*min')
+_WOZ_RE = re.compile(r'WOZ\s*(\d{4}):\s*€\s*([\d\.]+)')
+
+
+def parse_price(text: str) -> Optional[int]:
+    """"€ 499.500 k.k." -> 499500, "€499500" -> 499500, "€ 450,000" -> 450000, "€ 1.150.000,00" -> 1150000"""
+    m = _PRICE_RE.search(text or '')
+    return int(m.group(1).replace('.', '').replace(',', '')) if m else None
+
+
+def parse_area(text: str) -> Optional[int]:
+    """"118 m²" -> 118"""
+    m = _AREA_RE.search(text or '')
+    return int(m.group(1).replace('.', '')) if m else None
+
+
+def parse_rooms(text: str) -> Optional[int]:
+    """"5 kamers (4 slaapkamers)" -> 5"""
+    m = _ROOMS_RE.search(text or '')
+    return int(m.group(1)) if m else None
+
+
+def parse_year(text: str) -> Optional[int]:
+    m = _YEAR_RE.search(text or '')
+    return int(m.group(1)) if m else None
+
+
+def parse_energy_label(text: str) -> Optional[str]:
+    m = _LABEL_RE.search(text or '')
+    return m.group(1) if m else None
+
+
+def parse_woz(text: str) -> Optional[int]:
+    """WOZService返回的HTML中最近一年的WOZ值"""
+    values = [(int(year), int(amount.replace('.', ''))) for year, amount in _WOZ_RE.findall(text or '')]
+    return max(values)[1] if values else None
+
+
+def parse_minutes(text: str) -> Optional[int]:
+    """Google的时长文本，如 "1 uur 5 min." / "25 mins" -> 分钟数；"Niet beschikbaar" -> None"""
+    hours = _HOURS_RE.search(text or '')
+    minutes = _MINUTES_RE.search(text or '')
+    if not hours and not minutes:
+        return None
+    return (int(hours.group(1)) * 60 if hours else 0) + (int(minutes.group(1)) if minutes else 0)
+
+
+class ListingNumbers:
+    """入库时一次性解析出的数值字段，供筛选、排序和打分直接使用"""
+
+    __slots__ = ('price_eur', 'living_area_m2', 'plot_area_m2', 'rooms', 'build_year',
+                 'energy_label', 'woz_eur', 'walking_minutes', 'commute_minutes')
+
+    def __init__(self, price_eur=None, living_area_m2=None, plot_area_m2=None, rooms=None,
+                 build_year=None, energy_label=None, woz_eur=None, walking_minutes=None, commute_minutes=None):
+        self.price_eur = price_eur
+        self.living_area_m2 = living_area_m2
+        self.plot_area_m2 = plot_area_m2
+        self.rooms = rooms
+        self.build_year = build_year
+        self.energy_label = energy_label
+        self.woz_eur = woz_eur
+        self.walking_minutes = walking_minutes
+        # 通勤目标名称 -> 公共交通分钟数
+        self.commute_minutes = commute_minutes or {}
+
+    @classmethod
+    def parse(cls, data: Dict) -> 'ListingNumbers':
+        """从邮件和详情页的展示文本中解析"""
+        # size_rooms 形如 "118 m² • 152 m² • 4 kamers"，公寓没有地块面积
+        areas = [parse_area(part) for part in data.get('size_rooms', '').split('•')]
+        areas = [a for a in areas if a is not None]
+        important_info = data.get('important_info') or {}
+        station = data.get('nearest_station') or {}
+        commutes = station.get('commutes') or {}
+        if not commutes:
+            commutes = {name: station[key] for name, key in (('science_park', 'to_science_park'), ('flux', 'to_flux'))
+                        if station.get(key)}
+        commute_minutes = {}
+        for name, commute in commutes.items():
+            minutes = parse_minutes((commute or {}).get('duration'))
+            if minutes is not None:
+                commute_minutes[name] = minutes
+        return cls(
+            price_eur=parse_price(data.get('price')),
+            living_area_m2=areas[0] if areas else parse_area(important_info.get('Woonoppervlakte')),
+            plot_area_m2=areas[1] if len(areas) > 1 else None,
+            rooms=parse_rooms(data.get('size_rooms')) or parse_rooms(important_info.get('Aantal kamers')),
+            build_year=parse_year(important_info.get('Bouwjaar')),
+            energy_label=parse_energy_label(important_info.get('Energielabel')),
+            woz_eur=parse_woz(data.get('woz_info')),
+            walking_minutes=parse_minutes(station.get('walking_time')),
+            commute_minutes=commute_minutes
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ListingNumbers':
+        """读取已解析的字段；旧记录没有这些字段时重新解析"""
+        if 'price_eur' not in data:
+            return cls.parse(data)
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"ListingNumbers({fields})"
+
 @dataclass
 class StationInfo:
     name: str
@@ -9,6 +126,8 @@ class StationInfo:
     walking_distance: str
     to_science_park: Optional[Dict]
     to_flux: Optional[Dict]
+    # 所有配置的通勤目标：名称 -> 通勤信息
+    commutes: Optional[Dict] = None
 
 @dataclass
 class HouseInfo:
@@ -28,6 +147,10 @@ class HouseInfo:
     immigration_info: Optional[str]
     huispedia_url: Optional[str]
     filename: Optional[str]
+    numbers: Optional[ListingNumbers] = None
+    # 与历史房源比较的得分和百分位（0-100，越高越好）
+    score: Optional[float] = None
+    score_percentile: Optional[float] = None
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'HouseInfo':
@@ -39,7 +162,8 @@ class HouseInfo:
             walking_time=station_data.get('walking_time', ''),
             walking_distance=station_data.get('walking_distance', ''),
             to_science_park=station_data.get('to_science_park'),
-            to_flux=station_data.get('to_flux')
+            to_flux=station_data.get('to_flux'),
+            commutes=station_data.get('commutes')
         )
         
         return cls(
@@ -58,5 +182,8 @@ class HouseInfo:
             woz_info=data.get('woz_info'),
             immigration_info=data.get('immigration_info'),
             huispedia_url=data.get('huispedia_url'),
-            filename=data.get('filename')
+            filename=data.get('filename'),
+            numbers=ListingNumbers.from_dict(data),
+            score=data.get('score'),
+            score_percentile=data.get('score_percentile')
         ) 
\ No newline at end of file
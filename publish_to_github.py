@@ -1,15 +1,117 @@
 import os
 import json
 import datetime
-from jinja2 import Template
+import hashlib
+from jinja2 import Environment, Template, meta
 import subprocess
 import re
+import threading
+from core.listing_store import ListingStore
+from utils.metrics import metrics
+from utils.logging_config import logger
 
 # 配置
 REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'makelaarsland-houses'))  # 指向子仓库目录
 HOUSE_TEMPLATE = os.path.join(REPO_PATH, 'house_template.html')
 INDEX_TEMPLATE = os.path.join(REPO_PATH, 'index_template.html')
-HOUSES_JSON = os.path.join(REPO_PATH, 'houses.json')  # 存储所有房源信息
+HOUSES_JSON = os.path.join(REPO_PATH, 'houses.json')  # 旧版：所有房源的JSON数组，仅用于迁移
+# 只追加的JSONL记录（同一文件名后出现的是更新），随页面提交到Pages仓库，作为 LISTINGS_DB 的版本化备份；
+# 本地数据库丢失时从它重新导入
+HOUSES_STORE = os.path.join(REPO_PATH, 'houses.jsonl')
+LISTINGS_DB = os.getenv('LISTINGS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'listings.db'))
+INDEX_PAGE_SIZE = int(os.getenv('INDEX_PAGE_SIZE', '50'))  # 主页及每个归档页的房源数
+
+# 批量并发处理时，存储的读写和 git 操作需要串行
+_publish_lock = threading.Lock()
+
+# 已编译的模板：路径 -> (修改时间, Template, 模板用到的变量)
+_templates = {}
+# 主页模板需要渲染这些变量才能链接到归档页
+PAGINATION_VARIABLES = {'archive_pages', 'prev_page'}
+# 已写入文件的内容哈希：路径 -> sha1
+_written_hashes = {}
+# 房源存储，首次使用时打开
+_store = None
+# 已确认存在的归档页数量
+_archived_pages = 0
+
+def _load_template(path):
+    """按修改时间缓存已编译的模板及其用到的变量"""
+    mtime = os.path.getmtime(path)
+    cached = _templates.get(path)
+    if cached and cached[0] == mtime:
+        return cached
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    variables = meta.find_undeclared_variables(Environment().parse(source))
+    _templates[path] = (mtime, Template(source), variables)
+    if path == INDEX_TEMPLATE and not PAGINATION_VARIABLES <= variables:
+        logger.warning(f"[Publish] {path} does not render archive_pages/prev_page, "
+                       f"listing all houses on index.html instead of paginating")
+    return _templates[path]
+
+def _get_template(path):
+    return _load_template(path)[1]
+
+def _paginated():
+    """主页模板是否渲染了归档页链接；旧模板没有时主页仍列出全部房源，否则较早的房源无法访问"""
+    return PAGINATION_VARIABLES <= _load_template(INDEX_TEMPLATE)[2]
+
+def _write_if_changed(path, content):
+    """内容哈希未变化时跳过写入，返回是否写入"""
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    if path not in _written_hashes and os.path.exists(path):
+        with open(path, 'rb') as f:
+            _written_hashes[path] = hashlib.sha1(f.read()).hexdigest()
+    if _written_hashes.get(path) == digest:
+        return False
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    _written_hashes[path] = digest
+    return True
+
+def get_store():
+    """打开房源存储；存储为空时从 houses.jsonl（或旧版 houses.json）导入，并保证 houses.jsonl 是完整的备份"""
+    global _store
+    if _store is None:
+        _store = ListingStore(LISTINGS_DB)
+        if _store.count() == 0:
+            exists = lambda filename: os.path.exists(os.path.join(REPO_PATH, filename))
+            if not _store.import_legacy(HOUSES_STORE, exists):
+                _store.import_legacy(HOUSES_JSON, exists)
+        if _store.count():
+            _ensure_backup(_store)
+    return _store
+
+def _backed_up_filenames():
+    if not os.path.exists(HOUSES_STORE):
+        return set()
+    with open(HOUSES_STORE, encoding='utf-8') as f:
+        return {json.loads(line).get('filename') for line in f if line.strip()}
+
+def _ensure_backup(store):
+    """houses.jsonl 缺少数据库中的房源时重新完整导出；之后旧版 houses.json 不再需要"""
+    if not _backed_up_filenames() >= {house['filename'] for house in store.iter_summaries()}:
+        tmp_path = HOUSES_STORE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for house in store.iter_records():
+                f.write(json.dumps(house, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, HOUSES_STORE)
+        logger.info(f"[Publish] Exported {store.count()} listings to {os.path.basename(HOUSES_STORE)}")
+    # houses.json 已不再更新，留在Pages仓库中会被误当作最新数据；删除随下一次发布提交（历史中仍可找回）
+    if os.path.exists(HOUSES_JSON):
+        os.remove(HOUSES_JSON)
+        logger.info(f"[Publish] Removed {os.path.basename(HOUSES_JSON)}, listings are backed up in "
+                    f"{os.path.basename(HOUSES_STORE)}")
+
+def _append_backup(house):
+    """把新增或更新后的房源追加到 houses.jsonl（O(1)，不重写历史记录），随页面一起提交"""
+    with open(HOUSES_STORE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(house, ensure_ascii=False) + '\n')
+
+def load_house(filename):
+    """从存储中读取某套房源的完整最新记录"""
+    return get_store().get(filename)
 
 # 1. 渲染房源详情页
 
@@ -30,61 +132,217 @@ def render_house_page(house, filename):
         elif current_section:
             other_info[current_section].append(para)
     house['other_info'] = other_info
-    # 读取并渲染模板
-    with open(HOUSE_TEMPLATE, encoding='utf-8') as f:
-        template = Template(f.read())
-    html = template.render(**house)
-    with open(os.path.join(REPO_PATH, filename), 'w', encoding='utf-8') as f:
-        f.write(html)
-
-# 2. 渲染主页面
-
-def render_index_page(houses):
-    # 过滤掉不存在的房屋页面
-    valid_houses = []
-    for house in houses:
-        house_file = os.path.join(REPO_PATH, house['filename'])
-        if os.path.exists(house_file):
-            valid_houses.append(house)
-    
-    with open(INDEX_TEMPLATE, encoding='utf-8') as f:
-        template = Template(f.read())
-    html = template.render(houses=valid_houses)
-    with open(os.path.join(REPO_PATH, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(html)
+    # 渲染模板
+    html = _get_template(HOUSE_TEMPLATE).render(**house)
+    return _write_if_changed(os.path.join(REPO_PATH, filename), html)
+
+# 2. 渲染主页面（分页）
+#
+# index.html 只显示最新的 INDEX_PAGE_SIZE 套房源；更早的房源按发布顺序每 INDEX_PAGE_SIZE 套
+# 固定成一个归档页 page_<n>.html。归档页写满后内容不再变化，所以每次发布只需重写主页。
+
+def _archive_filename(page):
+    return f"page_{page}.html"
+
+def _render_archive_page(page):
+    # 归档页只链接到更早的一页和主页，写满后不会因为新房源而变化
+    html = _get_template(INDEX_TEMPLATE).render(
+        houses=get_store().page(page, INDEX_PAGE_SIZE),
+        page=page,
+        archive_pages=[],
+        prev_page=_archive_filename(page - 1) if page > 1 else None,
+        next_page='index.html'
+    )
+    return _write_if_changed(os.path.join(REPO_PATH, _archive_filename(page)), html)
+
+def render_index_page():
+    store = get_store()
+    if not _paginated():
+        html = _get_template(INDEX_TEMPLATE).render(
+            houses=store.latest(store.count()),
+            page=None,
+            archive_pages=[],
+            prev_page=None,
+            next_page=None
+        )
+        return _write_if_changed(os.path.join(REPO_PATH, 'index.html'), html)
+    full_pages = store.count() // INDEX_PAGE_SIZE
+    html = _get_template(INDEX_TEMPLATE).render(
+        houses=store.latest(INDEX_PAGE_SIZE),
+        page=None,
+        archive_pages=[_archive_filename(p) for p in range(full_pages, 0, -1)],
+        prev_page=_archive_filename(full_pages) if full_pages else None,
+        next_page=None
+    )
+    return _write_if_changed(os.path.join(REPO_PATH, 'index.html'), html)
+
+def _render_pages_for(position):
+    """某个位置的房源新增或更新后，只重写受影响的页面"""
+    global _archived_pages
+    render_index_page()
+    if not _paginated():
+        return
+    full_pages = get_store().count() // INDEX_PAGE_SIZE
+    # 新写满的归档页（包括迁移后第一次运行时的历史页）
+    for page in range(_archived_pages + 1, full_pages + 1):
+        if not os.path.exists(os.path.join(REPO_PATH, _archive_filename(page))):
+            _render_archive_page(page)
+    _archived_pages = full_pages
+    page = position // INDEX_PAGE_SIZE + 1
+    if page <= full_pages:
+        _render_archive_page(page)
 
 # 3. 自动git add/commit/push
 
-def git_push(commit_msg):
+@metrics.timed('git_commit')
+def git_commit(commit_msg):
     subprocess.run(['git', 'add', '.'], cwd=REPO_PATH)
     subprocess.run(['git', 'commit', '-m', commit_msg], cwd=REPO_PATH)
-    subprocess.run(['git', 'push'], cwd=REPO_PATH)
+
+@metrics.timed('git_push')
+def git_push(commit_msg=None):
+    """提交（如有消息）并推送，返回推送是否成功"""
+    if commit_msg:
+        git_commit(commit_msg)
+    return subprocess.run(['git', 'push'], cwd=REPO_PATH).returncode == 0
+
+class GitPushQueue:
+    """后台发布队列：把一个时间窗口内写入的页面合并成一次commit和push，失败时退避重试"""
+
+    def __init__(self, window=30, max_backoff=600):
+        self.window = window
+        self.max_backoff = max_backoff
+        self._messages = []
+        self._unpushed = False
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='git-push', daemon=True)
+        self._thread.start()
+
+    def submit(self, commit_msg):
+        """登记一次待发布的修改，立即返回"""
+        with self._cond:
+            self._messages.append(commit_msg)
+            self._cond.notify()
+
+    def _commit_pending(self):
+        with self._cond:
+            messages, self._messages = self._messages, []
+        if not messages:
+            return
+        if len(messages) == 1:
+            commit_msg = messages[0]
+        else:
+            commit_msg = f"publish {len(messages)} updates\n\n" + '\n'.join(f"- {m}" for m in messages)
+        # 提交时持有发布锁，避免把写到一半的页面提交进去；推送在锁外进行
+        with _publish_lock:
+            git_commit(commit_msg)
+        self._unpushed = True
+
+    def _run(self):
+        backoff = self.window
+        while True:
+            with self._cond:
+                while not self._messages and not self._unpushed and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._messages and not self._unpushed:
+                    return
+                # 收集窗口期内的其他修改
+                if self._messages and not self._stopping:
+                    self._cond.wait(self.window)
+            self._commit_pending()
+            if git_push():
+                self._unpushed = False
+                backoff = self.window
+            else:
+                if self._stopping:
+                    logger.error("[Publish] git push failed while stopping, commits remain local")
+                    return
+                logger.warning(f"[Publish] git push failed, retrying in {backoff}s")
+                with self._cond:
+                    self._cond.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def stop(self, timeout=None):
+        """提交并推送剩余的修改后停止"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+_push_queue = None
+
+def start_push_queue(window=30):
+    """启用后台发布；之后的新增和更新都只登记到队列，不再同步推送"""
+    global _push_queue
+    if _push_queue is None:
+        _push_queue = GitPushQueue(window)
+    return _push_queue
+
+def stop_push_queue(timeout=None):
+    global _push_queue
+    if _push_queue is not None:
+        _push_queue.stop(timeout)
+        _push_queue = None
+
+def _publish(commit_msg):
+    if _push_queue is not None:
+        _push_queue.submit(commit_msg)
+    else:
+        git_push(commit_msg)
 
 # 4. 新增房源并发布
 
+@metrics.timed('publish')
 def add_new_house(house_info):
-    # 生成唯一文件名
+    with _publish_lock:
+        return _add_new_house(house_info)
+
+def _add_new_house(house_info):
+    # 生成唯一文件名（同一秒内发布多套房源时追加序号）
     now = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"house_{now}.html"
+    suffix = 1
+    while os.path.exists(os.path.join(REPO_PATH, filename)):
+        suffix += 1
+        filename = f"house_{now}_{suffix}.html"
     house_info['filename'] = filename
 
-    # 读取/更新houses.json
-    if os.path.exists(HOUSES_JSON):
-        with open(HOUSES_JSON, encoding='utf-8') as f:
-            houses = json.load(f)
-    else:
-        houses = []
-    houses.insert(0, house_info)  # 新房源放最前
-    with open(HOUSES_JSON, 'w', encoding='utf-8') as f:
-        json.dump(houses, f, ensure_ascii=False, indent=2)
+    # 追加到存储（O(1)，不重写历史记录）
+    store = get_store()
+    store.insert(house_info)
+    _append_backup(house_info)
 
-    # 渲染详情页和主页面
+    # 渲染详情页和受影响的列表页
     render_house_page(house_info, filename)
-    render_index_page(houses)
-    # 推送到GitHub
-    git_push(f"add house: {house_info.get('title', '')}")
+    _render_pages_for(store.position(filename))
+    # 推送到GitHub（启用后台队列时立即返回，文件名即为稳定的页面地址）
+    _publish(f"add house: {house_info.get('title', '')}")
     return filename
 
+# 5. 更新已发布房源中可能变化的字段（如价格）
+
+@metrics.timed('publish_update')
+def update_house(filename, changes):
+    with _publish_lock:
+        return _update_house(filename, changes)
+
+def _update_house(filename, changes):
+    store = get_store()
+    house = store.get(filename)
+    if house is None:
+        return None
+    if all(house.get(k) == v for k, v in changes.items()):
+        return house
+    house = store.update(filename, changes)
+    _append_backup(house)
+
+    changed = render_house_page(house, filename)
+    _render_pages_for(store.position(filename))
+    if changed:
+        _publish(f"update house: {house.get('title', '')}")
+    return house
+
 # 示例用法（你可以在主流程里调用这个函数）
 if __name__ == '__main__':
     # 示例房源数据
@@ -102,4 +360,4 @@ if __name__ == '__main__':
             'distance': '1.2 km'
         }
     }
-    add_new_house(house_info) 
\ No newline at end of file
+    add_new_house(house_info)
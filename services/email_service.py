@@ -1,7 +1,6 @@
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from utils.logging_config import logger
 from models.house import HouseInfo
 
 class EmailService:
@@ -14,69 +13,104 @@ class EmailService:
         """从HouseInfo对象获取GitHub Pages URL"""
         return f"https://guozc12.github.io/makelaarsland-houses/{house_info.filename}"
     
-    def send_house_info(self, house_info: HouseInfo) -> None:
-        """发送房屋信息到邮件"""
-        logger.info("Starting email message preparation...")
-        try:
-            # 获取GitHub Pages URL
-            github_pages_url = self._get_github_pages_url(house_info)
-            
-            # 构建HTML内容
-            html_content = f"""
-            <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <h2 style="color: #2c3e50;">🏠 New House Alert!</h2>
-                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin-bottom: 20px;">
-                    <h3 style="color: #2c3e50; margin-top: 0;">{house_info.title}</h3>
-                    <p><strong>Address:</strong> {house_info.address}</p>
-                    <p><strong>Price:</strong> {house_info.price}</p>
-                    <p><strong>Details:</strong> {house_info.size_rooms}</p>
-                    <p><strong>Agent:</strong> {house_info.agent}</p>
+    @staticmethod
+    def _score_html(house_info: HouseInfo) -> str:
+        """单条通知和摘要共用的评分行；没有评分时为空"""
+        if house_info.score_percentile is None:
+            return ""
+        return f"""
+                <p><strong>Score:</strong> better than {house_info.score_percentile:.0f}% of earlier listings</p>
             """
-            
-            if house_info.nearest_station:
-                station_info = house_info.nearest_station
-                html_content += f"""
-                    <div style="background-color: #e8f4f8; padding: 15px; border-radius: 8px; margin-top: 15px;">
-                        <h4 style="color: #2c3e50; margin-top: 0;">🚉 Nearest Station</h4>
-                        <p><strong>Name:</strong> {station_info.name}</p>
-                        <p><strong>Distance:</strong> {station_info.walking_distance}</p>
-                        <p><strong>Walking Time:</strong> {station_info.walking_time}</p>
-                    </div>
-                """
-            
+    
+    def render_html(self, house_info: HouseInfo) -> str:
+        """生成邮件HTML正文；所有收件人共用"""
+        # 获取GitHub Pages URL
+        github_pages_url = self._get_github_pages_url(house_info)
+        
+        # 构建HTML内容
+        html_content = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <h2 style="color: #2c3e50;">🏠 New House Alert!</h2>
+            <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin-bottom: 20px;">
+                <h3 style="color: #2c3e50; margin-top: 0;">{house_info.title}</h3>
+                <p><strong>Address:</strong> {house_info.address}</p>
+                <p><strong>Price:</strong> {house_info.price}</p>
+                <p><strong>Details:</strong> {house_info.size_rooms}</p>
+                <p><strong>Agent:</strong> {house_info.agent}</p>
+        """
+        
+        html_content += self._score_html(house_info)
+        
+        if house_info.nearest_station:
+            station_info = house_info.nearest_station
             html_content += f"""
-                    <p style="margin-top: 20px;">
-                        <a href="{github_pages_url}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">
-                            View Details
-                        </a>
-                    </p>
+                <div style="background-color: #e8f4f8; padding: 15px; border-radius: 8px; margin-top: 15px;">
+                    <h4 style="color: #2c3e50; margin-top: 0;">🚉 Nearest Station</h4>
+                    <p><strong>Name:</strong> {station_info.name}</p>
+                    <p><strong>Distance:</strong> {station_info.walking_distance}</p>
+                    <p><strong>Walking Time:</strong> {station_info.walking_time}</p>
                 </div>
-            </body>
-            </html>
             """
-            
-            # 发送邮件给每个收件人
-            for recipient in self.recipients:
-                try:
-                    # Create a new message for each recipient
-                    message = MIMEMultipart()
-                    message['From'] = self.email
-                    message['To'] = recipient
-                    message['Subject'] = f"🏠 New House Alert: {house_info.title}"
-                    message.attach(MIMEText(html_content, 'html'))
-                    
-                    logger.info(f"Sending email to: {recipient}")
-                    
-                    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                        server.login(self.email, self.password)
-                        server.send_message(message)
-                    
-                    logger.info(f"Email sent successfully to {recipient}")
-                except Exception as e:
-                    logger.error(f"Failed to send email to {recipient}: {str(e)}")
-                    continue
-                
-        except Exception as e:
-            logger.error(f"Error in email message preparation: {str(e)}")
-            raise 
\ No newline at end of file
+        
+        html_content += f"""
+                <p style="margin-top: 20px;">
+                    <a href="{github_pages_url}" style="background-color: #3498db; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">
+                        View Details
+                    </a>
+                </p>
+            </div>
+        </body>
+        </html>
+        """
+        return html_content
+    
+    def render_digest_html(self, house_infos: list) -> str:
+        """生成摘要邮件：每套房源一个简短卡片，链接到GitHub Pages详情页"""
+        html_content = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <h2 style="color: #2c3e50;">🏠 {len(house_infos)} New House Alerts</h2>
+        """
+        for house_info in house_infos:
+            html_content += f"""
+            <div style="background-color: #f8f9fa; padding: 15px; border-radius: 8px; margin-bottom: 15px;">
+                <h3 style="color: #2c3e50; margin-top: 0;">{house_info.title}</h3>
+                <p><strong>Price:</strong> {house_info.price} &nbsp; <strong>Details:</strong> {house_info.size_rooms}</p>
+            """
+            html_content += self._score_html(house_info)
+            html_content += f"""
+                <p><a href="{self._get_github_pages_url(house_info)}">View Details</a></p>
+            </div>
+            """
+        html_content += """
+        </body>
+        </html>
+        """
+        return html_content
+    
+    @staticmethod
+    def subject(house_info: HouseInfo) -> str:
+        return f"🏠 New House Alert: {house_info.title}"
+    
+    @staticmethod
+    def digest_subject(house_infos: list) -> str:
+        return f"🏠 {len(house_infos)} New House Alerts"
+    
+    def build_message(self, subject: str, html_content: str, recipient: str) -> MIMEMultipart:
+        message = MIMEMultipart()
+        message['From'] = self.email
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.attach(MIMEText(html_content, 'html'))
+        return message
+    
+    def connect(self) -> smtplib.SMTP_SSL:
+        """建立并登录一个SMTP会话，可连续发送多封邮件"""
+        server = smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=30)
+        try:
+            server.login(self.email, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
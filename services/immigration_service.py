@@ -1,8 +1,18 @@
 import requests
 from bs4 import BeautifulSoup
 from utils.logging_config import logger
+from utils.cache import TTLCache
+from utils.metrics import metrics
+
+DAY = 24 * 3600
+NO_IMMIGRATION_INFO = "<p style='margin:0;color:#666;'>Geen immigratie informatie beschikbaar</p>"
+
 
 class ImmigrationService:
+    def __init__(self, cache_file: str = 'cache.sqlite3', ttl_days: float = 90, negative_ttl_days: float = 7):
+        # 数据按邮编前4位统计，同一区域的房源共用一次查询
+        self.cache = TTLCache(cache_file, 'immigration', ttl_days * DAY, negative_ttl=negative_ttl_days * DAY)
+
     def get_immigration_index(self, postcode: str) -> str:
         """
         从 allochtonenmeter.nl 获取移民指数数据
@@ -10,43 +20,46 @@ class ImmigrationService:
         :return: 移民指数数据HTML字符串
         """
         try:
-            logger.info(f"[Immigration] 获取邮编 {postcode} 的移民数据...")
-            url = f"http://www.allochtonenmeter.nl/?postcode={postcode}"
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            logger.info("[Immigration] 解析页面内容...")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 查找结果表格
-            table = soup.find('table')
-            if table:
-                logger.info("[Immigration] 找到数据表格，开始提取...")
-                # 提取表格数据并重新格式化
-                rows = table.find_all('tr')
-                logger.info(f"[Immigration] 找到 {len(rows)} 行数据")
-                
-                immigration_html = "<table style='width:100%;border-collapse:collapse;'>"
-                for i, row in enumerate(rows):
-                    cells = row.find_all(['td', 'th'])
-                    if cells:
-                        logger.info(f"[Immigration] 处理第 {i+1} 行，包含 {len(cells)} 个单元格")
-                        immigration_html += "<tr>"
-                        for cell in cells:
-                            cell_text = cell.get_text(strip=True)
-                            logger.info(f"[Immigration] 单元格内容: {cell_text}")
-                            immigration_html += f"<td>{cell_text}</td>"
-                        immigration_html += "</tr>"
-                immigration_html += "</table>"
-                logger.info("[Immigration] 表格数据提取完成")
-                return immigration_html
-            else:
-                logger.info("[Immigration] 未找到数据表格")
-                return "<p style='margin:0;color:#666;'>Geen immigratie informatie beschikbaar</p>"
-                
+            return self.cache.get_or_set(postcode, lambda: self._fetch(postcode)) or NO_IMMIGRATION_INFO
         except Exception as e:
             logger.error(f"[Immigration] 发生错误: {str(e)}")
             logger.error(f"[Immigration] 错误类型: {type(e).__name__}")
             import traceback
             logger.error(f"[Immigration] 错误堆栈: {traceback.format_exc()}")
-            return "<p style='margin:0;color:#666;'>Geen immigratie informatie beschikbaar</p>" 
\ No newline at end of file
+            return NO_IMMIGRATION_INFO
+
+    @metrics.timed('immigration')
+    def _fetch(self, postcode: str) -> str:
+        """抓取并提取数据表格；页面没有表格时返回空字符串，网络错误抛出异常（不缓存）"""
+        logger.info(f"[Immigration] 获取邮编 {postcode} 的移民数据...")
+        url = f"http://www.allochtonenmeter.nl/?postcode={postcode}"
+        response = requests.get(url, timeout=15)
+        response.raise_for_status()
+
+        logger.debug("[Immigration] 解析页面内容...")
+        soup = BeautifulSoup(response.text, 'html.parser')
+
+        # 查找结果表格
+        table = soup.find('table')
+        if not table:
+            logger.info(f"[Immigration] 邮编 {postcode} 未找到数据表格")
+            return ''
+
+        # 提取表格数据并重新格式化
+        rows = table.find_all('tr')
+        logger.debug(f"[Immigration] 找到 {len(rows)} 行数据")
+
+        immigration_html = "<table style='width:100%;border-collapse:collapse;'>"
+        for i, row in enumerate(rows):
+            cells = row.find_all(['td', 'th'])
+            if cells:
+                logger.debug(f"[Immigration] 处理第 {i+1} 行，包含 {len(cells)} 个单元格")
+                immigration_html += "<tr>"
+                for cell in cells:
+                    cell_text = cell.get_text(strip=True)
+                    logger.debug(f"[Immigration] 单元格内容: {cell_text}")
+                    immigration_html += f"<td>{cell_text}</td>"
+                immigration_html += "</tr>"
+        immigration_html += "</table>"
+        logger.debug("[Immigration] 表格数据提取完成")
+        return immigration_html
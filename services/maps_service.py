@@ -1,35 +1,83 @@
 from googlemaps import Client
 from datetime import datetime, timedelta
 from utils.logging_config import logger
+from utils.cache import TTLCache
+from utils.metrics import metrics
+
+DAY = 24 * 3600
+
+# Distance Matrix API 单次请求的限制
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_ELEMENTS = 100
+
+# 默认通勤目标：名称 -> 地址
+DEFAULT_COMMUTE_TARGETS = {
+    'science_park': 'Science Park 904, 1098 XH Amsterdam, Netherlands',
+    'flux': 'De Groene Loper 19, 5612 AP Eindhoven, Netherlands'
+}
 
 class MapsService:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_file: str = 'cache.sqlite3', cell_precision: int = 3,
+                 geocode_ttl_days: float = 90, station_ttl_days: float = 30, commute_ttl_days: float = 7,
+                 commute_targets: dict = None, station_index=None, station_index_max_km: float = 3):
         self.gmaps = Client(key=api_key)
+        # 本地车站索引；提供时先离线查找最近车站，索引中最近的车站超过 station_index_max_km 公里时
+        # 认为索引可能缺少附近的车站，仍调用places_nearby
+        self.station_index = station_index
+        self.station_index_max_km = station_index_max_km
+        self.commute_targets = commute_targets or DEFAULT_COMMUTE_TARGETS
+        # 经纬度四舍五入到多少位小数作为网格（3位约100米）
+        self.cell_precision = cell_precision
+        self.geocode_cache = TTLCache(cache_file, 'geocode', geocode_ttl_days * DAY)
+        self.station_cache = TTLCache(cache_file, 'nearest_station', station_ttl_days * DAY)
+        self.commute_cache = TTLCache(cache_file, 'commute', commute_ttl_days * DAY)
+    
+    def _default_departure_time(self) -> int:
+        # 默认下周二早上9点
+        today = datetime.now()
+        days_ahead = (1 - today.weekday() + 7) % 7  # 1=Tuesday
+        if days_ahead == 0:
+            days_ahead = 7
+        next_tuesday = today + timedelta(days=days_ahead)
+        commute_time = next_tuesday.replace(hour=9, minute=0, second=0, microsecond=0)
+        return int(commute_time.timestamp())
+    
+    def _cell(self, location: dict) -> str:
+        return f"{round(location['lat'], self.cell_precision)},{round(location['lng'], self.cell_precision)}"
+    
+    def geocode(self, address: str):
+        """地址转经纬度，按地址缓存"""
+        key = ' '.join(address.lower().split())
+        
+        def load():
+            with metrics.timer('maps_geocode'):
+                results = self.gmaps.geocode(address)
+            return (results or [{}])[0].get('geometry', {}).get('location')
+        return self.geocode_cache.get_or_set(key, load)
     
     def get_commute_time(self, origin: str, destination: str, mode: str = 'transit', departure_time: int = None) -> dict:
         """查询指定出发时间的通勤信息"""
         if departure_time is None:
-            # 默认下周二早上9点
-            today = datetime.now()
-            days_ahead = (1 - today.weekday() + 7) % 7  # 1=Tuesday
-            if days_ahead == 0:
-                days_ahead = 7
-            next_tuesday = today + timedelta(days=days_ahead)
-            commute_time = next_tuesday.replace(hour=9, minute=0, second=0, microsecond=0)
-            departure_time = int(commute_time.timestamp())
+            departure_time = self._default_departure_time()
         
         try:
-            directions = self.gmaps.directions(
-                origin,
-                destination,
-                mode=mode,
-                departure_time=departure_time,
-                region='nl',
-                language='nl'
-            )
+            cache_key = self._commute_key(origin, destination, mode, departure_time)
+            cached = self.commute_cache.get(cache_key)
+            if cached:
+                return cached
+            
+            with metrics.timer('maps_directions'):
+                directions = self.gmaps.directions(
+                    origin,
+                    destination,
+                    mode=mode,
+                    departure_time=departure_time,
+                    region='nl',
+                    language='nl'
+                )
             if directions and len(directions) > 0:
                 leg = directions[0]['legs'][0]
-                return {
+                result = {
                     'duration': leg['duration']['text'],
                     'distance': leg['distance']['text'],
                     'start_address': leg['start_address'],
@@ -37,62 +85,174 @@ class MapsService:
                     'summary': directions[0].get('summary', ''),
                     'mode': mode
                 }
+                self.commute_cache.set(cache_key, result)
+                return result
         except Exception as e:
             logger.error(f"Error in get_commute_time: {str(e)}")
+            return self._unavailable(origin, destination, mode)
+    
+    def _find_station(self, location: dict) -> dict:
+        """查找最近的火车站：优先使用本地车站索引，索引中没有足够近的车站时调用places_nearby并按网格缓存"""
+        nearest = self.station_index.nearest(location['lat'], location['lng']) if self.station_index else None
+        if nearest and nearest[0][0] <= self.station_index_max_km:
+            distance_km, station = nearest[0]
             return {
-                'duration': 'Niet beschikbaar',
-                'distance': 'Niet beschikbaar',
-                'start_address': origin,
-                'end_address': destination,
-                'summary': '',
-                'mode': mode
+                'name': station['name'],
+                'vicinity': '',
+                # 用坐标作为步行终点，避免Google对车站名称再做一次模糊匹配
+                'destination': f"{station['lat']},{station['lng']}",
+                'distance_km': round(distance_km, 2)
             }
+        
+        def load():
+            with metrics.timer('maps_places'):
+                stations = self.gmaps.places_nearby(
+                    location=location,
+                    radius=5000,
+                    type='train_station',
+                    language='nl'
+                )
+            if not stations['results']:
+                return None
+            nearest = stations['results'][0]
+            return {'name': nearest['name'], 'vicinity': nearest.get('vicinity', '')}
+        return self.station_cache.get_or_set(self._cell(location), load)
     
-    def get_nearest_station(self, address: str) -> dict:
-        """获取到最近火车站的距离，并查两大通勤点"""
+    def _unavailable(self, origin: str, destination: str, mode: str) -> dict:
+        return {
+            'duration': 'Niet beschikbaar',
+            'distance': 'Niet beschikbaar',
+            'start_address': origin,
+            'end_address': destination,
+            'summary': '',
+            'mode': mode
+        }
+    
+    def _commute_key(self, origin: str, destination: str, mode: str, departure_time: int) -> str:
+        # 缓存键：起点网格、终点、出行方式、出发时段（星期+小时）
+        location = self.geocode(origin)
+        slot = datetime.fromtimestamp(departure_time).strftime('%a%H')
+        origin_key = self._cell(location) if location else ' '.join(origin.lower().split())
+        return f"{origin_key}|{destination}|{mode}|{slot}"
+    
+    def get_commute_matrix(self, origins: list, destinations: list, mode: str = 'transit', departure_time: int = None) -> list:
+        """用distance matrix一次计算多个起点到多个终点的通勤，返回 results[起点序号][终点] = 通勤信息"""
+        if departure_time is None:
+            departure_time = self._default_departure_time()
+        
+        results = [{} for _ in origins]
+        # 起点 -> {缺失的终点: 缓存键}；重复的起点只查询一次
+        missing = {}
+        indexes = {}
+        for i, origin in enumerate(origins):
+            indexes.setdefault(origin, []).append(i)
+            for destination in destinations:
+                key = self._commute_key(origin, destination, mode, departure_time)
+                cached = self.commute_cache.get(key)
+                if cached:
+                    results[i][destination] = cached
+                else:
+                    missing.setdefault(origin, {})[destination] = key
+        if not missing:
+            return results
+        
+        # 按缺失的终点组合分组，每组发一次请求；每次请求最多25个起点、100个元素
+        groups = {}
+        for origin, keys in missing.items():
+            groups.setdefault(tuple(keys), []).append(origin)
+        for group_destinations, group_origins in groups.items():
+            chunk_size = max(1, min(MATRIX_MAX_ORIGINS, MATRIX_MAX_ELEMENTS // len(group_destinations)))
+            for start in range(0, len(group_origins), chunk_size):
+                chunk = group_origins[start:start + chunk_size]
+                try:
+                    with metrics.timer('maps_distance_matrix'):
+                        matrix = self.gmaps.distance_matrix(
+                            chunk,
+                            list(group_destinations),
+                            mode=mode,
+                            departure_time=departure_time,
+                            region='nl',
+                            language='nl'
+                        )
+                except Exception as e:
+                    logger.error(f"Error in get_commute_matrix: {str(e)}")
+                    matrix = None
+                for row_index, origin in enumerate(chunk):
+                    row = matrix['rows'][row_index]['elements'] if matrix else []
+                    for col_index, destination in enumerate(group_destinations):
+                        element = row[col_index] if col_index < len(row) else {}
+                        if element.get('status') == 'OK':
+                            result = {
+                                'duration': element['duration']['text'],
+                                'distance': element['distance']['text'],
+                                'start_address': matrix['origin_addresses'][row_index],
+                                'end_address': matrix['destination_addresses'][col_index],
+                                'summary': '',
+                                'mode': mode
+                            }
+                            self.commute_cache.set(missing[origin][destination], result)
+                        else:
+                            result = self._unavailable(origin, destination, mode)
+                        for i in indexes[origin]:
+                            results[i][destination] = result
+        return results
+    
+    def get_nearest_stations(self, addresses: list) -> list:
+        """批量获取最近火车站步行时间和到各通勤目标的时间，整批只需少量matrix请求
+        
+        使用本地车站索引时，Google只用于地理编码（有缓存）和步行/公共交通时间。
+        """
+        empty = {
+            'station_name': '',
+            'station_addr': '',
+            'walking_time': '',
+            'walking_distance': '',
+            'commutes': {},
+            'to_science_park': None,
+            'to_flux': None
+        }
+        results = [dict(empty) for _ in addresses]
         try:
-            # 1. 最近火车站（步行）
-            stations = self.gmaps.places_nearby(
-                location=self.gmaps.geocode(address)[0]['geometry']['location'],
-                radius=5000,
-                type='train_station',
-                language='nl'
-            )
+            # 1. 最近火车站（步行）：同一车站的起点合并成一次请求
+            by_station = {}
+            for i, address in enumerate(addresses):
+                location = self.geocode(address)
+                station = self._find_station(location) if location else None
+                if station:
+                    results[i]['station_name'] = station['name']
+                    results[i]['station_addr'] = station['vicinity']
+                    by_station.setdefault(station.get('destination', station['name']), []).append(i)
+            for destination, indexes in by_station.items():
+                walks = self.get_commute_matrix([addresses[i] for i in indexes], [destination], mode='walking')
+                for i, walk in zip(indexes, walks):
+                    results[i]['walking_time'] = walk[destination]['duration']
+                    results[i]['walking_distance'] = walk[destination]['distance']
             
-            if stations['results']:
-                nearest = stations['results'][0]
-                station_name = nearest['name']
-                station_addr = nearest.get('vicinity', '')
-                walk = self.get_commute_time(address, station_name, mode='walking')
-            else:
-                station_name = ''
-                station_addr = ''
-                walk = None
-
-            # 2. 到 amsterdam science park station
-            science_park = 'Science Park 904, 1098 XH Amsterdam, Netherlands'
-            commute_science = self.get_commute_time(address, science_park, mode='transit')
-
-            # 3. 到 Eindhoven Station
-            flux_building = 'De Groene Loper 19, 5612 AP Eindhoven, Netherlands'
-            commute_flux = self.get_commute_time(address, flux_building, mode='transit')
-
-            return {
-                'station_name': station_name,
-                'station_addr': station_addr,
-                'walking_time': walk['duration'] if walk else '',
-                'walking_distance': walk['distance'] if walk else '',
-                'to_science_park': commute_science,
-                'to_flux': commute_flux
-            }
+            # 2. 所有起点到所有通勤目标（公共交通）
+            commutes = self.get_commute_matrix(addresses, list(self.commute_targets.values()), mode='transit')
+            for i, row in enumerate(commutes):
+                results[i]['commutes'] = {name: row[target] for name, target in self.commute_targets.items()}
+                results[i]['to_science_park'] = results[i]['commutes'].get('science_park')
+                results[i]['to_flux'] = results[i]['commutes'].get('flux')
             
+            logger.info(f"[Maps] Cache hit rate: {self.cache_stats()['hit_rate']:.1%}")
         except Exception as e:
-            logger.error(f"Error in get_nearest_station: {str(e)}")
-            return {
-                'station_name': '',
-                'station_addr': '',
-                'walking_time': '',
-                'walking_distance': '',
-                'to_science_park': None,
-                'to_flux': None
-            } 
\ No newline at end of file
+            logger.error(f"Error in get_nearest_stations: {str(e)}")
+        return results
+    
+    def get_nearest_station(self, address: str) -> dict:
+        """获取到最近火车站的距离，并查各通勤目标"""
+        return self.get_nearest_stations([address])[0]
+    
+    def cache_stats(self) -> dict:
+        """各类缓存的命中情况及总体命中率"""
+        caches = {
+            'geocode': self.geocode_cache,
+            'nearest_station': self.station_cache,
+            'commute': self.commute_cache
+        }
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        hits = sum(s['hits'] for s in stats.values())
+        total = hits + sum(s['misses'] for s in stats.values())
+        stats['hit_rate'] = hits / total if total else 0.0
+        return stats
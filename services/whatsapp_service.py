@@ -2,50 +2,65 @@ from twilio.rest import Client as TwilioClient
 from utils.logging_config import logger
 from models.house import HouseInfo
 
+# WhatsApp单条消息的最大长度（Twilio限制）
+MAX_MESSAGE_LENGTH = 1600
+
 class WhatsAppService:
     def __init__(self, account_sid: str, auth_token: str, phone_number: str, recipients: list):
         self.client = TwilioClient(account_sid, auth_token)
         self.phone_number = phone_number
         self.recipients = recipients
     
-    def send_house_info(self, house_info: HouseInfo) -> None:
-        """发送房屋信息到WhatsApp"""
-        logger.info("Starting WhatsApp message preparation...")
-        try:
-            # 准备消息内容
-            message = f"🏠 New House Alert!\n\n"
-            message += f"Title: {house_info.title}\n"
-            message += f"Address: {house_info.address}\n"
-            message += f"Price: {house_info.price}\n"
-            message += f"Details: {house_info.size_rooms}\n"
-            message += f"Agent: {house_info.agent}\n"
-            
-            if house_info.nearest_station:
-                station_info = house_info.nearest_station
-                message += f"\n🚉 Nearest Station: {station_info.name}\n"
-                message += f"Distance: {station_info.walking_distance}\n"
-                message += f"Walking Time: {station_info.walking_time}\n"
-            
-            message += f"\n🔗 View Details: {house_info.url}"
-            
-            logger.info(f"Message length: {len(message)} characters")
-            
-            # 发送消息给每个收件人
-            for recipient in self.recipients:
-                try:
-                    logger.info(f"Sending message to: {recipient}")
-                    message = self.client.messages.create(
-                        body=message,
-                        from_=f'whatsapp:{self.phone_number}',
-                        to=recipient
-                    )
-                    logger.info(f"Message sent successfully")
-                    logger.info(f"Message SID: {message.sid}")
-                    logger.info(f"Message status: {message.status}")
-                except Exception as e:
-                    logger.error(f"Failed to send message to {recipient}: {str(e)}")
-                    continue
-                
-        except Exception as e:
-            logger.error(f"Error in WhatsApp message preparation: {str(e)}")
-            raise 
\ No newline at end of file
+    @staticmethod
+    def _score_line(house_info: HouseInfo) -> str:
+        """单条消息和摘要共用的评分行；没有评分时为空"""
+        if house_info.score_percentile is None:
+            return ""
+        return f"Score: better than {house_info.score_percentile:.0f}% of earlier listings\n"
+    
+    def format_message(self, house_info: HouseInfo) -> str:
+        """生成WhatsApp消息正文；所有收件人共用"""
+        message = f"🏠 New House Alert!\n\n"
+        message += f"Title: {house_info.title}\n"
+        message += f"Address: {house_info.address}\n"
+        message += f"Price: {house_info.price}\n"
+        message += f"Details: {house_info.size_rooms}\n"
+        message += f"Agent: {house_info.agent}\n"
+        message += self._score_line(house_info)
+        
+        if house_info.nearest_station:
+            station_info = house_info.nearest_station
+            message += f"\n🚉 Nearest Station: {station_info.name}\n"
+            message += f"Distance: {station_info.walking_distance}\n"
+            message += f"Walking Time: {station_info.walking_time}\n"
+        
+        message += f"\n🔗 View Details: {house_info.url}"
+        return message
+    
+    def digest_chunks(self, house_infos: list) -> list:
+        """把多套房源合并成摘要，超出单条消息长度时拆成几条；返回每条消息及其包含的房源序号：[(正文, [序号])]"""
+        entries = []
+        for house_info in house_infos:
+            entry = f"🏠 {house_info.title}\n{house_info.price} | {house_info.size_rooms}\n"
+            entry += self._score_line(house_info)
+            entry += f"🔗 {house_info.url}\n"
+            entries.append(entry)
+        
+        header = f"🏠 {len(house_infos)} New House Alerts\n\n"
+        messages = [[header, []]]
+        for i, entry in enumerate(entries):
+            if len(messages[-1][0]) + len(entry) + 1 > MAX_MESSAGE_LENGTH:
+                messages.append(['', []])
+            messages[-1][0] += entry + "\n"
+            messages[-1][1].append(i)
+        return [(body.rstrip(), indexes) for body, indexes in messages]
+    
+    def send_message(self, recipient: str, body: str):
+        """发送给单个收件人，失败时抛出异常"""
+        sent = self.client.messages.create(
+            body=body,
+            from_=f'whatsapp:{self.phone_number}',
+            to=recipient
+        )
+        logger.info(f"WhatsApp message to {recipient} sent, SID: {sent.sid}, status: {sent.status}")
+        return sent
@@ -2,68 +2,84 @@ import re
 import requests
 from bs4 import BeautifulSoup
 from utils.logging_config import logger
+from utils.cache import TTLCache
+from utils.metrics import metrics
+
+DAY = 24 * 3600
+ADDRESS_RE = re.compile(r'([A-Za-z\.\-\'\s]+)\s(\d+[A-Za-z]?),?\s*(\d{4}[A-Z]{2})\s+([A-Za-z ]+)')
+
 
 class WOZService:
+    def __init__(self, cache_file: str = 'cache.sqlite3', ttl_days: float = 180, negative_ttl_days: float = 7):
+        # WOZ每年更新一次；查不到的地址也缓存一段时间
+        self.cache = TTLCache(cache_file, 'woz', ttl_days * DAY, negative_ttl=negative_ttl_days * DAY)
+
     def get_woz_info(self, address: str) -> str:
-        """从walterliving.com获取WOZ信息"""
-        logger.info(f"[WOZ] Querying address: {address}")
+        """从walterliving.com获取WOZ信息，按报告地址缓存"""
+        m = ADDRESS_RE.match(address)
+        if not m:
+            logger.error(f"[WOZ] Invalid address format: {address}")
+            return None
+        street = '-'.join(m.group(1).lower().split())
+        house_number = m.group(2).strip().lower()
+        city = m.group(4).strip().lower()
+        # 报告页只由街道、门牌号和城市决定，直接作为缓存key
+        slug = f"{street}-{house_number}-{city}"
         try:
-            m = re.match(r'([A-Za-z\.\-\'\s]+)\s(\d+[A-Za-z]?),?\s*(\d{4}[A-Z]{2})\s+([A-Za-z ]+)', address)
-            if not m:
-                logger.error("[WOZ] Invalid address format")
-                return None
-                
-            street = m.group(1).strip().lower().replace(' ', '-')
-            house_number = m.group(2).strip().lower()
-            city = m.group(4).strip().lower()
-            url = f"https://walterliving.com/report/{street}-{house_number}-{city}"
-            logger.info(f"[WOZ] Generated URL: {url}")
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            return self.cache.get_or_set(slug, lambda: self._fetch(slug))
+        except Exception as e:
+            logger.error(f"[WOZ] Error in WOZ info retrieval: {str(e)}")
+            return None
+
+    @metrics.timed('woz')
+    def _fetch(self, slug: str) -> str:
+        """抓取并解析报告页；没有WOZ数据时返回None，网络错误抛出异常（不缓存）"""
+        url = f"https://walterliving.com/report/{slug}"
+        logger.info(f"[WOZ] Fetching {url}")
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        response = requests.get(url, headers=headers, timeout=15)
+        if response.status_code == 404:
+            logger.info("[WOZ] No report for this address")
+            return None
+        response.raise_for_status()
+
+        soup = BeautifulSoup(response.text, 'html.parser')
+        woz_list = soup.find('ul', class_='group')
+        if not woz_list:
+            logger.error("[WOZ] No WOZ data found")
+            return None
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            woz_list = soup.find('ul', class_='group')
-            if not woz_list:
-                logger.error("[WOZ] No WOZ data found")
-                return None
-                
-            woz_data = []
-            for item in woz_list.find_all('li', class_='timeline-events__item'):
-                try:
-                    woz_type = item.find('span', class_='timeline-events__item__type')
-                    if not woz_type or 'WOZ' not in woz_type.text:
-                        continue
-                        
-                    # 提取年份
-                    year_match = re.search(r'WOZ\s*(\d{4})', woz_type.text)
-                    year = year_match.group(1) if year_match else ''
-                    
-                    # 提取金额
-                    value_div = item.find('div', class_='timeline-events__item__content')
-                    amount_match = re.search(r'€\s*[\d\.]+', value_div.text) if value_div else None
-                    amount = amount_match.group(0) if amount_match else ''
-                    
-                    # 提取百分比
-                    percent_match = re.search(r'(\d{1,2},\d)%', value_div.text) if value_div else None
-                    percent = percent_match.group(1) + '%' if percent_match else ''
-                    
-                    if year and amount:
-                        woz_data.append(f"WOZ {year}: {amount} {f'({percent})' if percent else ''}")
-                except Exception as e:
-                    logger.error(f"[WOZ] Error parsing WOZ item: {str(e)}")
+        woz_data = []
+        for item in woz_list.find_all('li', class_='timeline-events__item'):
+            try:
+                woz_type = item.find('span', class_='timeline-events__item__type')
+                if not woz_type or 'WOZ' not in woz_type.text:
                     continue
                     
-            if not woz_data:
-                logger.error("[WOZ] No valid WOZ data found")
-                return None
+                # 提取年份
+                year_match = re.search(r'WOZ\s*(\d{4})', woz_type.text)
+                year = year_match.group(1) if year_match else ''
+                
+                # 提取金额
+                value_div = item.find('div', class_='timeline-events__item__content')
+                amount_match = re.search(r'€\s*[\d\.]+', value_div.text) if value_div else None
+                amount = amount_match.group(0) if amount_match else ''
                 
-            woz_html = "<ul class='woz-data'>" + ''.join(f"<li>{row}</li>" for row in woz_data) + "</ul>"
-            return woz_html
+                # 提取百分比
+                percent_match = re.search(r'(\d{1,2},\d)%', value_div.text) if value_div else None
+                percent = percent_match.group(1) + '%' if percent_match else ''
+                
+                if year and amount:
+                    woz_data.append(f"WOZ {year}: {amount} {f'({percent})' if percent else ''}")
+            except Exception as e:
+                logger.error(f"[WOZ] Error parsing WOZ item: {str(e)}")
+                continue
+                
+        if not woz_data:
+            logger.error("[WOZ] No valid WOZ data found")
+            return None
             
-        except Exception as e:
-            logger.error(f"[WOZ] Error in WOZ info retrieval: {str(e)}")
-            return None 
\ No newline at end of file
+        woz_html = "<ul class='woz-data'>" + ''.join(f"<li>{row}</li>" for row in woz_data) + "</ul>"
+        return woz_html
@@ -0,0 +1,66 @@
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.email_handler import EmailHandler
+
+
+class FakeMailbox:
+    """只实现增量同步用到的 UID SEARCH：UNSEEN、"UID n:*" 和 "UID *" """
+
+    def __init__(self, uids, unseen=()):
+        self.uids = sorted(uids)
+        self.unseen = set(unseen)
+
+    def noop(self):
+        return 'OK', [b'NOOP completed']
+
+    def uid(self, command, *args):
+        assert command == 'SEARCH', command
+        query = args[-1]
+        if query == 'UID *':
+            found = self.uids[-1:]
+        else:
+            m = re.search(r'UID (\d+):\*', query)
+            found = ([uid for uid in self.uids if uid >= int(m.group(1))] or self.uids[-1:]) if m else self.uids
+            if 'UNSEEN' in query:
+                found = [uid for uid in found if uid in self.unseen]
+        return 'OK', [' '.join(str(uid) for uid in found).encode()]
+
+
+class FirstSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.handler = EmailHandler('bot@example.com', 'secret',
+                                    state_file=os.path.join(self.tmp.name, 'imap_state.json'))
+        self.handler._uidvalidity = '1'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def use(self, mailbox):
+        self.handler._mail = mailbox
+        self.handler._fetch_html_parts = lambda mail, uids: ({}, {})
+
+    def test_no_unseen_mail_does_not_replay_history(self):
+        self.use(FakeMailbox(range(1, 6)))
+        self.assertEqual(self.handler.fetch_new_batch(), [])
+        self.assertEqual(self.handler.state.last_uid, 5)
+        # 第二个周期没有新邮件，不能按 "UID 1:*" 取回全部历史
+        self.assertEqual(self.handler.fetch_new_batch(), [])
+
+    def test_only_unseen_and_newer_mail_is_processed(self):
+        mailbox = FakeMailbox(range(1, 6), unseen={3})
+        self.use(mailbox)
+        self.assertEqual([uid for uid, _ in self.handler.fetch_new_batch()], [3])
+        self.handler.commit(3, [3])
+        mailbox.uids.append(6)
+        self.assertEqual([uid for uid, _ in self.handler.fetch_new_batch()], [6])
+
+
+if __name__ == '__main__':
+    unittest.main()
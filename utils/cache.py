@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+import time
+from utils.logging_config import logger
+
+_MISSING = object()
+
+
+class _InFlight:
+    """正在加载的一个key：其他线程等待它完成并共用结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """基于SQLite的持久化缓存，带过期时间；同一个文件可以按namespace存放多种数据
+
+    设置 negative_ttl 时，"未找到"（空结果）也会缓存这么久，避免反复查询不存在的数据。
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: float, negative_ttl: float = None):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        # 等待其他线程的同一查询而没有自己加载的次数
+        self.shared = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def _read(self, key: str):
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING
+        return row[0]
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            value = self._read(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value, ttl: float = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+
+    def get_or_set(self, key: str, loader, ttl: float = None):
+        """命中则直接返回；否则调用loader并缓存非空结果（设置了negative_ttl时空结果也缓存）
+
+        同一个key同时只有一个线程调用loader，其他线程等待并共用它的结果或异常；
+        loader抛出的异常不缓存。
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is None:
+                # 等锁期间其他线程可能刚写入
+                value = self._read(key)
+                if value is not _MISSING:
+                    return json.loads(value)
+                call = self._inflight[key] = _InFlight()
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            value = call.value = loader()
+            if value:
+                self.set(key, value, ttl)
+            elif self.negative_ttl:
+                self.set(key, value, self.negative_ttl)
+            return value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (self.namespace, time.time())
+            ).rowcount
+        if deleted:
+            logger.info(f"[Cache] Purged {deleted} expired '{self.namespace}' entries")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'shared': self.shared, 'hit_rate': self.hit_rate}
@@ -4,23 +4,131 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+def _optional_int(name):
+    value = os.getenv(name, '').strip()
+    return int(value) if value else None
+
 class Config:
     # Email配置
     EMAIL = os.getenv('EMAIL')
     EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+    # 使用IMAP IDLE推送；IDLE每隔IDLE_TIMEOUT秒续期，不支持时每POLL_INTERVAL秒轮询一次
+    IMAP_IDLE = os.getenv('IMAP_IDLE', 'true').lower() == 'true'
+    IDLE_TIMEOUT = float(os.getenv('IDLE_TIMEOUT', '300'))
+    POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '10'))
+    # 增量同步状态文件（UIDVALIDITY和已处理的最高UID）
+    IMAP_STATE_FILE = os.getenv('IMAP_STATE_FILE', 'imap_state.json')
     
     # Makelaarsland配置
     MAKELAARSLAND_USERNAME = os.getenv('MAKELAARSLAND_USERNAME')
     MAKELAARSLAND_PASSWORD = os.getenv('MAKELAARSLAND_PASSWORD')
     
+    # 浏览器池配置：同时保留的Chrome数量，以及每个浏览器最多加载多少页后回收
+    BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '1'))
+    BROWSER_MAX_PAGES = int(os.getenv('BROWSER_MAX_PAGES', '50'))
+    # 是否优先用HTTP请求获取详情页（cookie有效时跳过Selenium）
+    HTTP_DETAIL_FETCH = os.getenv('HTTP_DETAIL_FETCH', 'true').lower() == 'true'
+    
+    # 按比例（0-1）抽样保存原始详情页到目录中，用于排查解析问题；0表示不保存
+    DEBUG_DUMP_RATE = float(os.getenv('DEBUG_DUMP_RATE', '0'))
+    DEBUG_DUMP_DIR = os.getenv('DEBUG_DUMP_DIR', 'debug_pages')
+    
+    # 已处理房源索引（按对象ID/地址去重，SQLite）；指向旧的 .json 文件时改用同名 .db 并导入
+    LISTING_INDEX_FILE = os.getenv('LISTING_INDEX_FILE', 'listing_index.db')
+    
+    # 预筛选：不满足条件的房源直接归档，不抓取详情页、不查询外部服务；留空表示不限制
+    PREFILTER_MIN_PRICE = _optional_int('PREFILTER_MIN_PRICE')
+    PREFILTER_MAX_PRICE = _optional_int('PREFILTER_MAX_PRICE')
+    PREFILTER_MIN_AREA = _optional_int('PREFILTER_MIN_AREA')
+    PREFILTER_MIN_ROOMS = _optional_int('PREFILTER_MIN_ROOMS')
+    # 逗号分隔的邮编前缀和城市
+    PREFILTER_POSTCODES = os.getenv('PREFILTER_POSTCODES', '')
+    PREFILTER_CITIES = os.getenv('PREFILTER_CITIES', '')
+    PREFILTER_EXCLUDE_CITIES = os.getenv('PREFILTER_EXCLUDE_CITIES', '')
+    # 到最近通勤目标的最长时间（分钟），在抓取详情页之前用地图结果检查
+    PREFILTER_MAX_COMMUTE = _optional_int('PREFILTER_MAX_COMMUTE')
+    
+    # GitHub Pages发布：把该窗口（秒）内的修改合并成一次commit和push；设为0则每套房源同步推送
+    GIT_PUSH_WINDOW = float(os.getenv('GIT_PUSH_WINDOW', '30'))
+    
+    # 通知配置：同时发送的WhatsApp消息数、邮件合并窗口（秒）、每条通知的最多尝试次数
+    WHATSAPP_CONCURRENCY = int(os.getenv('WHATSAPP_CONCURRENCY', '4'))
+    EMAIL_BATCH_WINDOW = float(os.getenv('EMAIL_BATCH_WINDOW', '2'))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+    # 摘要模式：每分钟超过该数量的房源时，把 DIGEST_WINDOW 秒内的房源合并为每个收件人一条摘要；0表示关闭
+    DIGEST_RATE = int(os.getenv('DIGEST_RATE', '5'))
+    DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', '120'))
+    
+    # 指标接口：只监听本机，端口设为0或留空则关闭
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108') or 0)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    
+    # 批量处理配置：同时处理的房源数
+    BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+    # 持久化任务队列：文件、租约时长（秒，持有者崩溃后任务在此之后由其他工作者接手）、最多尝试次数
+    JOB_QUEUE_FILE = os.getenv('JOB_QUEUE_FILE', 'jobs.db')
+    JOB_LEASE = float(os.getenv('JOB_LEASE', '300'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+    
+    # 并发查询配置：线程数和单个查询的超时时间（秒）；每个房源约占5个线程
+    ENRICHMENT_WORKERS = int(os.getenv('ENRICHMENT_WORKERS', '20'))
+    ENRICHMENT_TIMEOUT = float(os.getenv('ENRICHMENT_TIMEOUT', '30'))
+    DETAIL_TIMEOUT = float(os.getenv('DETAIL_TIMEOUT', '90'))
+    
+    # 房源打分权重，格式：特征=权重,特征=权重；未列出的特征使用默认权重
+    # 特征：price_per_m2, price_vs_woz, commute_penalty, walk_penalty, rooms
+    SCORE_WEIGHTS = os.getenv('SCORE_WEIGHTS', '')
+    # 每新增多少套房源重新拟合一次打分参数和分位数表
+    SCORE_REFIT_EVERY = int(os.getenv('SCORE_REFIT_EVERY', '100'))
+    
     # Google Maps配置
     GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
+    # 经纬度网格精度（小数位数），同一网格内的房源共享车站和通勤结果
+    MAPS_CELL_PRECISION = int(os.getenv('MAPS_CELL_PRECISION', '3'))
+    
+    # 本地火车站数据（离线查找最近车站），默认不启用，使用Google places_nearby。
+    # 需要完整的车站列表：自带的 data/stations.json 只有主要车站，启用时会把更近的非索引车站换成较远的索引车站；
+    # 最近的索引车站超过 STATION_INDEX_MAX_KM 公里时仍调用places_nearby
+    STATIONS_FILE = os.getenv('STATIONS_FILE', '')
+    STATION_INDEX_MAX_KM = float(os.getenv('STATION_INDEX_MAX_KM', '3'))
+    
+    # 通勤目标，格式：名称=地址;名称=地址
+    COMMUTE_TARGETS = os.getenv(
+        'COMMUTE_TARGETS',
+        'science_park=Science Park 904, 1098 XH Amsterdam, Netherlands;'
+        'flux=De Groene Loper 19, 5612 AP Eindhoven, Netherlands'
+    )
+    
+    # 本地持久化缓存文件
+    CACHE_FILE = os.getenv('CACHE_FILE', 'cache.sqlite3')
+    # WOZ、移民指数查询结果的缓存天数；"未找到"的结果缓存较短时间
+    WOZ_CACHE_DAYS = float(os.getenv('WOZ_CACHE_DAYS', '180'))
+    IMMIGRATION_CACHE_DAYS = float(os.getenv('IMMIGRATION_CACHE_DAYS', '90'))
+    NEGATIVE_CACHE_DAYS = float(os.getenv('NEGATIVE_CACHE_DAYS', '7'))
     
     # Twilio配置
     TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
     TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
     TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
     
+    @classmethod
+    def get_commute_targets(cls):
+        targets = {}
+        for item in cls.COMMUTE_TARGETS.split(';'):
+            name, sep, address = item.partition('=')
+            if sep and name.strip() and address.strip():
+                targets[name.strip()] = address.strip()
+        return targets
+    
+    @classmethod
+    def get_score_weights(cls):
+        weights = {}
+        for item in cls.SCORE_WEIGHTS.split(','):
+            name, sep, weight = item.partition('=')
+            if sep and name.strip():
+                weights[name.strip()] = float(weight)
+        return weights
+    
     # WhatsApp收件人配置
     @classmethod
     def get_whatsapp_recipients(cls):
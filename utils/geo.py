@@ -0,0 +1,81 @@
+import json
+import math
+from utils.logging_config import logger
+
+EARTH_RADIUS_KM = 6371.0
+# 每度纬度对应的公里数
+KM_PER_DEGREE = 111.32
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """两点之间的大圆距离（公里）"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationIndex:
+    """本地火车站数据的网格空间索引，离线返回按直线距离排序的最近车站"""
+
+    def __init__(self, stations: list, cell_degrees: float = 0.05, max_rings: int = 40, complete: bool = True):
+        self.stations = stations
+        # 数据不完整时，索引中缺少的更近车站会被较远的索引车站取代
+        self.complete = complete
+        self.cell = cell_degrees
+        self.max_rings = max_rings
+        self.grid = {}
+        for station in stations:
+            self.grid.setdefault(self._cell_of(station['lat'], station['lng']), []).append(station)
+        max_lat = max((abs(s['lat']) for s in stations), default=0.0)
+        # 一个网格在任意方向上的最小宽度（公里），用于判断何时可以停止向外搜索
+        self._cell_km = self.cell * KM_PER_DEGREE * math.cos(math.radians(min(max_lat + self.cell, 89.0)))
+
+    @classmethod
+    def load(cls, path: str) -> 'StationIndex':
+        """读取车站数据：JSON 数组，或 {"complete": false, "stations": [...]}（标明不是完整的车站列表）"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        stations, complete = (data, True) if isinstance(data, list) else (data['stations'], data.get('complete', True))
+        logger.info(f"[StationIndex] Loaded {len(stations)} stations from {path}")
+        if not complete:
+            logger.warning(f"[StationIndex] {path} is not a complete station list: a station missing from it "
+                           f"will be replaced by a farther indexed one within STATION_INDEX_MAX_KM")
+        return cls(stations, complete=complete)
+
+    def _cell_of(self, lat: float, lng: float) -> tuple:
+        return math.floor(lat / self.cell), math.floor(lng / self.cell)
+
+    def _ring(self, center: tuple, radius: int):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for dc in range(-radius, radius + 1):
+            yield row - radius, col + dc
+            yield row + radius, col + dc
+        for dr in range(-radius + 1, radius):
+            yield row + dr, col - radius
+            yield row + dr, col + radius
+
+    def nearest(self, lat: float, lng: float, k: int = 1) -> list:
+        """返回最近的k个车站：[(距离公里, 车站)]，按距离升序"""
+        if not self.stations:
+            return []
+        k = min(k, len(self.stations))
+        center = self._cell_of(lat, lng)
+        found = []
+        radius = 0
+        while radius <= self.max_rings:
+            for cell in self._ring(center, radius):
+                for station in self.grid.get(cell, ()):
+                    found.append((haversine_km(lat, lng, station['lat'], station['lng']), station))
+            # 第radius圈之外的车站距离至少为 radius 个网格宽度
+            if len(found) >= k:
+                found.sort(key=lambda item: item[0])
+                if found[k - 1][0] <= radius * self._cell_km or len(found) == len(self.stations):
+                    return found[:k]
+            radius += 1
+        # 离所有车站都很远（如国外地址），直接全量计算
+        found = [(haversine_km(lat, lng, s['lat'], s['lng']), s) for s in self.stations]
+        found.sort(key=lambda item: item[0])
+        return found[:k]
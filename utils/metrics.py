@@ -0,0 +1,193 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.logging_config import logger
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 每个阶段在一个周期内最多保留的样本数，用于周期摘要中的中位数和最大值
+MAX_CYCLE_SAMPLES = 10000
+
+
+class Histogram:
+    """累计的耗时直方图：各桶计数、总次数和总耗时"""
+
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float):
+        """按桶估计分位数（返回所在桶的上界）；落在最后一个桶（超过 BUCKETS[-1]）时没有上界，返回None
+
+        不返回 inf：/metrics.json 中的 Infinity 不是合法的JSON，None 输出为 null。
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.buckets))
+        }
+
+
+class Metrics:
+    """各阶段的耗时直方图和计数器
+
+    累计值通过本地HTTP接口导出（Prometheus文本格式或JSON）；周期摘要只统计上次摘要之后的样本。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self._cycle = {}
+        self._cycle_counters = {}
+        self._server = None
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            samples = self._cycle.setdefault(name, [])
+            if len(samples) < MAX_CYCLE_SAMPLES:
+                samples.append(seconds)
+
+    def inc(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self._cycle_counters[name] = self._cycle_counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str):
+        """记录代码块的耗时；抛出异常时另外计入 <name>_errors"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f'{name}_errors')
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """装饰器形式的 timer"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'histograms': {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f'bouwbot_{name}_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for bound, n in zip([str(b) for b in BUCKETS] + ['+Inf'], histogram.buckets):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum {histogram.sum:.6f}')
+                lines.append(f'{metric}_count {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE bouwbot_{name}_total counter')
+                lines.append(f'bouwbot_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def cycle_summary(self) -> str:
+        """上次调用之后各阶段的次数、中位数和最大耗时，以及计数器增量；没有数据时返回空字符串"""
+        with self._lock:
+            cycle, self._cycle = self._cycle, {}
+            counters, self._cycle_counters = self._cycle_counters, {}
+        parts = []
+        for name, samples in sorted(cycle.items()):
+            samples.sort()
+            parts.append(f"{name} {len(samples)}x p50={_format_seconds(samples[len(samples) // 2])} "
+                         f"max={_format_seconds(samples[-1])}")
+        parts.extend(f"{name}={value}" for name, value in sorted(counters.items()))
+        return '; '.join(parts)
+
+    def start_server(self, port: int, host: str = '127.0.0.1'):
+        """在后台线程中提供 /metrics（Prometheus文本格式）和 /metrics.json
+
+        端口被占用（另一个实例、重启时旧连接未释放）时只记录警告并返回None，不影响主流程。
+        """
+        if self._server is not None:
+            return self._server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.render_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot(), indent=2), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.warning(f"[Metrics] Cannot listen on {host}:{port} ({str(e)}), continuing without the metrics endpoint")
+            return None
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        logger.info(f"[Metrics] Serving metrics on http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _format_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+# 全局实例
+metrics = Metrics()